@@ -4,6 +4,8 @@ from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER
 from ryu.controller.handler import set_ev_cls
 from ryu.ofproto import ofproto_v1_3
 from ryu.controller import dpset
+from ryu.lib import hub
+from eventlet.hubs import trampoline
 
 from util.RyuOpenFlow import OpenFlow
 
@@ -26,6 +28,25 @@ class EdgeMainRyu(app_manager.RyuApp):
         self.logger.name = "Edge"
         self.ctrl = EdgeController(self.logger)
 
+        self.threads.append(hub.spawn(self._mainLoop))
+        if self.ctrl.statsInterval:
+            self.threads.append(hub.spawn(self._housekeeping))
+
+    def _mainLoop(self):
+        #
+        # Executes the work handed over from other threads (e.g., flow setup after a deployment) in the hub's loop.
+        #
+        queue = self.ctrl.mainLoop
+        while True:
+            trampoline(queue.fileno(), read=True)  # green-thread-aware wait for the wakeup
+            queue.drain()
+
+    def _housekeeping(self):
+
+        while True:
+            hub.sleep(self.ctrl.statsInterval)
+            self.ctrl.housekeeping()
+
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
 
@@ -34,7 +55,10 @@ class EdgeMainRyu(app_manager.RyuApp):
     @set_ev_cls(dpset.EventDP, MAIN_DISPATCHER)
     def _event_dp_handler(self, ev):
 
-        self.ctrl.connected(OpenFlow(ev), ev.ports)
+        if ev.enter:
+            self.ctrl.connected(OpenFlow(ev), ev.ports)
+        else:
+            self.ctrl.disconnected(OpenFlow(ev))
 
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
@@ -54,3 +78,8 @@ class EdgeMainRyu(app_manager.RyuApp):
     def aggregate_stats_reply_handler(self, ev):
 
         self.ctrl.aggregateStats(OpenFlow(ev))
+
+    @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
+    def flow_stats_reply_handler(self, ev):
+
+        self.ctrl.flowStats(OpenFlow(ev))
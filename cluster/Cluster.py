@@ -2,6 +2,7 @@ from __future__ import annotations
 
 from util.K8sService import K8sService
 from util.Service import ServiceInstance
+from util.SocketAddr import SocketAddr
 
 from collections import defaultdict
 from abc import ABC, abstractmethod  # abstract base class
@@ -12,10 +13,22 @@ class Cluster(ABC):
     Base class for different kinds of clusters.
     """
 
+    # Limits of the (pooled) API client per cluster: the same for all cluster types, so that a burst of deployments
+    # cannot overwhelm the API server of an edge.
+    #
+    API_DEFAULTS = {
+        "maxConnections": 10,  # concurrent requests (connections kept in the pool)
+        "keepAlive": True,  # reuse connections (HTTP keep-alive)
+        "timeout": 60  # seconds per request
+    }
+
     @staticmethod
-    def init(clusterType: str, apiServer: str, cfgFilename: str) -> Cluster:
+    def init(clusterType: str, apiServer: str, cfgFilename: str, cfg: dict = None) -> Cluster:
         """
         Factory method to allow different kinds of clusters.
+
+        cfg: Options per cluster type, e.g. {"docker": {"warmPool": {...}}, "k8s": {...}}. The "api" options apply to
+            all cluster types (unless overridden per type; see API_DEFAULTS).
         """
 
         if clusterType == 'k8s':
@@ -27,7 +40,11 @@ class Cluster(ABC):
         else:
             return None
 
-        return cluster(apiServer, cfgFilename)
+        cfg = cfg or {}
+        typeCfg = dict(cfg.get(clusterType, {}))
+        typeCfg["api"] = {**cfg.get("api", {}), **typeCfg.get("api", {})}
+
+        return cluster(apiServer, cfgFilename, cfg=typeCfg)
 
     @staticmethod
     def initService(service=None, label=None, port=None, filename=None, yml: dict = None):
@@ -66,10 +83,53 @@ class Cluster(ABC):
                 self._log.info("Scaling down to zero: " + str(svc))
                 self._scale(svc, replicas)
 
+    def rescale(self, svc: ServiceInstance, replicas: int):
+        """
+        Changes the number of replicas of a running service instance (autoscaling). Returns when the new replicas are
+        ready.
+        """
+        assert (svc and replicas)
+        self._log.info(f"Scaling to {replicas} replicas: {str(svc)}")
+        self._rescale(svc, replicas)
+
     @abstractmethod
     def _scale(self, svc: ServiceInstance, replicas: int = 1):
         pass
 
+    def _rescale(self, svc: ServiceInstance, replicas: int):
+        self._scale(svc, replicas)
+
+    def isPaused(self, svc: ServiceInstance) -> bool:
+        """
+        True if the scaled-down instance still holds its memory (e.g., paused Docker containers; see reclaim()).
+        """
+        return False
+
+    def reclaim(self, svc: ServiceInstance):
+        """
+        Frees the memory still held by a scaled-down instance (e.g., stops its paused containers).
+        """
+        pass
+
+    @staticmethod
+    def apiCfg(cfg: dict) -> dict:
+        """
+        Returns the API client options from the cluster config (with defaults).
+        """
+        return {**Cluster.API_DEFAULTS, **(cfg or {}).get("api", {})}
+
+    def prePull(self, images: list[str], timeout=300):
+        """
+        Pulls the images onto the node(s) of the cluster (blocking). Not supported by default.
+        """
+        pass
+
+    def replicaAddrs(self, svc: ServiceInstance) -> list[SocketAddr]:
+        """
+        Returns the cluster addresses of all running replicas of the service instance.
+        """
+        return [svc.clusterAddr] if svc.clusterAddr else []
+
     def _toMap(self, label, rawFunc, func):
 
         items = rawFunc(label)
@@ -7,12 +7,19 @@ from util.Service import Deployment, ServiceInstance, Service
 from util.K8sService import K8sService
 from util.SocketAddr import SocketAddr
 from cluster.Cluster import Cluster
+from cluster.DockerContainerCache import DockerContainerCache
+from cluster.DockerWarmPool import DockerWarmPool
 from concurrent.futures import ThreadPoolExecutor as PoolExecutor
+from functools import partial
 
 from logging import WARNING, getLogger
 
 from util.Performance import PerfCounter
 
+from threading import Event, Lock, Thread
+from time import sleep, time
+from uuid import uuid4
+
 import tempfile
 import os
 
@@ -20,6 +27,15 @@ import os
 class DockerCluster(Cluster):
     """
     Interface to a single Docker cluster.
+
+    Config (all optional):
+        "events": Cache the containers locally (default: true; see DockerContainerCache).
+        "warmPool": {"enabled": false, ...} (see DockerWarmPool)
+        "scaleMode": "stop" (default) | "pause": Scale down to zero by pausing the containers (cgroup freezer) instead
+            of stopping them. Memory stays allocated, but a scale-up resumes within milliseconds (no restart).
+        "pausedTimeout": Stop containers paused for longer than this to reclaim their memory (default: 600 seconds;
+            0: never).
+        "api": {"maxConnections": 10, "keepAlive": true, "timeout": 60} (see Cluster.API_DEFAULTS)
     """
 
     def __init__(self,
@@ -28,14 +44,15 @@ class DockerCluster(Cluster):
                  namespace="edge",
                  labelName="edge.service",
                  labelPort="edge.port",
-                 log=None):
+                 log=None,
+                 client=None,
+                 cfg: dict = None):
 
         self._ip = IPAddr(apiServer.split(":")[0])
         self._namespace = namespace
         self._labelName = labelName
         self._labelPort = labelPort
         self._log = log
-        self._executor = PoolExecutor()
 
         if self._log is None:
             self._log = getLogger("Docker." + str(self._ip))
@@ -44,20 +61,104 @@ class DockerCluster(Cluster):
         getLogger("urllib3").setLevel(WARNING)
         getLogger("docker").setLevel(WARNING)
 
-        self._client = docker.from_env()
+        cfg = cfg or {}
+        self._apiCfg = self.apiCfg(cfg)
+        self._client = client or self._apiClient(self._apiCfg, 1 if cfg.get("events", True) else 0)
+        self._executor = PoolExecutor(max_workers=self._apiCfg["maxConnections"])  # containers of a deployment
+
+        # local cache of our containers (events stream): no Docker API requests per lookup
+        self._cache = None
+        if cfg.get("events", True):
+            self._cache = DockerContainerCache(self._log, self._client, labelName, self._toServices)
+
+        self._pool = DockerWarmPool(self._log, cfg.get("warmPool", {}), self._createPoolEntry, self._removeContainer)
+
+        self.scaleMode = cfg.get("scaleMode", "stop")
+        self.pausedTimeout = cfg.get("pausedTimeout", 600)
+        self._pauseLock = Lock()
+        self._paused = {}  # container ID -> (container, timestamp)
+        self._reclaiming = {}  # container ID -> Event: being stopped (paused for too long)
 
         # TODO Implement remote access:
         # https://stackoverflow.com/questions/38286564/docker-tls-verify-docker-host-and-docker-cert-path-on-ubuntu
         #
         # client = docker.DockerClient(base_url='tcp://127.0.0.1:1234')
 
+    def _apiClient(self, apiCfg: dict, numStreams=0):
+        """
+        Docker client with a connection pool of `maxConnections` (plus one per event stream, which keeps its
+        connection). Event streams are not subject to the request timeout.
+        """
+        client = docker.from_env(max_pool_size=apiCfg["maxConnections"] + numStreams, timeout=apiCfg["timeout"] or None)
+        for adapter in client.api.adapters.values():
+            self._blockingPool(adapter)
+        if not apiCfg["keepAlive"]:
+            client.api.headers["Connection"] = "close"
+        return client
+
+    @staticmethod
+    def _blockingPool(adapter):
+        #
+        # By default, a full pool opens additional connections (and discards them afterwards): max_pool_size is not a
+        # limit. With block=True, requests wait for a free connection instead.
+        #
+        if not hasattr(adapter, "pools"):  # requests.HTTPAdapter (TCP)
+            adapter.poolmanager.connection_pool_kw["block"] = True
+            return
+
+        getConnection = adapter.get_connection  # docker's adapters (unix socket, named pipe, SSH)
+
+        def blockingConnection(*args, **kwargs):
+            pool = getConnection(*args, **kwargs)
+            pool.block = True
+            return pool
+
+        adapter.get_connection = blockingConnection
+
     def connect(self):
-        pass
+
+        if self._cache is not None:
+            self._cache.start()
+            if not self._cache.waitSynced(timeout=30):
+                self._log.warn("Container cache not synced yet: using the Docker API directly.")
+
+        if self.scaleMode == "pause":
+            for cont in self.rawServices():  # paused before we started: count from now on
+                if cont.status == "paused":
+                    self._paused[cont.id] = (cont, time())
+            if self.pausedTimeout:
+                Thread(target=self._reclaimPaused, name="DockerReclaim", daemon=True).start()
+
+        if self._pool.enabled:
+            # pool entries of a previous run are unknown to us
+            for cont in self._getItems(None, self._client.containers.list, pool=True):
+                self._removeContainer(cont)
+            self._pool.start()
 
     def deploy(self, serviceDef: K8sService):
 
         assert (serviceDef and serviceDef.yaml)
 
+        startTime_s = time()
+        perf = PerfCounter()
+
+        entry = self._pool.claim(serviceDef) if serviceDef.replicas else None
+        if entry:
+            containers = self._startPoolEntry(serviceDef, entry)
+        else:
+            containers = self._createContainers(serviceDef, run=bool(serviceDef.replicas))
+            if containers is None:
+                return None
+
+        self._log.warn(f'#perf{"Pool" if entry else "Cold"}Deploy: {{"svc":"{str(serviceDef)}", ' +
+                       f'"total":{round(perf.ms())}, "ts":{startTime_s}}}')
+
+        svc = self._apiResponseToService(containers[0])  # REVIEW port from first container only
+        svc.containers = containers
+        return svc
+
+    def _createContainers(self, serviceDef: K8sService, run: bool, namePrefix: str = None) -> list:
+
         containers = []
         futures = []
         hostPaths = serviceDef.volumes()
@@ -80,10 +181,10 @@ class DockerCluster(Cluster):
 
         # if more than one container: launch in separate thread
         for cont in contTodo[1:]:
-            futures.append(self._executor.submit(self._deployFunc, serviceDef, cont, hostPaths))
+            futures.append(self._executor.submit(self._deployFunc, serviceDef, cont, hostPaths, run, namePrefix))
 
         # launch first container in current thread (there must be at least one container!)
-        containers.append(self._deployFunc(serviceDef, contTodo[0], hostPaths))
+        containers.append(self._deployFunc(serviceDef, contTodo[0], hostPaths, run, namePrefix))
         if len(contTodo) > 1:
             self._log.info(f"Service <{ str(serviceDef) }>: First container deployed ({ round(perf.ms()) } ms).")
 
@@ -91,17 +192,49 @@ class DockerCluster(Cluster):
         for future in futures:
             containers.append(future.result())
 
-        self._log.info(f"Service <{ str(serviceDef) }> deployed ({ round(perf.ms()) } ms).")
+        self._log.info(f"Service <{ str(serviceDef) }> {'deployed' if not namePrefix else 'pooled'} " +
+                       f"({ round(perf.ms()) } ms).")
+        return containers
 
-        svc = self._apiResponseToService(containers[0])  # REVIEW port from first container only
-        svc.containers = containers
-        return svc
+    def _createPoolEntry(self, serviceDef: K8sService, namePrefix: str, paused: bool) -> list:
+        #
+        # NOTE: Called in the pool's thread.
+        #
+        containers = self._createContainers(serviceDef, run=False, namePrefix=namePrefix)
+        if containers and paused:
+            for cont in containers:
+                cont.start()
+                cont.pause()
+                cont.reload()  # get the auto-assigned ports (and status)
+        return containers
+
+    def _startPoolEntry(self, serviceDef: K8sService, containers: list) -> list:
+
+        for cont in containers:
+            cont.rename(f"{Service.uniqueName(serviceDef.label)}-{cont.id[:12]}")  # visible as service instance now
+            if cont.status == 'paused':
+                cont.unpause()
+            else:
+                cont.start()
+            cont.reload()  # current status and name (and the auto-assigned ports after a start)
+        return containers
+
+    def _removeContainer(self, cont):
+
+        try:
+            cont.remove(force=True)
+        except Exception as e:
+            self._log.warn(f"Failed to remove container {cont.name}: {e}")
 
     def _scale(self, svc: ServiceInstance, replicas: int):
         #
         # NOTE: If svc is running already, this method won't be called (see Cluster.scale()).
 
         futures = []
+        startTime_s = time()
+        perf = PerfCounter()
+        with self._pauseLock:
+            resumed = svc.containers[0].id in self._paused
 
         # if more than one container: launch in separate thread
         for cont in svc.containers[1:]:
@@ -116,10 +249,95 @@ class DockerCluster(Cluster):
         for future in futures:
             svc.deployment = svc.deployment or future.result()  # in case port is in another container
 
+        # set once after all threads are done: the first container with ports (not whichever finished last)
+        if svc.deployment:
+            cont = next(cont for cont in svc.containers if cont.ports)
+            svc.clusterAddr = SocketAddr(self._ip, self._getLocalPort(cont))  # REVIEW For K8s in K8sService
+
+        # more than one replica: clone the container(s) with the service port
+        #
+        if replicas > 1 and svc.deployment:
+            self._addReplicas(svc, replicas)
+
         if replicas and (not svc.deployment or not svc.deployment.ready_replicas):
             self._log.error("Failed to scale: " + str(svc))
 
-    def _deployFunc(self, serviceDef, cont, hostPaths):
+        if replicas:  # scale-up latency per mode: unpause vs. (re)start
+            self._log.warn(f'#perf{"Unpause" if resumed else "Start"}: {{"svc":"{str(svc.service)}", ' +
+                           f'"total":{round(perf.ms())}, "ts":{startTime_s}}}')
+
+    def _rescale(self, svc: ServiceInstance, replicas: int):
+
+        if replicas > len(self.replicaAddrs(svc)):
+            self._addReplicas(svc, replicas)
+        else:
+            self._removeReplicas(svc, replicas)
+
+    def _removeReplicas(self, svc: ServiceInstance, replicas: int):
+        #
+        # The last replicas are removed (same order as replicaAddrs()); the first one is never removed.
+        #
+        portConts = [cont for cont in svc.containers if self._hasPorts(cont)]
+        for cont in portConts[max(1, replicas):]:
+            try:
+                cont.stop()
+                cont.remove()
+                svc.containers.remove(cont)
+            except Exception as e:
+                self._log.error(f"Failed to remove replica {cont.name} of {str(svc)}: {e}")
+
+        numReplicas = len(self.replicaAddrs(svc))
+        svc.deployment = Deployment(numReplicas, numReplicas)
+
+    def _addReplicas(self, svc: ServiceInstance, replicas: int):
+        #
+        # NOTE: Sidecar containers (without ports) are shared by all replicas.
+        #
+        portConts = [cont for cont in svc.containers if self._hasPorts(cont)]
+        if not len(portConts):
+            return
+
+        futures = [self._executor.submit(self._cloneFunc, portConts[0]) for _ in range(replicas - len(portConts))]
+        for future in futures:
+            try:
+                svc.containers.append(future.result())
+            except Exception as e:
+                self._log.error(f"Failed to add replica for {str(svc)}: {e}")
+
+        numReplicas = len(self.replicaAddrs(svc))
+        svc.deployment = Deployment(numReplicas, numReplicas)
+
+    def _cloneFunc(self, cont):
+
+        cfg = cont.attrs['Config']
+        cont = self._client.containers.run(cfg['Image'],
+                                           command=cfg.get('Cmd'),
+                                           detach=True,
+                                           labels=cont.labels,
+                                           ports={port: None
+                                                  for port in cfg.get('ExposedPorts') or {}},
+                                           volumes=cont.attrs['HostConfig'].get('Binds') or [],
+                                           publish_all_ports=False)
+        cont.reload()  # get the auto-assigned ports
+        return cont
+
+    def prePull(self, images: list[str], timeout=300):
+
+        for image in images:
+            try:
+                self._client.images.pull(image)
+            except Exception as e:
+                self._log.warn(f"Failed to pull {image}: {e}")
+
+    def replicaAddrs(self, svc: ServiceInstance) -> list[SocketAddr]:
+
+        return [SocketAddr(self._ip, self._getLocalPort(cont)) for cont in svc.containers if self._hasPorts(cont)]
+
+    def _hasPorts(self, container):
+
+        return container.ports and any(container.ports.values())  # running with published ports
+
+    def _deployFunc(self, serviceDef, cont, hostPaths, run: bool, namePrefix: str = None):
 
         # generate volume mounts list
         #
@@ -129,9 +347,12 @@ class DockerCluster(Cluster):
         contCommand = list(cont.command) if cont.command else []  # _copy_ list
         contCommand.extend(cont.args or [])
 
-        func = self._client.containers.run if serviceDef.replicas else self._client.containers.create
+        func = self._client.containers.run if run else self._client.containers.create
+        if not run:
+            func = partial(self._createFunc, func)
         cont = func(
             cont.image,
+            name=f"{namePrefix}{Service.uniqueName(serviceDef.label)}-{uuid4().hex[:8]}" if namePrefix else None,
             command=contCommand,
             # auto_remove=True,  # we want to keep them after scaling down to zero
             detach=True,
@@ -151,29 +372,126 @@ class DockerCluster(Cluster):
         # for line in containers[-1].logs(stream=True):  #, follow=False):
         #     self._log.debug(line.strip())
 
-        if serviceDef.replicas:
+        if run:
             # update attrs to get the new auto-assigned ports
             # ports are assigned only on run, not on create!
             cont.reload()
         return cont
 
+    def _createFunc(self, createFunc, image, **kwargs):
+        #
+        # Unlike run, create does not pull missing images.
+        #
+        try:
+            return createFunc(image, **kwargs)
+        except docker.errors.ImageNotFound:
+            self._client.images.pull(image)
+            return createFunc(image, **kwargs)
+
     def _scaleFunc(self, svc, replicas, cont):
         if replicas:
-            cont.start()
-            # update attrs to get the new auto-assigned ports
-            # ports are assigned only on run, not on create!
-            cont.reload()
+            if not self._resume(cont):
+                cont.start()
+                # update attrs to get the new auto-assigned ports
+                # ports are assigned only on run, not on create!
+                cont.reload()
 
-            if cont.ports:  # REVIEW Duplicate from _apiResonseToService()
-                svc.clusterAddr = SocketAddr(self._ip, self._getLocalPort(cont))  # REVIEW For K8s in K8sService
+            if cont.ports:  # NOTE: svc.clusterAddr is set by _scale() (containers may run in parallel)
                 return Deployment(1, 1)
             return None
         else:
-            cont.stop()
+            if not self._pause(cont):
+                cont.stop()
             return None
 
+    def _pause(self, cont) -> bool:
+        """
+        Pauses the container (in "pause" mode). Returns False if it needs to be stopped instead.
+        """
+        if self.scaleMode != "pause":
+            return False
+        try:
+            cont.pause()
+            cont.reload()
+        except Exception as e:  # e.g., not running
+            self._log.warn(f"Cannot pause {cont.name}: {e}")
+            return False
+
+        with self._pauseLock:
+            self._paused[cont.id] = (cont, time())
+        return True
+
+    def _resume(self, cont) -> bool:
+        """
+        Unpauses the container if it is paused. Returns False if it needs to be started instead.
+        """
+        with self._pauseLock:
+            paused = self._paused.pop(cont.id, None)
+            reclaiming = self._reclaiming.get(cont.id)
+
+        if reclaiming is not None:
+            reclaiming.wait()  # being stopped right now -> start it again afterwards
+        if paused is None:
+            return False
+
+        cont.unpause()
+        cont.reload()
+        return True
+
+    def isPaused(self, svc: ServiceInstance) -> bool:
+
+        with self._pauseLock:
+            return any(cont.id in self._paused for cont in svc.containers)
+
+    def reclaim(self, svc: ServiceInstance):
+        """
+        Stops the paused containers of the instance right away (e.g., evicted by the CapacityManager).
+        """
+        with self._pauseLock:
+            paused = [self._paused[cont.id][0] for cont in svc.containers if cont.id in self._paused]
+            self._startReclaim(paused)
+        self._stopPaused(paused, "evicted")
+
+    def _reclaimPaused(self):
+        """
+        Stops all containers that have been paused for longer than `pausedTimeout` (to free their memory).
+        """
+        while True:
+            sleep(max(1, min(60, self.pausedTimeout / 4)))
+
+            minTime = time() - self.pausedTimeout
+            with self._pauseLock:
+                expired = [cont for cont, pausedAt in self._paused.values() if pausedAt < minTime]
+                self._startReclaim(expired)
+            self._stopPaused(expired, f"paused for more than {self.pausedTimeout}s")
+
+    def _startReclaim(self, containers: list):
+        #
+        # NOTE: Called with the pause lock held.
+        #
+        for cont in containers:
+            self._paused.pop(cont.id)
+            self._reclaiming[cont.id] = Event()
+
+    def _stopPaused(self, containers: list, reason: str):
+
+        for cont in containers:
+            try:
+                cont.unpause()  # a paused container cannot be stopped
+                cont.stop()
+                cont.reload()
+                self._log.info(f"Stopped container {cont.name} ({reason}).")
+            except Exception as e:
+                self._log.warn(f"Failed to stop paused container {cont.name}: {e}")
+            finally:
+                with self._pauseLock:
+                    self._reclaiming.pop(cont.id).set()
+
     def services(self, label: str):
 
+        if self._cache is not None and self._cache.synced:
+            return self._cache.services(label)
+
         svcs = self._toMap(label, self.rawServices, lambda i: self._apiResponseToService(i))
 
         if isinstance(svcs, list):
@@ -183,6 +501,10 @@ class DockerCluster(Cluster):
                 svcs[k] = self._combine(v)
         return svcs
 
+    def _toServices(self, containers) -> list[ServiceInstance]:
+
+        return self._combine([self._apiResponseToService(cont) for cont in self._filterLabelAvailable(containers)])
+
     def _combine(self, svcs):
         sMap = {}
 
@@ -202,15 +524,26 @@ class DockerCluster(Cluster):
         svc.containers.append(i)  # REVIEW Works only if service consists of a single container
         if i.ports:
             svc.clusterAddr = SocketAddr(self._ip, self._getLocalPort(i))  # REVIEW For K8s in K8sService
-            svc.deployment = Deployment(replicas=1, ready_replicas=1)
+            # paused: scaled down to zero, but the ports are still published
+            svc.deployment = Deployment() if i.status == "paused" else Deployment(replicas=1, ready_replicas=1)
         else:
             svc.deployment = Deployment()  # deployed, but no instance running
         return svc
 
     def rawServices(self, label=None):
 
+        if self._cache is not None and self._cache.synced:
+            return self._filterLabelAvailable(self._cache.containers(label))
         return self._getItems(label, self._client.containers.list)
 
+    def cacheStats(self) -> dict:
+
+        return self._cache.stats() if self._cache is not None else {}
+
+    def poolStats(self) -> dict:
+
+        return self._pool.stats()
+
     def _label(self, item):
 
         return None if not item else item.labels.get(self._labelName)
@@ -219,17 +552,21 @@ class DockerCluster(Cluster):
 
         return {} if not label else {'label': f'{self._labelName}={label}'}
 
-    def _filterLabelAvailable(self, items):
-
+    def _filterLabelAvailable(self, items, pool=False):
+        #
+        # NOTE: Containers in the warm pool are not service instances (yet).
+        #
         if self._labelName is None:
             return items
-        return filter(lambda i: self._labelName in i.labels and self._labelPort in i.labels, items)
+        return filter(
+            lambda i: self._labelName in i.labels and self._labelPort in i.labels and i.name.startswith(
+                DockerWarmPool.PREFIX) == pool, items)
 
-    def _getItems(self, label, func):
+    def _getItems(self, label, func, pool=False):
 
         try:
             ret = func(filters=self._labelSelector(label), all=True)  # all: include stopped containers
-            return self._filterLabelAvailable(ret)
+            return self._filterLabelAvailable(ret, pool)
 
         except Exception as e:
             self._log.warn(e)
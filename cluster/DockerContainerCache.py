@@ -0,0 +1,178 @@
+from __future__ import annotations
+
+from threading import Condition, Thread
+from time import sleep, time
+
+
+class DockerContainerCache:
+    """
+    Local cache of our containers (those with the service label), fed by the Docker events stream.
+
+    The cache is filled by a single list and then updated per event (create/start/die/destroy, as well as
+    stop/pause/unpause/rename): only the affected container is inspected again and only the ServiceInstance of its
+    service is rebuilt (incl. its clusterAddr and readiness). Lookups never touch the Docker socket. If the stream
+    breaks, the cache is rebuilt by another list and a new stream starts from the time of that list.
+
+    client: docker.DockerClient (or a fake with the same `containers.list/get` and `events` API, see tests)
+    toServices: fn(containers) -> [ServiceInstance] (see DockerCluster)
+    """
+
+    EVENTS = {"create", "start", "die", "destroy", "stop", "pause", "unpause", "rename"}
+
+    def __init__(self, log, client, labelName: str, toServices):
+
+        self._log = log
+        self._client = client
+        self._labelName = labelName
+        self._toServices = toServices
+
+        self._cond = Condition()
+        self._containers = {}  # id -> Container
+        self._index = {}  # label value -> {id -> Container}
+        self._services = {}  # label value -> [ServiceInstance]
+        self._synced = False
+        self._stopped = False
+        self._stream = None
+        self._thread = None
+
+        self.numEvents = self.numResyncs = 0
+
+    def start(self):
+
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name="DockerEvents", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+
+        self._stopped = True
+        if self._stream is not None:
+            self._stream.close()
+
+    def waitSynced(self, timeout=None) -> bool:
+
+        with self._cond:
+            return self._cond.wait_for(lambda: self._synced, timeout)
+
+    @property
+    def synced(self) -> bool:
+        return self._synced
+
+    def containers(self, label: str = None) -> list:
+
+        with self._cond:
+            if label:
+                return list(self._index.get(label, {}).values())
+            return list(self._containers.values())
+
+    def services(self, label: str = None):
+        """
+        Returns the list of ServiceInstances for this label; dict[label] -> list if no label is given.
+        """
+        with self._cond:
+            if label:
+                return list(self._services.get(label, []))
+            return {label: list(svcs) for label, svcs in self._services.items()}
+
+    def _run(self):
+
+        while not self._stopped:
+            try:
+                since = time()  # no event between the list and the stream must get lost
+                self._list()
+                self._listen(since)
+            except Exception as e:
+                if not self._stopped:
+                    self._log.warning(f"Docker events: {e}")
+                    sleep(5)
+            self.numResyncs += 1
+
+    def _list(self):
+
+        containers = self._client.containers.list(all=True, filters={'label': self._labelName})
+
+        with self._cond:
+            self._containers = {}
+            self._index = {}
+            for cont in containers:
+                self._add(cont)
+            self._services = {}
+            for label, conts in self._index.items():
+                self._rebuild(label, list(conts.values()))
+            self._synced = True
+            self._cond.notify_all()
+
+    def _listen(self, since: float):
+
+        self._stream = self._client.events(decode=True,
+                                           since=int(since),
+                                           filters={
+                                               'type': 'container',
+                                               'label': self._labelName
+                                           })
+        for event in self._stream:
+            if self._stopped:
+                break
+
+            action = event.get('Action') or event.get('status')
+            if action not in self.EVENTS:
+                continue  # e.g., exec_start, health_status
+
+            self.numEvents += 1
+            contID = event.get('id') or event.get('Actor', {}).get('ID')
+
+            cont = None
+            if action != 'destroy':
+                try:
+                    cont = self._client.containers.get(contID)  # current state (ports, status)
+                except Exception:
+                    pass  # removed in the meantime
+
+            self._update(contID, cont)
+
+    def _update(self, contID: str, cont):
+
+        with self._cond:
+            prev = self._containers.get(contID)
+            labels = {self._label(c) for c in (prev, cont) if c is not None}
+
+            self._remove(contID)
+            if cont is not None:
+                self._add(cont)
+
+            for label in labels:  # rebuild the affected services only
+                self._rebuild(label, list(self._index.get(label, {}).values()))
+            self._cond.notify_all()
+
+    def _rebuild(self, label: str, conts: list):
+
+        self._services.pop(label, None)
+        if conts:
+            try:
+                self._services[label] = self._toServices(conts)
+            except Exception as e:  # e.g., the service name cannot be resolved
+                self._log.warning(f"Docker events: ignoring containers of {label}: {e}")
+
+    def _add(self, cont):
+
+        self._containers[cont.id] = cont
+        self._index.setdefault(self._label(cont), {})[cont.id] = cont
+
+    def _remove(self, contID: str):
+
+        prev = self._containers.pop(contID, None)
+        if prev is not None:
+            label = self._label(prev)
+            entries = self._index.get(label, {})
+            entries.pop(contID, None)
+            if not entries:
+                self._index.pop(label, None)
+
+    def _label(self, cont):
+
+        return cont.labels.get(self._labelName)
+
+    def stats(self) -> dict:
+
+        with self._cond:
+            return {"containers": len(self._containers), "events": self.numEvents, "resyncs": self.numResyncs}
@@ -0,0 +1,177 @@
+from __future__ import annotations
+
+from util.K8sService import K8sService
+
+from collections import Counter
+from threading import Condition, Thread
+
+
+class DockerWarmPool:
+    """
+    Pool of pre-created containers per service: a deployment only needs to claim a pool entry and start (or unpause)
+    its containers instead of creating them.
+
+    Entries are created in the background for the configured services and for the `popular` services deployed most
+    often so far, up to `perService` entries per service and `size` entries in total. Entries of services that are no
+    longer targets are evicted (removed) before refilling. Pool containers are named `edgepool-*` (and thus ignored as
+    service instances) until they are claimed and renamed.
+
+    Config (all optional):
+        "enabled": false
+        "size": Max. entries in total (default: 4).
+        "perService": Entries per service (default: 1).
+        "paused": Start the containers and pause them right away (default: false: created only).
+        "services": [<service yml file>]: Services to keep in the pool.
+        "popular": Also keep the n most often deployed services in the pool (default: 2).
+
+    createFunc: fn(serviceDef, namePrefix, paused) -> [containers]
+    """
+
+    PREFIX = "edgepool-"
+
+    def __init__(self, log, cfg: dict, createFunc, removeFunc):
+
+        self._log = log
+        self._createFunc = createFunc
+        self._removeFunc = removeFunc  # fn(container)
+
+        self.enabled = cfg.get("enabled", False)
+        self.size = cfg.get("size", 4)
+        self.perService = cfg.get("perService", 1)
+        self.paused = cfg.get("paused", False)
+        self.popular = cfg.get("popular", 2)
+        self._serviceFiles = cfg.get("services", [])
+
+        self._cond = Condition()
+        self._entries = {}  # label -> [[containers]]
+        self._defs = {}  # label -> K8sService
+        self._configured = []  # labels
+        self._deployed = Counter()  # label -> number of deployments
+        self._creating = Counter()  # label -> entries being created
+        self._thread = None
+
+        self.numClaimed = self.numMissed = self.numCreated = self.numEvicted = 0
+
+    def start(self):
+
+        if not self.enabled or self._thread is not None:
+            return
+
+        for filename in self._serviceFiles:
+            try:
+                serviceDef = K8sService(filename=filename)
+                self._defs[serviceDef.label] = serviceDef
+                self._configured.append(serviceDef.label)
+            except Exception as e:
+                self._log.error(f"Warm pool: cannot load {filename}: {e}")
+
+        self._thread = Thread(target=self._run, name="WarmPool", daemon=True)
+        self._thread.start()
+
+    def claim(self, serviceDef: K8sService) -> list:
+        """
+        Returns the (stopped or paused) containers of a pool entry for this service; None if there is none.
+        """
+        if not self.enabled:
+            return None
+
+        with self._cond:
+            self._deployed[serviceDef.label] += 1
+            self._defs.setdefault(serviceDef.label, serviceDef)
+
+            entries = self._entries.get(serviceDef.label)
+            entry = entries.pop() if entries else None
+            if entry:
+                self.numClaimed += 1
+            else:
+                self.numMissed += 1
+            self._cond.notify_all()  # refill
+            return entry
+
+    def targets(self) -> list[str]:
+        """
+        Returns the labels of the services to keep in the pool (in order of priority).
+        """
+        labels = list(self._configured)
+        for label, _ in self._deployed.most_common():
+            if len(labels) >= len(self._configured) + self.popular:
+                break
+            if label not in labels:
+                labels.append(label)
+        return labels
+
+    def _stale(self) -> list[str]:
+        #
+        # NOTE: Called with the lock held.
+        #
+        targets = self.targets()
+        return [label for label, entries in self._entries.items() if entries and label not in targets]
+
+    def _next(self) -> str:
+        #
+        # NOTE: Called with the lock held.
+        #
+        if sum(len(entries) for entries in self._entries.values()) + sum(self._creating.values()) >= self.size:
+            return None
+
+        for label in self.targets():
+            if len(self._entries.get(label, [])) + self._creating[label] < self.perService:
+                return label
+        return None
+
+    def _run(self):
+
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._stale() or self._next() is not None)
+
+                # evict first: stale entries must not count towards the size
+                stale = [entry for label in self._stale() for entry in self._entries.pop(label)]
+                self.numEvicted += len(stale)
+
+                label = self._next()
+                if label:
+                    self._creating[label] += 1
+
+            for entry in stale:
+                for cont in entry:
+                    self._removeFunc(cont)
+            if not label:
+                continue
+
+            entry = None
+            try:
+                entry = self._createFunc(self._defs[label], self.PREFIX, self.paused)
+            except Exception as e:
+                self._log.error(f"Warm pool: cannot create {label}: {e}")
+
+            with self._cond:
+                self._creating[label] -= 1
+                if entry:
+                    self.numCreated += 1
+                    self._entries.setdefault(label, []).append(entry)
+                else:
+                    self._cond.wait(10)  # do not retry immediately
+
+    def clear(self):
+        """
+        Removes all unused pool containers.
+        """
+        with self._cond:
+            entries = [entry for entries in self._entries.values() for entry in entries]
+            self._entries = {}
+
+        for entry in entries:
+            for cont in entry:
+                self._removeFunc(cont)
+
+    def stats(self) -> dict:
+
+        with self._cond:
+            return {
+                "entries": sum(len(entries) for entries in self._entries.values()),
+                "claimed": self.numClaimed,
+                "missed": self.numMissed,
+                "created": self.numCreated,
+                "evicted": self.numEvicted
+            }
@@ -13,17 +13,34 @@ from util.IPAddr import IPAddr
 from util.Service import Deployment, Pod, ServiceInstance, Service
 from util.K8sService import K8sService
 from cluster.Cluster import Cluster
+from cluster.K8sInformer import K8sInformer
+from util.Performance import PerfCounter
+
+from concurrent.futures import ThreadPoolExecutor as PoolExecutor
 
 from logging import WARNING, getLogger
 from functools import partial
+from time import monotonic, sleep
 
 
 class K8sCluster(Cluster):
     """
     Interface to a single Kubernetes cluster.
+
+    Config (all optional):
+        "informers": Cache services, deployments and pods locally (default: true; see K8sInformer).
+        "resyncPeriod": 300 (seconds)
+        "api": {"maxConnections": 10, "keepAlive": true, "timeout": 60} (see Cluster.API_DEFAULTS)
+        "prePullTools": Image with a static busybox for prePull() (default: "busybox:1.36-musl").
     """
 
-    def __init__(self, apiServer, tokenFileName, namespace="edge", labelName="edge.service", log=None):
+    def __init__(self,
+                 apiServer,
+                 tokenFileName,
+                 namespace="edge",
+                 labelName="edge.service",
+                 log=None,
+                 cfg: dict = None):
 
         # disable debug logs from the REST client
         client.rest.logger.setLevel(WARNING)
@@ -35,10 +52,28 @@ class K8sCluster(Cluster):
         if self._log is None:
             self._log = getLogger("K8s." + str(self._ip))
 
-        self._apiClient = self._apiClient(apiServer, tokenFileName)
+        cfg = cfg or {}
+        useInformers = cfg.get("informers", True)
+        self._prePullTools = cfg.get("prePullTools", "busybox:1.36-musl")
+
+        # the informers' watches keep one connection each (in addition to maxConnections)
+        #
+        self._apiCfg = self.apiCfg(cfg)
+        self._apiClient = self._apiClient(apiServer, tokenFileName, self._apiCfg, 3 if useInformers else 0)
 
         self._k8s = client.CoreV1Api(self._apiClient)
         self._k8sApps = client.AppsV1Api(self._apiClient)
+        self._executor = PoolExecutor(max_workers=4)  # to create the objects of a service concurrently
+
+        # local caches (list + watch) of our services, deployments and pods: no API requests per flow setup
+        #
+        self._informers = {}
+        if useInformers:
+            for name, func in [("services", self._k8s.list_namespaced_service),
+                               ("deployments", self._k8sApps.list_namespaced_deployment),
+                               ("pods", self._k8s.list_namespaced_pod)]:
+                self._informers[name] = K8sInformer(self._log, f"{self._ip}/{name}", partial(func, self._namespace),
+                                                    labelName, cfg.get("resyncPeriod", 300))
 
     def connect(self):
         if not len(self.rawNamespaces(self._namespace)):
@@ -47,24 +82,64 @@ class K8sCluster(Cluster):
             #
             self.createNamespace(self._namespace)
 
+        for informer in self._informers.values():
+            informer.start()
+        for informer in self._informers.values():
+            if not informer.waitSynced(timeout=30):
+                self._log.warn(f"Informer {informer.name} not synced yet: using the API directly.")
+
     def deploy(self, service: K8sService) -> ServiceInstance:
+        """
+        Creates the Deployment (already with its target number of replicas, see K8sService.annotate()) and the Service
+        concurrently and waits until the first replica is ready: no separate scaling step is required afterwards.
 
+        The timings of the steps are added to `service.perf`.
+        """
         assert (service and service.yaml)
 
-        self.applyYaml(yml=service.yaml)
+        perf = PerfCounter()
+        self._createItems(service.yaml)
+        service.perf["apply"] = perf.ms()
         self._log.info("Service <" + str(service) + "> deployed.")
-        return next(iter(self.services(service.label)), None)
 
-    def watchDeployment(self, svcInst: ServiceInstance):
+        informer = self._informers.get("services")
+        if informer and informer.synced:  # wait for the watch event of the new service
+            informer.waitFor(service.label, len, timeout=10)
+        svcInst = next(iter(self.services(service.label)), None)
+        service.perf["service"] = round(perf.ms() - service.perf["apply"], 3)
+
+        if svcInst and service.replicas:
+            self.watchDeployment(svcInst)
+            service.perf["ready"] = round(perf.ms() - service.perf["apply"] - service.perf["service"], 3)
+        return svcInst
+
+    def watchDeployment(self, svcInst: ServiceInstance, minReady: int = 1, timeout=60):
+        """
+        Waits until at least `minReady` replicas are ready (and updates svcInst.deployment).
 
+        Uses the shared watch of the deployments informer if available; a separate watch otherwise.
+        """
         assert (svcInst)
 
-        # REVIEW Monitoring should/could be done in a separate thread
-        #
+        informer = self._informers.get("deployments")
+        if informer and informer.synced:
+            items = informer.waitFor(svcInst.service.label,
+                                     lambda items: any(self._toDeployment(i).ready_replicas >= minReady for i in items),
+                                     timeout)
+            if items:
+                svcInst.deployment = max((self._toDeployment(i) for i in items), key=lambda d: d.ready_replicas)
+        else:
+            self._watchDeployment(svcInst, minReady, timeout)
+
+        if not svcInst.deployment or svcInst.deployment.ready_replicas < minReady:
+            self._log.error(f"Deployment/scaling failed: {str(svcInst)}")
+
+    def _watchDeployment(self, svcInst: ServiceInstance, minReady: int, timeout):
+
         w = watch.Watch()
         events = partial(w.stream, self._k8sApps.list_namespaced_deployment, self._namespace)
 
-        for event in events(label_selector=self._labelSelector(svcInst.service.label), _request_timeout=60):
+        for event in events(label_selector=self._labelSelector(svcInst.service.label), _request_timeout=timeout):
             evObj = event['object']
 
             dpm = self._toDeployment(evObj)
@@ -77,20 +152,99 @@ class K8sCluster(Cluster):
             # However, if we use Pod routing, then we need to wait for the Pod anyway to get the IP address!
             #
             # if dpm.updated_replicas or dpm.ready_replicas:
-            if dpm.ready_replicas:
+            if dpm.ready_replicas >= minReady:
                 svcInst.deployment = dpm
                 w.stop()
 
-        if not svcInst.deployment.ready_replicas:
-            self._log.error(f"Deployment/scaling failed: {str(svcInst)}")
-
     def _scale(self, svc: ServiceInstance, replicas: int):
         api_response = self._k8sApps.patch_namespaced_deployment_scale(Service.uniqueName(svc.service.label),
                                                                        self._namespace,
                                                                        {'spec': {
                                                                            'replicas': replicas
                                                                        }})
-        self.watchDeployment(svc)
+        if replicas:
+            self.watchDeployment(svc)
+        else:
+            svc.deployment = Deployment(0, 0)  # pods are terminating
+
+    def _rescale(self, svc: ServiceInstance, replicas: int):
+
+        self._k8sApps.patch_namespaced_deployment_scale(Service.uniqueName(svc.service.label), self._namespace,
+                                                        {'spec': {
+                                                            'replicas': replicas
+                                                        }})
+        self.watchDeployment(svc, minReady=replicas)
+
+    def prePull(self, images: list[str], timeout=300):
+        """
+        Pulls the images onto all nodes with a temporary DaemonSet (one container per image). The DaemonSet is deleted
+        when ready (i.e. all images pulled) or after the timeout.
+
+        The images need neither a shell nor any other binary: an init container copies a static busybox into a shared
+        volume and every image container just sleeps with it.
+        """
+        name = "edge-prepull"
+        labels = {"edge.prepull": name}  # NOT our service label: the pods are no service instances
+        mount = {"name": "tools", "mountPath": "/edge-prepull"}
+        busybox = mount["mountPath"] + "/busybox"
+
+        tools = {
+            "name": "tools",
+            "image": self._prePullTools,
+            "imagePullPolicy": "IfNotPresent",
+            "command": ["/bin/busybox", "cp", "/bin/busybox", busybox],
+            "volumeMounts": [mount]
+        }
+        containers = [{
+            "name": f"image{i}",
+            "image": image,
+            "imagePullPolicy": "IfNotPresent",
+            "command": [busybox, "sleep", "2147483647"],
+            "volumeMounts": [mount]
+        } for i, image in enumerate(images)]
+
+        daemonSet = {
+            "apiVersion": "apps/v1",
+            "kind": "DaemonSet",
+            "metadata": {
+                "name": name,
+                "labels": labels
+            },
+            "spec": {
+                "selector": {
+                    "matchLabels": labels
+                },
+                "template": {
+                    "metadata": {
+                        "labels": labels
+                    },
+                    "spec": {
+                        "volumes": [{
+                            "name": mount["name"],
+                            "emptyDir": {}
+                        }],
+                        "initContainers": [tools],
+                        "containers": containers,
+                        "terminationGracePeriodSeconds": 0
+                    }
+                }
+            }
+        }
+        deleteFunc = partial(self._k8sApps.delete_namespaced_daemon_set, name, self._namespace)
+
+        self._tryFunc(deleteFunc)  # left over from a previous run?
+        if not self._tryFunc(partial(self._k8sApps.create_namespaced_daemon_set, self._namespace, daemonSet)):
+            return
+
+        endTime = monotonic() + timeout
+        while monotonic() < endTime:
+            status = self._tryFunc(partial(self._k8sApps.read_namespaced_daemon_set_status, name, self._namespace))
+            status = getattr(status, "status", None)
+            if status and status.desired_number_scheduled and status.number_ready == status.desired_number_scheduled:
+                break
+            sleep(2)
+
+        self._tryFunc(deleteFunc)
 
     def services(self, label: str):
 
@@ -115,11 +269,13 @@ class K8sCluster(Cluster):
 
     def rawServices(self, label=None):
 
-        return self._getItems(label, self._k8s.list_service_for_all_namespaces)
+        items = self._cachedItems("services", label)
+        return items if items is not None else self._getItems(label, self._k8s.list_service_for_all_namespaces)
 
     def rawDeployments(self, label=None):
 
-        return self._getItems(label, self._k8sApps.list_deployment_for_all_namespaces)
+        items = self._cachedItems("deployments", label)
+        return items if items is not None else self._getItems(label, self._k8sApps.list_deployment_for_all_namespaces)
 
     def rawPods(self, label=None):
         #
@@ -134,8 +290,11 @@ class K8sCluster(Cluster):
         # While the 'pod-template-hash' shows a connection to a specific deployment, if the same deployment is
         # deleted and created again immediately, the only solution is to filter by deletion_timestamp.
         #
-        return filter(lambda p: p.metadata.deletion_timestamp is None,
-                      self._getItems(label, self._k8s.list_pod_for_all_namespaces))
+        items = self._cachedItems("pods", label, valid=lambda pods: any(p.status.pod_ip for p in pods))
+        if items is None:
+            items = self._getItems(label, self._k8s.list_pod_for_all_namespaces)
+
+        return filter(lambda p: p.metadata.deletion_timestamp is None, items)
 
     def rawEndpoints(self, label=None):
 
@@ -148,10 +307,39 @@ class K8sCluster(Cluster):
                               filter=False,
                               fieldSelectors=self._fieldSelector({'metadata.name': name}))
 
+    def _cachedItems(self, name, label=None, valid=len):
+        """
+        Returns the items from the informer's cache; None if not available (not synced yet, or no valid items for
+        this label yet, e.g., a watch event that has not arrived yet).
+        """
+        informer = self._informers.get(name)
+        if informer is None or not informer.synced:
+            return None
+
+        items = informer.items(label)
+        return items if not label or valid(items) else None
+
+    def informerStats(self) -> dict:
+
+        return {name: informer.stats() for name, informer in self._informers.items()}
+
     def _label(self, item):
 
         return None if not item.metadata.labels else item.metadata.labels.get(self._labelName)
 
+    def _createItems(self, yml: list):
+        """
+        Creates the objects of the (annotated) yaml concurrently.
+        """
+
+        def create(item):
+            try:
+                utils.create_from_dict(self._apiClient, item, namespace=self._namespace)
+            except Exception as e:
+                self._log.warn(e)
+
+        list(self._executor.map(create, yml))
+
     def applyYaml(self, filename=None, yml=None):
         """
         Pass either filename or file content (`yaml.safe_load_all(filename)`).
@@ -163,7 +351,10 @@ class K8sCluster(Cluster):
         except Exception as e:
             self._log.warn(e)
 
-    def _apiClient(self, apiServer, tokenFileName):
+    def _apiClient(self, apiServer, tokenFileName, apiCfg: dict, numWatches=0):
+
+        cfg = client.Configuration()  # create new config object
+        cfg.connection_pool_maxsize = apiCfg["maxConnections"] + numWatches
 
         if self._ip == IPAddr("127.0.0.1"):
             #
@@ -171,12 +362,11 @@ class K8sCluster(Cluster):
             # - https://github.com/krestomatio/container_builder/issues/54
             # - https://github.com/kubernetes-client/python/issues/1333
             #
-            config.load_kube_config()
-            return client.ApiClient()
+            config.load_kube_config(client_configuration=cfg)
+            return self._initPool(client.ApiClient(cfg), apiCfg)
 
         token = self._readToken(tokenFileName)
         if token:
-            cfg = client.Configuration()  # create new config object
             cfg.host = "https://" + apiServer  # specify the endpoint of our K8s cluster
             cfg.api_key = {"authorization": "Bearer " + token}
 
@@ -186,9 +376,33 @@ class K8sCluster(Cluster):
             #
             cfg.verify_ssl = False
 
-            return client.ApiClient(cfg)  # create API client
+            return self._initPool(client.ApiClient(cfg), apiCfg)  # create API client
         return None
 
+    def _initPool(self, apiClient, apiCfg: dict):
+        """
+        Applies the limits to the connection pool: requests beyond maxConnections wait for a free connection (instead
+        of opening additional ones). Watches set their own timeout.
+        """
+        restClient = apiClient.rest_client
+        restClient.pool_manager.connection_pool_kw["block"] = True  # used for all pools created from now on
+
+        if apiCfg["timeout"]:
+            #
+            # NOTE: The REST client always passes its `_request_timeout` to urllib3 (None: no timeout), thus a default
+            # timeout of the pool would be ignored.
+            #
+            request = restClient.request
+
+            def requestWithTimeout(*args, _request_timeout=None, **kwargs):
+                return request(*args, _request_timeout=_request_timeout or apiCfg["timeout"], **kwargs)
+
+            restClient.request = requestWithTimeout
+
+        if not apiCfg["keepAlive"]:
+            apiClient.set_default_header("Connection", "close")
+        return apiClient
+
     def _readToken(self, tokenFileName):
         """
         Reads the authentication token from the file given with the filename. 
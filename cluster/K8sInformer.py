@@ -0,0 +1,162 @@
+from __future__ import annotations
+
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+from threading import Condition, Thread
+from time import sleep
+
+
+class K8sInformer:
+    """
+    Local cache of a single K8s resource type (list + watch), indexed by the value of the service label.
+
+    The cache is filled by a full list and then kept up to date by a watch starting at the list's resourceVersion.
+    When the watch expires (every `resyncPeriod` seconds at the latest) or the resourceVersion is too old (410 Gone),
+    the cache is rebuilt by another full list (resync). All reads are served from memory.
+
+    listFunc: e.g. partial(CoreV1Api.list_namespaced_service, namespace)
+    """
+
+    def __init__(self, log, name: str, listFunc, labelName: str, resyncPeriod=300):
+
+        self._log = log
+        self.name = name
+        self._listFunc = listFunc
+        self._labelName = labelName
+        self.resyncPeriod = resyncPeriod
+
+        self._cond = Condition()
+        self._items = {}  # uid -> item
+        self._index = {}  # label value -> {uid -> item}
+        self._synced = False
+        self._stopped = False
+        self._thread = None
+
+        self.numResyncs = self.numEvents = 0
+
+    def start(self):
+
+        if self._thread is None:
+            self._thread = Thread(target=self._run, name=f"Informer-{self.name}", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+
+        self._stopped = True
+
+    def waitSynced(self, timeout=None) -> bool:
+        """
+        Blocks until the initial list is complete. Returns False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(lambda: self._synced, timeout)
+
+    @property
+    def synced(self) -> bool:
+        return self._synced
+
+    def items(self, label: str = None) -> list:
+        """
+        Returns the cached items with this label value (all items if no label is given).
+        """
+        with self._cond:
+            if label:
+                return list(self._index.get(label, {}).values())
+            return list(self._items.values())
+
+    def waitFor(self, label: str, predicate, timeout=None):
+        """
+        Blocks until predicate(items with this label) is true. Returns the items (or None on timeout).
+        """
+        result = None
+
+        def check():
+            nonlocal result
+            items = list(self._index.get(label, {}).values())
+            if predicate(items):
+                result = items
+                return True
+            return False
+
+        with self._cond:
+            self._cond.wait_for(check, timeout)
+        return result
+
+    def _run(self):
+
+        while not self._stopped:
+            try:
+                resourceVersion = self._list()
+                self._watch(resourceVersion)
+            except ApiException as e:
+                if e.status != 410:  # 410 Gone: resourceVersion too old -> simply resync
+                    self._log.warn(f"Informer {self.name}: {e}")
+                    sleep(5)
+            except Exception as e:
+                self._log.warn(f"Informer {self.name}: {e}")
+                sleep(5)
+            self.numResyncs += 1
+
+    def _list(self) -> str:
+
+        response = self._listFunc(label_selector=self._labelName)
+
+        with self._cond:
+            self._items = {}
+            self._index = {}
+            for item in response.items:
+                self._add(item)
+            self._synced = True
+            self._cond.notify_all()
+
+        return response.metadata.resource_version
+
+    def _watch(self, resourceVersion: str):
+
+        w = watch.Watch()
+        for event in w.stream(self._listFunc,
+                              label_selector=self._labelName,
+                              resource_version=resourceVersion,
+                              timeout_seconds=self.resyncPeriod,
+                              _request_timeout=self.resyncPeriod + 30):  # not the timeout of the API client
+            if self._stopped:
+                w.stop()
+                break
+
+            if event['type'] == 'ERROR':
+                raw = event.get('raw_object') or {}
+                raise ApiException(status=raw.get('code'), reason=raw.get('message'))
+
+            self.numEvents += 1
+            with self._cond:
+                item = event['object']
+                self._remove(item)
+                if event['type'] != 'DELETED':
+                    self._add(item)
+                self._cond.notify_all()
+
+    def _add(self, item):
+
+        uid = item.metadata.uid
+        self._items[uid] = item
+        self._index.setdefault(self._label(item), {})[uid] = item
+
+    def _remove(self, item):
+
+        prev = self._items.pop(item.metadata.uid, None)
+        if prev is not None:
+            label = self._label(prev)
+            entries = self._index.get(label, {})
+            entries.pop(item.metadata.uid, None)
+            if not entries:
+                self._index.pop(label, None)
+
+    def _label(self, item):
+
+        return None if not item.metadata.labels else item.metadata.labels.get(self._labelName)
+
+    def stats(self) -> dict:
+
+        with self._cond:
+            return {"items": len(self._items), "events": self.numEvents, "resyncs": self.numResyncs}
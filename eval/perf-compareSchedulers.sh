@@ -0,0 +1,61 @@
+#!/bin/bash
+
+# Replays the same trace once per controller config (e.g., ProximityScheduler vs. LoadAwareScheduler) and compares
+# the tail latencies of the runs (see perfStats.py).
+#
+# *** Run e.g. with ***
+# ../transparent-edge-synced/eval/perf-compareSchedulers.sh perf-cfg/d.asm-hello.p.t5.uS.cfg tcpreplay-bigFlows.pcap.flows.csv perf-cfg/nodes20.txt 1
+
+# Controller configs to compare (same topology, different schedulers); can be overwritten from the environment
+#
+SCHED_CONFIGS=${SCHED_CONFIGS:-"config/edge-double.json config/edge-double-load.json"}
+COLLECT_DIR=~/perf-measure-data/  # see perf-flowDeploy.sh
+
+
+DIR="$( cd "$( dirname "${BASH_SOURCE[0]}" )" >/dev/null 2>&1 && pwd )"
+
+if [ "$#" -lt 4 ]
+  then
+    echo "Usage: $0 configFile replayFlows.csv nodes.txt minNumRequests [svcFile]"
+    exit 1
+fi
+CONFIG_FILE="$1"
+REPLAY_FILE="$2"
+shift 2
+
+CFG_DIR="$( cd "$( dirname "$CONFIG_FILE" )" >/dev/null 2>&1 && pwd )"
+CONFIG_NAME=$(basename "$CONFIG_FILE")
+CONFIG_NAME=${CONFIG_NAME%.*}
+REPLAY_NAME=$(basename "$REPLAY_FILE")
+REPLAY_NAME=${REPLAY_NAME%.*}
+
+RESULTS=()
+
+for ryuConfig in $SCHED_CONFIGS; do
+
+    # same eval config, but with this controller config (the config name becomes part of the collect folder)
+    #
+    SCHED_NAME=$(basename "$ryuConfig")
+    SCHED_NAME=${SCHED_NAME%.*}
+    CURFILE="$CFG_DIR/$CONFIG_NAME.$SCHED_NAME.cfg"
+    echo "source \"$(realpath "$CONFIG_FILE")\" \"\$1\"" > "$CURFILE"
+    echo "RYU_CONFIG=\"$ryuConfig\"" >> "$CURFILE"
+
+    echo ""
+    echo "Executing $CURFILE ..."
+    echo ""
+
+    "$DIR/perf-flowDeploy.sh" "$CURFILE" "$REPLAY_FILE" "$@" nowait
+    rm "$CURFILE"
+
+    RUN_DIR=$(ls -td "$COLLECT_DIR/$REPLAY_NAME/$CONFIG_NAME.$SCHED_NAME"/*/ | head -n 1)
+    RESULTS+=("$RUN_DIR/ctrl.log.json")
+
+    echo "Waiting for 20s"
+    sleep 20
+done
+
+echo ""
+echo "*** Comparison ***"
+echo ""
+"$DIR/perfStats.py" "${RESULTS[@]}" --names perfDeploy perfPark
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+"""
+Summarizes the performance records of one or more evaluation runs (e.g., to compare two schedulers).
+
+Input: `ctrl.log.json` files as created by perf-flowDeploy.sh (list of {"<name>": {...}} records extracted from the
+`#<name>: {...}` log lines). Prints count, mean and percentiles of all numeric fields per record name.
+"""
+
+from collections import defaultdict
+import argparse
+import json
+import os
+
+PERCENTILES = [50, 90, 95, 99]
+
+
+def percentile(values: list, p: int):
+    """
+    Nearest-rank percentile of sorted values.
+    """
+    idx = max(0, -(-len(values) * p // 100) - 1)  # ceil(n * p / 100) - 1
+    return values[idx]
+
+
+def loadRecords(filename, names=None):
+    """
+    Returns {name: {field: [values]}}.
+    """
+    result = defaultdict(lambda: defaultdict(list))
+
+    with open(filename) as file:
+        for record in json.load(file):
+            for name, data in record.items():
+                if (names and name not in names) or not isinstance(data, dict):
+                    continue
+                for field, value in data.items():
+                    if isinstance(value, (int, float)) and not isinstance(value, bool) and field != 'ts':
+                        result[name][field].append(value)
+    return result
+
+
+def printStats(label, records, fields=None):
+
+    for name in sorted(records):
+        for field in sorted(records[name]):
+            if fields and field not in fields:
+                continue
+            values = sorted(records[name][field])
+            pcts = ' '.join(f"p{p}={percentile(values, p):.1f}" for p in PERCENTILES)
+            print(f"{label:20} {name:16} {field:10} n={len(values):<7} mean={sum(values) / len(values):<10.1f} " +
+                  f"{pcts} max={values[-1]:.1f}")
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('logFiles', nargs='+', help='ctrl.log.json file(s) of one or more runs')
+    parser.add_argument('--names', nargs='*', help='These record names only (e.g., perfDeploy perfProbe)')
+    parser.add_argument('--fields', nargs='*', help='These fields only (e.g., total wait)')
+    args = parser.parse_args()
+
+    for filename in args.logFiles:
+        label = os.path.basename(os.path.dirname(os.path.abspath(filename))) or filename  # run folder
+        printStats(label, loadRecords(filename, args.names), args.fields)
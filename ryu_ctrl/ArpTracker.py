@@ -15,7 +15,7 @@ class ArpTracker(object):
     Does NOT clear the table!
     """
 
-    def __init__(self, log, tableID, srcMac, installFlow=False, fwdTable=None, flowPriority=3):
+    def __init__(self, log, tableID, srcMac, installFlow=False, fwdTable=None, flowPriority=3, onHostAdded=None):
 
         self.log = log
         self.table = tableID
@@ -23,6 +23,7 @@ class ArpTracker(object):
         self.installFlow = installFlow
         self.fwdTable = fwdTable
         self.flowPrio = flowPriority
+        self.onHostAdded = onHostAdded  # fn(dpid, ip)
 
     def connect(self, of: OpenFlow):
 
@@ -110,7 +111,11 @@ class ArpTracker(object):
             else:
                 log.debug("*** Refreshed %s", old)
 
+        isNew = swHosts.get(ip_src) != newHost
         swHosts[ip_src] = newHost
 
+        if isNew and self.onHostAdded:
+            self.onHostAdded(dpid, ip_src)
+
         for _, host in swHosts.items():
             log.debug("({}) {}".format(dpid, host))
@@ -0,0 +1,193 @@
+from __future__ import annotations
+
+from util.EdgeTools import Edge
+from util.Service import ServiceInstance
+from util.Stats import FlowStatsRegistry
+from util.MainLoopQueue import MainLoopQueue
+from util.DeploymentRegistry import DeploymentState
+from util.Performance import PerfCounter
+from util.DeployExecutor import DeployExecutor
+from .ServiceManager import ServiceManager
+
+from functools import partial
+from math import ceil
+from time import monotonic, time
+
+
+class Autoscaler:
+    """
+    Scales the replicas of running service instances according to their load (active flows and byte rate per
+    instance, see FlowStatsRegistry).
+
+    Hysteresis: An instance is scaled up if its utilization exceeds `scaleUpThreshold` and scaled down (one replica at
+    a time) if it falls below `scaleDownThreshold`. After each change, the instance is left alone for `upCooldown` or
+    `downCooldown` seconds. New replicas are registered (ServiceManager.updateReplicas) only once they are ready;
+    replicas to be removed are deregistered before they are stopped. The rescaling runs in the DeployExecutor (shared
+    with the Dispatcher) with a background priority.
+
+    Config (all optional):
+        "enabled": false
+        "minReplicas": 1, "maxReplicas": 4
+        "flowsPerReplica": Flows that a single replica can handle (default: 50).
+        "bytesPerReplica": Bytes/s that a single replica can handle (default: 0 = ignore).
+        "scaleUpThreshold": 0.8, "scaleDownThreshold": 0.3 (utilization)
+        "upCooldown": 10, "downCooldown": 60 (seconds)
+    """
+
+    def __init__(self,
+                 log,
+                 cfg: dict,
+                 serviceMngr: ServiceManager,
+                 flowStats: FlowStatsRegistry,
+                 executor: DeployExecutor = None,
+                 mainLoop: MainLoopQueue = None):
+
+        self.log = log
+        self._serviceMngr = serviceMngr
+        self._flowStats = flowStats
+        self._mainLoop = mainLoop
+        self._executor = executor or DeployExecutor(log, {"maxWorkers": 4})
+
+        self.enabled = cfg.get("enabled", False)
+        self.minReplicas = max(1, cfg.get("minReplicas", 1))
+        self.maxReplicas = max(self.minReplicas, cfg.get("maxReplicas", 4))
+        self.flowsPerReplica = cfg.get("flowsPerReplica", 50)
+        self.bytesPerReplica = cfg.get("bytesPerReplica", 0)
+        self.scaleUpThreshold = cfg.get("scaleUpThreshold", 0.8)
+        self.scaleDownThreshold = cfg.get("scaleDownThreshold", 0.3)
+        self.upCooldown = cfg.get("upCooldown", 10)
+        self.downCooldown = cfg.get("downCooldown", 60)
+
+        self._lastChange = {}  # (vAddr, edge) -> monotonic timestamp
+        self._scaling = set()  # (vAddr, edge): rescaling in progress
+        self.numScaledUp = self.numScaledDown = 0
+
+    def run(self):
+        """
+        Checks all service instances and starts the necessary rescaling (in the main loop; called periodically).
+        """
+        if not self.enabled:
+            return
+
+        deployments = self._serviceMngr.deployments
+
+        for edge, svc in self._serviceMngr.instances():
+
+            key = (svc.service.vAddr, edge)
+            if key in self._scaling or deployments.state(svc.service, edge) == DeploymentState.DEPLOYING:
+                continue  # do not interfere with a running deployment
+
+            stats = self._flowStats.stats(edge, svc.eAddr)
+            if stats is None or not svc.deployment or not svc.deployment.ready_replicas:
+                continue
+            numReplicas = self.numReplicas(svc)
+
+            utilization = self.utilization(stats, numReplicas)
+            target = self.target(utilization, numReplicas)
+            if target == numReplicas:
+                continue
+
+            cooldown = self.upCooldown if target > numReplicas else self.downCooldown
+            if monotonic() - self._lastChange.get(key, 0) < cooldown:
+                continue
+
+            self._rescale(edge, svc, numReplicas, target, utilization)
+
+    @staticmethod
+    def numReplicas(svc: ServiceInstance) -> int:
+        #
+        # NOTE: svc.replicas are addresses only (e.g., a single clusterAddr for all replicas with the "cluster" target).
+        #
+        return max(1, svc.deployment.replicas if svc.deployment else len(svc.replicas))
+
+    def isScaling(self, svc: ServiceInstance, edge: Edge) -> bool:
+
+        return (svc.service.vAddr, edge) in self._scaling
+
+    def utilization(self, stats, numReplicas: int) -> float:
+
+        utilization = stats.activeFlows / (self.flowsPerReplica * numReplicas)
+        if self.bytesPerReplica:
+            utilization = max(utilization, stats.byteRate / (self.bytesPerReplica * numReplicas))
+        return utilization
+
+    def target(self, utilization: float, numReplicas: int) -> int:
+        """
+        Returns the number of replicas for this utilization (unchanged within the hysteresis band).
+        """
+        if utilization > self.scaleUpThreshold:
+            target = ceil(numReplicas * utilization / self.scaleUpThreshold)  # enough replicas for the current load
+        elif utilization < self.scaleDownThreshold:
+            target = numReplicas - 1  # scale down slowly
+        else:
+            target = numReplicas
+
+        return min(self.maxReplicas, max(self.minReplicas, target))
+
+    def _rescale(self, edge: Edge, svc: ServiceInstance, numReplicas: int, target: int, utilization: float):
+
+        if self._executor.full():
+            return  # try again in the next run
+
+        key = (svc.service.vAddr, edge)
+        self._scaling.add(key)
+        self._lastChange[key] = monotonic()
+
+        if target > numReplicas:
+            self.numScaledUp += 1
+        else:
+            self.numScaledDown += 1
+            if len(svc.replicas) > target and edge.target != "pod":
+                # deregister first: new clients must not be sent to the removed replicas anymore
+                # (pods: K8s chooses the pods to remove -> the survivors are registered afterwards)
+                self._serviceMngr.updateReplicas(svc, edge, svc.replicas[:target])
+
+        future = self._executor.submit(edge, lambda: DeployExecutor.BACKGROUND, self._rescaleFunc, edge, svc,
+                                       numReplicas, target, utilization)
+        future.add_done_callback(lambda ft: self._runInMainLoop(partial(self._rescaled, edge, svc, ft)))
+
+    def _rescaleFunc(self, edge: Edge, svc: ServiceInstance, numReplicas: int, target: int, utilization: float):
+        #
+        # NOTE: Called in the executor thread.
+        #
+        startTime_s = time()
+        perf = PerfCounter()
+
+        addrs = self._serviceMngr.rescale(edge, svc, target)
+
+        self.log.warn(f'#perfScale: {{"svc":"{str(svc.service)}", "edge":"{str(edge.ip)}", "from":{numReplicas}, ' +
+                      f'"to":{target}, "ready":{len(addrs)}, "util":{round(utilization, 2)}, ' +
+                      f'"total":{round(perf.ms())}, "ts":{startTime_s}}}')
+        return addrs
+
+    def _rescaled(self, edge: Edge, svc: ServiceInstance, future):
+        """
+        Registers the ready replicas (in the main loop).
+        """
+        key = (svc.service.vAddr, edge)
+        self._scaling.discard(key)
+        self._lastChange[key] = monotonic()  # cooldown starts when the replicas are ready
+
+        if future.exception():
+            self.log.error(f"Scaling failed for {svc}: {future.exception()}")
+            return
+
+        if edge.vServices.get(svc.service.vAddr) is svc:  # not removed in the meantime
+            self._serviceMngr.updateReplicas(svc, edge, future.result())
+
+    def _runInMainLoop(self, fn):
+
+        if self._mainLoop is None:
+            fn()
+        else:
+            self._mainLoop.put(fn)
+
+    def stats(self) -> dict:
+
+        return {
+            "instances": len(self._serviceMngr.instances()),
+            "replicas": sum(self.numReplicas(svc) for _, svc in self._serviceMngr.instances()),
+            "scaling": len(self._scaling),
+            "scaledUp": self.numScaledUp,
+            "scaledDown": self.numScaledDown
+        }
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+from util.EdgeTools import Edge
+from util.Service import Service, ServiceInstance
+from util.Stats import FlowStatsRegistry
+from util.Resources import Resources
+from util.DeploymentRegistry import DeploymentState
+from util.Performance import PerfCounter
+from .ServiceManager import ServiceManager
+
+from threading import Lock
+from time import time
+
+
+class CapacityManager:
+    """
+    Keeps the running service instances of each edge within the edge's capacity (containers, CPU, memory; see the
+    "capacity" of an edge in the config). The edge behaves like a cache: if a new deployment (or scale-up) does not
+    fit, the least valuable idle instances are scaled down to zero first.
+
+    Value of an instance (the higher, the longer we keep it):
+
+        (1 + requests per minute) * cold-start seconds / (1 + idle minutes)
+
+    Paused instances (see Cluster.isPaused()) still hold their memory until they are reclaimed: it is counted, and
+    evicting them stops them right away (as does evicting a running instance).
+
+    Instances with active flows, clients that might still remember them (idle for less than `minIdle`, e.g., the
+    timeout of the FlowMemory), or a running deployment are never evicted. If evicting all other candidates would
+    still not be enough, the deployment is rejected (i.e. it fails fast instead of overloading the edge).
+
+    NOTE: Called from the deployment threads (ServiceManager.admission).
+    """
+
+    def __init__(self,
+                 log,
+                 serviceMngr: ServiceManager,
+                 flowStats: FlowStatsRegistry,
+                 defaultColdStart=1000,
+                 minIdle=0):
+
+        self.log = log
+        self._serviceMngr = serviceMngr
+        self._flowStats = flowStats
+        self.defaultColdStart = defaultColdStart  # ms; if not measured yet
+        self.minIdle = minIdle  # seconds
+        self._lock = Lock()
+        self._pending = {}  # (edge, service) -> Resources: admitted, but not running yet
+
+        self.numEvicted = self.numRejected = 0
+
+    def admit(self, edge: Edge, service: Service, replicas: int) -> bool:
+        """
+        Returns True if the service (with `replicas`) fits into the edge (after evicting other instances if
+        necessary). The resources are reserved until done() is called.
+        """
+        if edge.capacity is None:
+            return True
+
+        perf = PerfCounter()
+        demand = self.resources(edge, service) * replicas
+
+        with self._lock:
+            used = self.usage(edge, exclude=service)
+            if (used + demand).fits(edge.capacity):
+                self._pending[(edge, service)] = demand
+                return True
+
+            victims = self._victims(edge, service, used + demand)
+            if victims is None:
+                self.numRejected += 1
+                self.log.warn(f"Edge {edge.ip} full: {used} + {demand} > {edge.capacity}")
+                return False
+
+            paused = [svc for svc in victims if not self._running(svc)]
+            released = [svc for svc in victims if self._running(svc) and self._serviceMngr.release(edge, svc)]
+            self._pending[(edge, service)] = demand
+
+        for svc in released + paused:  # outside the lock: scaling down takes a while
+            try:
+                if svc in paused:
+                    edge.cluster.reclaim(svc)
+                else:
+                    self._serviceMngr.scaleDown(edge, svc, reclaim=True)
+                self.numEvicted += 1
+            except Exception as e:
+                self.log.error(f"Eviction failed for {svc}: {e}")
+
+        self.log.warn(f'#perfEvict: {{"svc":"{str(service)}", "edge":"{str(edge.ip)}", ' +
+                      f'"evicted":{len(released) + len(paused)}, "total":{round(perf.ms())}, "ts":{time()}}}')
+        return True
+
+    def fits(self, edge: Edge, service: Service, demand: Resources) -> bool:
+        """
+        Returns True if the demand fits into the free capacity of the edge (without evicting anything).
+        """
+        if edge.capacity is None:
+            return True
+
+        with self._lock:
+            return (self.usage(edge, exclude=service) + demand).fits(edge.capacity)
+
+    def done(self, edge: Edge, service: Service):
+
+        with self._lock:
+            self._pending.pop((edge, service), None)
+
+    def usage(self, edge: Edge, exclude: Service = None) -> Resources:
+        """
+        Resources used by all running (or admitted) service instances at the edge.
+        """
+        used = Resources()
+
+        for svc in list(edge.vServices.values()):
+            if svc.service != exclude:
+                used += self._footprint(edge, svc)
+
+        for (pendingEdge, service), demand in self._pending.items():
+            if pendingEdge == edge and service != exclude:
+                used += demand
+        return used
+
+    def resources(self, edge: Edge, service: Service) -> Resources:
+        """
+        Resources required by a single replica of the service.
+        """
+        svc = edge.vServices.get(service.vAddr)
+        if svc is not None:
+            return self._instanceResources(edge, svc)
+        return self._serviceMngr.serviceDef(service).resources()
+
+    def _footprint(self, edge: Edge, svc: ServiceInstance) -> Resources:
+        """
+        Resources held by the instance: all while running, the memory only while paused (until reclaimed).
+        """
+        if svc.deployment and svc.deployment.replicas:
+            return self._instanceResources(edge, svc) * svc.deployment.replicas
+        if edge.cluster.isPaused(svc):
+            return Resources(memory=self._instanceResources(edge, svc).memory)
+        return Resources()
+
+    @staticmethod
+    def _running(svc: ServiceInstance) -> bool:
+        return bool(svc.deployment and svc.deployment.ready_replicas)
+
+    def _instanceResources(self, edge: Edge, svc: ServiceInstance) -> Resources:
+
+        if svc.resources is None:  # e.g., deployed before we started
+            svc.resources = self._serviceMngr.serviceDef(svc.service).resources()
+        return svc.resources
+
+    def value(self, edge: Edge, svc: ServiceInstance, curTime=None) -> float:
+
+        curTime = curTime or time()
+        stats = self._flowStats.stats(edge, svc.eAddr)
+
+        rate = idle = 0  # requests/min, minutes
+        if stats is not None:
+            rate = stats.totalFlows * 60 / max(1, curTime - stats.created)
+            idle = (curTime - stats.lastActive) / 60 if stats.lastActive else 0
+
+        coldStart = (svc.coldStart or self.defaultColdStart) / 1000
+        return (1 + rate) * coldStart / (1 + idle)
+
+    def _victims(self, edge: Edge, service: Service, needed: Resources) -> list[ServiceInstance]:
+        """
+        Returns the least valuable idle instances to evict so that `needed` fits; None if not possible.
+        """
+        deployments = self._serviceMngr.deployments
+        curTime = time()
+        candidates = []
+
+        for svc in list(edge.vServices.values()):
+            if svc.service == service or not (self._running(svc) or edge.cluster.isPaused(svc)):
+                continue
+            stats = self._flowStats.stats(edge, svc.eAddr)
+            if (stats and stats.activeFlows) or deployments.state(svc.service, edge) == DeploymentState.DEPLOYING:
+                continue
+            if stats and curTime - stats.lastActive < self.minIdle:
+                continue  # remembered by a client (see FlowMemory)
+            candidates.append((self.value(edge, svc, curTime), svc))
+
+        victims = []
+        for _, svc in sorted(candidates, key=lambda c: c[0]):
+            if needed.fits(edge.capacity):
+                break
+            victims.append(svc)
+            needed -= self._footprint(edge, svc)
+
+        return victims if needed.fits(edge.capacity) else None
+
+    def stats(self) -> dict:
+
+        return {"evicted": self.numEvicted, "rejected": self.numRejected, "pending": len(self._pending)}
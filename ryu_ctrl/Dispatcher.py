@@ -2,12 +2,18 @@ from __future__ import annotations
 from collections.abc import Callable
 
 from util.FlowMemory import FlowMemoryEntry, FlowMemory
+from util.AgingDict import AgingDict
 from util.SocketAddr import SocketAddr
 from util.EdgeTools import Switch
 from util.RyuDPID import DPID
+from util.MainLoopQueue import MainLoopQueue
+from util.Stats import FlowStatsRegistry
+from util.DeployExecutor import DeployExecutor
+from util.DeploymentRegistry import DeploymentState
 from .ServiceManager import ServiceManager
 
-from concurrent.futures import ThreadPoolExecutor as PoolExecutor
+from functools import partial
+from time import monotonic
 
 
 class Dispatcher:
@@ -17,23 +23,66 @@ class Dispatcher:
 
     # REVIEW Might have to be synchronized due to parallel access.
 
-    def __init__(self, log, serviceMngr: ServiceManager, scheduler, memIdleTimeout=10):
+    def __init__(self,
+                 log,
+                 serviceMngr: ServiceManager,
+                 scheduler,
+                 memIdleTimeout=10,
+                 memMaxEntries=0,
+                 memMaxBytes=0,
+                 locIdleTimeout=600,
+                 locMaxEntries=0,
+                 parkMaxPackets=64,
+                 parkMaxAge=10,
+                 deployCfg: dict = None,
+                 popIdleTimeout=600,
+                 popMaxEntries=10000,
+                 mainLoop: MainLoopQueue = None):
 
         self.log = log
         self._serviceMngr = serviceMngr
         self._scheduler = scheduler
-        self._executor = PoolExecutor()
+        # Deployments run with a global and a per-edge limit; pending ones are ordered by waiting clients and the
+        # popularity of the service (see deployPriority()). If the queue is full, requests are forwarded by default.
+        self._executor = DeployExecutor(log, deployCfg or {})
+        self._requests = AgingDict(popIdleTimeout, popMaxEntries)  # service -> new requests (popularity)
 
-        # Remember the locations of the clients to detect client movement
-        self.locations = {}
+        # Completed deployments are handed over to the main loop: all switch I/O must happen in a single thread.
+        self._mainLoop = mainLoop
+
+        # Packets that arrive while their service is being deployed are parked until the deployment is ready.
+        self._parked = {}  # (service, edge) -> [(timestamp, src, dst, fnFlowSetup, fnPacketOut)]
+        self._parkMaxPackets = parkMaxPackets
+        self._parkMaxAge = parkMaxAge  # seconds
+        self.numParkDropped = 0
+
+        # Remember the locations of the clients to detect client movement (inactive clients are forgotten)
+        self.locations = AgingDict(locIdleTimeout, locMaxEntries)  # ip -> dpid
 
         # We remember where we directed flows so that if they start up again, we can send them to the same server.
-        self.memory = FlowMemory(memIdleTimeout)  # (srcip,dstip,srcport,dstport) -> MemoryEntry
+        # (srcip,dstip,srcport,dstport) -> MemoryEntry
+        self.memory = FlowMemory(memIdleTimeout, memMaxEntries, memMaxBytes)
+
+        # Flow counters per service instance (and edge) for load-aware scheduling
+        self.flowStats = FlowStatsRegistry()
+
+        # fn(service, edge, numRunningInstances): called for each new request once the edge is chosen (e.g., Prewarmer)
+        self.onRequest = None
 
-    def dispatch(self, switch: Switch, src: SocketAddr, dst: SocketAddr, fnFlowSetup: Callable[[SocketAddr], None]):
+    def dispatch(self,
+                 switch: Switch,
+                 src: SocketAddr,
+                 dst: SocketAddr,
+                 fnFlowSetup: Callable[[SocketAddr, int, DPID], None],
+                 fnPacketOut: Callable[[SocketAddr, DPID], None] = None):
         """
         Finds the ideal edge server for a given (virtual) ServiceID address 
-        and uses fnFlowSetup to set up the flows to/from it.
+        and uses fnFlowSetup(edgeAddr, cookie, edgeDpid, packetOut=True) to set up the flows to/from it.
+        The edge may be attached to another switch (edgeDpid); the flows need to be routed there.
+
+        If the service needs to be deployed first, the packet is parked until the deployment is ready. Then, one flow
+        per client is set up and all other parked packets are sent out with fnPacketOut. Packets parked for longer
+        than `parkMaxAge` are dropped (packetOut=False), but their flows are set up nevertheless.
 
         Returns False if no flow could be set up.
         """
@@ -56,12 +105,13 @@ class Dispatcher:
             # remember vMac
             switch.vMac = dst.mac
 
-            # REVIEW: If edge is different, we would need to route it to the other switch first (destMac = switch).
-
             service, edges = self._serviceMngr.availServers(dst)  # running instances available?
             if not service:
                 service = self._serviceMngr.service(dst)
             edge, numDeployed, numRunningInstances = self._scheduler.schedule(dpid, service, edges)
+            self._requests[service] = self._requests.get(service, 0) + 1
+            if self.onRequest and edge is not None:
+                self.onRequest(service, edge, numRunningInstances)
 
             if numRunningInstances:
                 svc = edge.vServices.get(dst)
@@ -70,29 +120,159 @@ class Dispatcher:
                     self.log.warn("No server found for service {} at switch {}.".format(dst, dpid))
                     return False
 
-                # to be called here in the main thread to avoid race conditions
-                waitOnly = self._serviceMngr.bookDeployment(service, edge)
+                key = (service, edge)
+                parked = self._parked.get(key)
+                if parked is not None:  # deployment running already -> wait for it
+                    self._park(parked, src, dst, fnFlowSetup, fnPacketOut)
+                    return True
+
+                deploying = self._serviceMngr.deployments.state(service, edge) == DeploymentState.DEPLOYING
+                if not deploying and not self._executor.accepts():  # reject quickly (before booking the deployment)
+                    self.log.warn("Deployment queue full: service {} at edge {}.".format(dst, edge.ip))
+                    return False
+                self._parked[key] = [(monotonic(), src, dst, fnFlowSetup, fnPacketOut)]
 
-                future = self._executor.submit(self._serviceMngr.deploy, service, edge, src, numDeployed, waitOnly)
-                future.add_done_callback(
-                    lambda ft: self._setUpFlow(log, fnFlowSetup, None, src, dst, edge, svc=ft.result()))
+                if not self._deploy(log, key, src, numDeployed):  # not parked -> default forwarding
+                    del self._parked[key]
+                    self.log.warn("Deployment queue full: service {} at edge {}.".format(dst, edge.ip))
+                    return False
                 return True
 
         self._setUpFlow(log, fnFlowSetup, entry, src, dst, edge, svc)
         return True
 
-    def _setUpFlow(self, log, fnFlowSetup, entry, src=None, dst=None, edge=None, svc=None):
+    def _deploy(self, log, key, src: SocketAddr, numDeployed: int) -> bool:
+        #
+        # NOTE: To be called here in the main thread to avoid race conditions (booking).
+        #
+        # Returns False if the deployment was rejected (queue full; the check in dispatch() does not cover waiting for
+        # a deployment being booked by someone else meanwhile, nor re-deployments).
+        #
+        service, edge = key
+        if self._serviceMngr.bookDeployment(service, edge):
+            # deploying already (e.g., pre-warming): wait for it without occupying a worker
+            self._serviceMngr.waitForDeployment(
+                service, edge, src,
+                lambda svc: self._runInMainLoop(partial(self._waited, log, key, src, numDeployed, svc)))
+            return True
+
+        future = self._executor.submit(edge, partial(self.deployPriority, service, edge), self._serviceMngr.deploy,
+                                       service, edge, src, numDeployed, False)
+        if future is None:
+            self._serviceMngr.deployments.resolve(service, edge, None)
+            return False
+
+        future.add_done_callback(
+            lambda ft: self._runInMainLoop(partial(self._deployed, log, key, None if ft.exception() else ft.result())))
+        return True
+
+    def _waited(self, log, key, src: SocketAddr, numDeployed: int, svc):
+        """
+        The deployment we waited for is resolved (in the main loop).
+        """
+        service, edge = key
+        state = self._serviceMngr.deployments.state(service, edge)
+
+        if svc is None and state in (DeploymentState.SCALED_DOWN, DeploymentState.DEPLOYING):
+            # scaled down (idle) while the request arrived -> scale up again (or wait for whoever does so)
+            if not self._deploy(log, key, src, numDeployed or int(service.vAddr in edge.vServices)):
+                self._deployed(log, key, None)  # queue full: drop the parked packets (dispatch() returned already)
+        else:
+            self._deployed(log, key, svc)
+
+    def deployPriority(self, service, edge) -> tuple:
+        """
+        Priority of a pending deployment (see DeployExecutor): clients waiting for it, then the popularity of the
+        service; DeployExecutor.BACKGROUND if no client is waiting (e.g., pre-warming).
+
+        NOTE: Called in an executor thread (while the main loop may park more packets).
+        """
+        parked = list(self._parked.get((service, edge)) or [])
+        if not parked:
+            return DeployExecutor.BACKGROUND
+        return len({src.ip for _, src, _, _, _ in parked}), self._requests.peek(service, 0)
+
+    @property
+    def executor(self) -> DeployExecutor:
+        return self._executor
+
+    def _runInMainLoop(self, fn):
+        #
+        # NOTE: Called in the executor thread.
+        #
+        if self._mainLoop is None:
+            fn()
+        else:
+            self._mainLoop.put(fn)
+
+    def _park(self, parked: list, src, dst, fnFlowSetup, fnPacketOut):
+
+        if len(parked) >= self._parkMaxPackets:
+            parked.pop(0)  # drop the oldest packet (the client will retransmit it)
+            self.numParkDropped += 1
+
+        parked.append((monotonic(), src, dst, fnFlowSetup, fnPacketOut))
+
+    def _deployed(self, log, key, svc):
+        """
+        Sets up one flow per client and releases all parked packets (in the main loop).
+        """
+        service, edge = key
+        parked = self._parked.pop(key, [])
+
+        if svc is None or svc.eAddr is None:
+            log.warn("Deployment of {} at edge {} failed; dropped {} packets.".format(service, edge.ip, len(parked)))
+            self.numParkDropped += len(parked)
+            return
+
+        minTime = monotonic() - self._parkMaxAge
+        entries = {}  # fwdkey -> FlowMemoryEntry
+        dropped = 0
+
+        for timestamp, src, dst, fnFlowSetup, fnPacketOut in parked:
+
+            # too old: the switch might not have buffered the packet anymore -> set up the flow, but drop the packet
+            # (the client will retransmit it)
+            stale = timestamp < minTime
+            dropped += stale
+
+            entry = entries.get((src.ip, dst))
+            if entry is None:
+                entries[(src.ip, dst)] = self._setUpFlow(log, fnFlowSetup, None, src, dst, edge, svc, not stale)
+            elif not stale:
+                if fnPacketOut:  # flow exists already -> send the packet only
+                    fnPacketOut(entry.edge, entry.dpid)
+                else:
+                    fnFlowSetup(entry.edge, entry.cookie, entry.dpid)
+
+        self.numParkDropped += dropped
+        log.info(f'#perfPark: {{"svc":"{str(service)}", "edge":"{str(edge.ip)}", "parked":{len(parked)}, ' +
+                 f'"clients":{len(entries)}, "dropped":{dropped}}}')
+
+    def _setUpFlow(self, log, fnFlowSetup, entry, src=None, dst=None, edge=None, svc=None, packetOut=True):
 
         if entry is None:
             assert (svc is not None)
-            edgeAddr = SocketAddr(svc.eAddr.ip, svc.eAddr.port, edge.switch.hosts[svc.edgeIP].mac)
+            replica = svc.replicaFor(src.ip)  # new clients are spread across the replicas
+            edgeAddr = SocketAddr(replica.ip, replica.port, edge.switch.hosts[svc.edgeIP].mac)
 
-            entry = FlowMemoryEntry(src, dst, edgeAddr)
+            entry = FlowMemoryEntry(src, dst, edgeAddr, self.flowStats.cookie(edge, svc.eAddr), edge.dpid)
             self.memory.add(entry)
             log.debug("Memorized: {}".format(entry))
 
         assert (entry.edge.mac)
-        fnFlowSetup(entry.edge)
+        fnFlowSetup(entry.edge, entry.cookie, entry.dpid, packetOut=packetOut)
+        self.flowStats.flowAdded(entry.cookie)
+        return entry
+
+    def forgetReplicas(self, replicas: list[SocketAddr]) -> list[FlowMemoryEntry]:
+        """
+        Forgets all clients sent to one of the replicas (e.g., before they are stopped): their next request is
+        dispatched again. Returns the removed entries (see EdgeRedirector.deleteFlows()).
+        """
+        entries = self.memory.removeEdges(replicas)
+        self.log.info("Forgot {} clients of replicas {}".format(len(entries), replicas))
+        return entries
 
     def findServiceID(self, switch: Switch, src: SocketAddr, dst: SocketAddr):
         """
@@ -103,6 +283,12 @@ class Dispatcher:
 
         entry = self.memory.getRet(src, dst)
 
+        if entry is None:
+            # The client might have been balanced to another replica of the same instance (SELECT group)
+            svc = self._serviceMngr.instanceFor(src)
+            if svc is not None:
+                entry = self.memory.getFwd(dst, svc.service.vAddr)
+
         if entry is None:
             return None
 
@@ -117,18 +303,46 @@ class Dispatcher:
         return entry.dst  # original destination (= ServiceID)
 
     def printClientLocations(self):
-        for ip in self.locations:
-            self.log.info("Location: {} @ {}".format(ip, self.locations[ip]))
+        for ip, dpid in self.locations.items():
+            self.log.info("Location: {} @ {}".format(ip, dpid))
+
+    def expire(self):
+        """
+        Removes idle flows and client locations (even if there is no new traffic that would trigger it).
+        """
+        self.memory.expire()
+        self.locations.expire()
+        self._requests.expire()
+
+    def memStats(self) -> dict:
+
+        stats = {"flows": self.memory.stats()}
+        stats["parked"] = {
+            "packets": sum(len(parked) for parked in self._parked.values()),
+            "deployments": len(self._parked),
+            "dropped": self.numParkDropped
+        }
+        stats["locations"] = {
+            "entries": len(self.locations),
+            "expired": self.locations.numExpired,
+            "evicted": self.locations.numEvicted
+        }
+        return stats
+
+    def queueStats(self) -> dict:
+
+        return self._executor.stats()
 
     def _setClientLocation(self, dpid: DPID, src: SocketAddr):
         prev = None
         log = self.log
         ip = src.ip
 
-        if ip in self.locations:
-            prev = self.locations[ip]
-            if prev != dpid:
-                log.info("---Migration--- {} @ {} -> {}".format(ip, prev, dpid))
+        self.locations.expire()
+
+        prev = self.locations.peek(ip)
+        if prev is not None and prev != dpid:
+            log.info("---Migration--- {} @ {} -> {}".format(ip, prev, dpid))
 
         self.locations[ip] = dpid
         log.debug("Location: {} @ {}".format(ip, dpid))
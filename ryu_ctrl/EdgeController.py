@@ -5,6 +5,10 @@ from .PortTracker import PortTracker
 from .L2TableForwarder import L2TableForwarder
 from .ServiceManager import ServiceManager
 from .EdgeRedirector import EdgeRedirector
+from .Autoscaler import Autoscaler
+from .IdleReaper import IdleReaper
+from .CapacityManager import CapacityManager
+from .Prewarmer import Prewarmer
 
 from util.RyuOpenFlow import OpenFlow
 from util.RyuDPID import DPID
@@ -13,9 +17,17 @@ from util.EdgeTools import Edge, Switches, Switch
 from util.IPAddr import IPAddr
 from util.Performance import PerfCounter
 from util.Config import Config
+from util.MainLoopQueue import MainLoopQueue
+from util.Stats import Stats
+from util.Topology import Topology
+from util.Resources import Resources
 
+from concurrent.futures import ThreadPoolExecutor as PoolExecutor
 from datetime import datetime
+from functools import partial
+from json import dumps as json_dumps
 from os import getenv as os_getenv
+from threading import Timer
 
 
 class EdgeController:
@@ -38,6 +50,12 @@ class EdgeController:
 
         self.ofPerSwitch = {}
         self._switches = Switches()
+        self._datapaths = {}  # dpid -> OpenFlow (to send requests outside of events)
+        self._redirectors = {}  # dpid -> EdgeRedirector
+        self._statsRequests = {}  # xid -> (dpid, {cookie -> [flowCount, byteCount]})
+        self._initPerf = PerfCounter()  # time to ready (see #perfInit)
+        self._init = None  # state while initializing the services of the edges
+        self._ready = False
 
         # set config vars with default values
         self._cfg = Config(os_getenv('EDGE_CONFIG'))
@@ -46,12 +64,33 @@ class EdgeController:
         self._cfg.servicesDir = "/var/emu/svcMngr/"  # default value
         self._cfg.arpSrcMac = "02:00:00:00:00:ff"
         self._cfg.flowIdleTimeout = 5
+        self._cfg.flowMemoryMaxEntries = 0  # 0: unlimited
+        self._cfg.flowMemoryMaxBytes = 0  # 0: unlimited
+        self._cfg.locationIdleTimeout = 600  # seconds
+        self._cfg.locationMaxEntries = 0  # 0: unlimited
+        self._cfg.statsInterval = 10  # seconds; 0: disabled
+        self._cfg.parkMaxPackets = 64  # max. packets parked per deployment
+        self._cfg.parkMaxAge = 10  # seconds
+        # see DeployExecutor
+        self._cfg.deployQueue = {"maxWorkers": 16, "maxPerEdge": 4, "maxQueue": 256, "reserved": 1}
+        self._cfg.popularityIdleTimeout = 600  # seconds; request counts per service (deployment priority)
+        self._cfg.popularityMaxEntries = 10000  # 0: unlimited
+        self._cfg.serviceReplicas = 1  # replicas per service instance and edge
+        self._cfg.selectGroups = False  # balance between replicas on the switch (OpenFlow SELECT groups)
+        self._cfg.autoscaler = {"enabled": False}  # see Autoscaler
+        self._cfg.reaper = {"enabled": False}  # scale idle services down to zero; see IdleReaper
+        self._cfg.prewarmer = {"enabled": False}  # deploy services ahead of time; see Prewarmer
+        self._cfg.provision = {"services": []}  # deploy with zero replicas at startup; see ServiceManager.provision()
+        self._cfg.clusters = {}  # options per cluster type: {"docker": {...}, "k8s": {...}}; see Cluster.init()
+        self._cfg.deployHistoryFile = None  # persist the deployment timings (e.g., for "coldStartAware" schedulers)
         self._cfg.useUniquePrefix = True
         self._cfg.useUniqueMask = True
         self._cfg.logPerformance = False
         self._cfg.switches = None
+        self._cfg.links = []  # see Topology
         self._cfg.logLevel = None
         self._cfg.readyFile = None
+        self._cfg.initTimeout = 60  # seconds to wait for the services of all edges before being ready
         self._cfg.scheduler = {
             "class": "ryu_ctrl.ProximityScheduler.ProximityScheduler",
             "logName": "ProxScheduler"
@@ -65,11 +104,20 @@ class EdgeController:
             self.log.setLevel(self._cfg.logLevel)
             self.log.warn("Loglevel set to " + self._cfg.logLevel)
 
+        # Work from other threads to be executed in the main loop
+        self.mainLoop = MainLoopQueue(self.logger("MainLoop"))
+
         self._serviceMngr = ServiceManager(self.logger("ServiceMngr"),
                                            self._switches,
                                            clusterGlob=self._cfg.clusterGlob,
                                            servicesGlob=self._cfg.servicesGlob,
-                                           servicesDir=self._cfg.servicesDir)
+                                           servicesDir=self._cfg.servicesDir,
+                                           replicas=self._cfg.serviceReplicas,
+                                           historyFile=self._cfg.deployHistoryFile,
+                                           clusterCfg=self._cfg.clusters,
+                                           provisionCfg=self._cfg.provision)
+
+        self._topology = Topology(self._cfg.links)
 
         # dynamically load scheduler
         #
@@ -77,9 +125,57 @@ class EdgeController:
         schedulerModule = __import__(moduleName, fromlist=[className])
         scheduler = getattr(schedulerModule, className)
 
-        self.dispatcher = Dispatcher(self.logger("Dispatcher"), self._serviceMngr,
-                                     scheduler(self.logger(self._cfg.scheduler["logName"]), self._cfg.scheduler),
-                                     self._cfg.flowIdleTimeout * 6)
+        memIdleTimeout = self._cfg.flowIdleTimeout * 6  # clients stay with their edge while remembered
+        self.dispatcher = Dispatcher(self.logger("Dispatcher"),
+                                     self._serviceMngr,
+                                     scheduler(self.logger(self._cfg.scheduler["logName"]), self._cfg.scheduler,
+                                               self._topology, self._serviceMngr.history),
+                                     memIdleTimeout=memIdleTimeout,
+                                     memMaxEntries=self._cfg.flowMemoryMaxEntries,
+                                     memMaxBytes=self._cfg.flowMemoryMaxBytes,
+                                     locIdleTimeout=self._cfg.locationIdleTimeout,
+                                     locMaxEntries=self._cfg.locationMaxEntries,
+                                     parkMaxPackets=self._cfg.parkMaxPackets,
+                                     parkMaxAge=self._cfg.parkMaxAge,
+                                     deployCfg=self._cfg.deployQueue,
+                                     popIdleTimeout=self._cfg.popularityIdleTimeout,
+                                     popMaxEntries=self._cfg.popularityMaxEntries,
+                                     mainLoop=self.mainLoop)
+
+        self.autoscaler = Autoscaler(self.logger("Autoscaler"),
+                                     self._cfg.autoscaler,
+                                     self._serviceMngr,
+                                     self.dispatcher.flowStats,
+                                     executor=self.dispatcher.executor,
+                                     mainLoop=self.mainLoop)
+
+        self.capacity = CapacityManager(self.logger("Capacity"),
+                                        self._serviceMngr,
+                                        self.dispatcher.flowStats,
+                                        minIdle=memIdleTimeout)
+        self._serviceMngr.admission = self.capacity.admit
+        self._serviceMngr.admissionDone = self.capacity.done
+        self._serviceMngr.onReplicasRemoved = self._replicasRemoved
+
+        self.reaper = IdleReaper(self.logger("Reaper"),
+                                 self._cfg.reaper,
+                                 self._serviceMngr,
+                                 self.dispatcher.flowStats,
+                                 minIdle=memIdleTimeout,
+                                 mainLoop=self.mainLoop,
+                                 isBusy=self.autoscaler.isScaling,
+                                 executor=self.dispatcher.executor)
+
+        self.prewarmer = Prewarmer(self.logger("Prewarmer"),
+                                   self._cfg.prewarmer,
+                                   self._serviceMngr,
+                                   self.capacity,
+                                   replicas=self._cfg.serviceReplicas,
+                                   executor=self.dispatcher.executor,
+                                   priority=self.dispatcher.deployPriority,
+                                   mainLoop=self.mainLoop)
+        if self.prewarmer.enabled:
+            self.dispatcher.onRequest = self.prewarmer.onRequest
 
         for dpid, sw in self._switches.items():
             for edge in sw.edges:
@@ -115,13 +211,21 @@ class EdgeController:
                              useUniquePrefix=self._cfg.useUniquePrefix,
                              useUniqueMask=self._cfg.useUniqueMask,
                              flowIdleTimeout=self._cfg.flowIdleTimeout))
-            fwds.append(
-                EdgeRedirector(self.logger("Redir", dpid),
-                               self._serviceMngr,
-                               self.dispatcher,
-                               tableID=self.EDGE_REDIR_TABLE,
-                               defaultTableID=self.DEFAULT_TABLE,
-                               flowIdleTimeout=self._cfg.flowIdleTimeout))
+            redirector = EdgeRedirector(self.logger("Redir", dpid),
+                                        self._serviceMngr,
+                                        self.dispatcher,
+                                        tableID=self.EDGE_REDIR_TABLE,
+                                        defaultTableID=self.DEFAULT_TABLE,
+                                        flowIdleTimeout=self._cfg.flowIdleTimeout,
+                                        transitTableID=self.PRESELECT_TABLE,
+                                        topology=self._topology,
+                                        datapaths=self._datapaths,
+                                        selectGroups=self._cfg.selectGroups)
+            fwds.append(redirector)
+            self._redirectors[dpid] = redirector
+            if self._cfg.selectGroups:  # group updates need to be sent from the main loop
+                self._serviceMngr.replicaListeners.append(
+                    lambda svc, edge, redir=redirector: self.mainLoop.put(partial(redir.replicasChanged, svc, edge)))
             fwds.append(
                 L2TableForwarder(self.logger("L2Fwd", dpid),
                                  table1ID=self.DEFAULT_TABLE,
@@ -133,7 +237,8 @@ class EdgeController:
                            self.PRESELECT_TABLE,
                            srcMac=self._cfg.arpSrcMac,
                            installFlow=True,
-                           fwdTable=self.DEFAULT_TABLE))
+                           fwdTable=self.DEFAULT_TABLE,
+                           onHostAdded=self._serviceMngr.hostAdded))
             fwds.append(PortTracker(self.logger("PortTracker", dpid)))
 
             # forward call to all forwarders
@@ -155,9 +260,13 @@ class EdgeController:
         # we need to temporarily store the OpenFlow object
         #
         self.ofPerSwitch[of.dpid] = of
+        self._datapaths[of.dpid] = of
 
         self.log.info("Added Switch {}: {}".format(of.dpid, switch))
 
+        for ip in list(switch.hosts):  # reconnected: the known hosts are reachable again
+            self._serviceMngr.hostAdded(of.dpid, ip)
+
         # check if all switches are connected already
         #
         if not len([dpid for (dpid, sw) in self._switches.items() if sw.ports is None]):
@@ -172,22 +281,112 @@ class EdgeController:
 
             # get data about all services from the attached clusters
             #
-            for dpid, sw in self._switches.items():
-                for edge in sw.edges:
-                    if edge and edge.cluster:
-                        self._serviceMngr.initServices(edge)
+            self._initEdges([edge for sw in self._switches.values() for edge in sw.edges if edge and edge.cluster])
 
-            self.log.info("")
-            self.log.info("")
-            self.log.warn("**** Fully connected. ****")
-            self.log.info("")
-            self.log.info("")
+    def _replicasRemoved(self, svc, edge: Edge, replicas: list):
+        """
+        Forgets the clients of the removed replicas and deletes their flows on all switches (before the replicas are
+        stopped; see ServiceManager.updateReplicas()).
+        """
+        entries = self.dispatcher.forgetReplicas(replicas)
+        for dpid, redirector in self._redirectors.items():
+            of = self._datapaths.get(dpid)
+            if of is not None:
+                redirector.deleteFlows(of, entries, replicas)
 
-            # signal being ready by creating a file
-            #
-            if self._cfg.readyFile:
-                fp = open(self._cfg.readyFile, 'x')  # 'x': fail if file already exists
-                fp.close()
+    def disconnected(self, of: OpenFlow):
+
+        switch = self._switches.get(of.dpid)
+        if switch is None:  # configured switches only
+            return
+
+        self._datapaths.pop(of.dpid, None)
+        self.log.warn("Switch {} disconnected.".format(of.dpid))
+
+        for ip in list(switch.hosts):  # not reachable anymore (until the switch is connected again)
+            self._serviceMngr.hostRemoved(of.dpid, ip)
+
+    def _initEdges(self, edges: list[Edge]):
+        """
+        Fetches the services of all edges concurrently; the results are merged in the main loop. We are ready when all
+        edges have reported or `initTimeout` has passed (late results are still merged).
+        """
+        self._init = {"pending": set(edges), "connect": self._initPerf.ms(), "fetch": 0, "merge": 0, "failed": 0}
+
+        if not edges:
+            return self._initDone(timedOut=False)
+
+        executor = PoolExecutor(max_workers=min(len(edges), 16), thread_name_prefix="InitEdge")
+        for edge in edges:
+            future = executor.submit(self._fetchServices, edge)
+            future.add_done_callback(lambda f, edge=edge: self.mainLoop.put(partial(self._edgeInitialized, edge, f)))
+        executor.shutdown(wait=False)
+
+        self._initTimer = Timer(self._cfg.initTimeout, lambda: self.mainLoop.put(self._initTimeout))
+        self._initTimer.daemon = True
+        self._initTimer.start()
+
+    def _fetchServices(self, edge: Edge):
+
+        perf = PerfCounter()
+        return self._serviceMngr.fetchServices(edge), perf.ms()
+
+    def _edgeInitialized(self, edge: Edge, future):
+        """
+        Called from the main loop.
+        """
+        perf = PerfCounter()
+        try:
+            svcInstances, fetchTime = future.result()
+            self._serviceMngr.addServices(edge, svcInstances)
+        except Exception as e:
+            self.log.error(f"Cannot initialize services of edge {edge.ip}: {e}")
+            self._serviceMngr.clusterLost(edge)
+            svcInstances, fetchTime = [], 0
+            self._init["failed"] += 1
+
+        mergeTime = perf.ms()
+        self._init["fetch"] = max(self._init["fetch"], fetchTime)
+        self._init["merge"] += mergeTime
+        self.log.warn(f'#perfInitEdge: {{"edge":"{edge.ip}", "services":{len(svcInstances)}, ' +
+                      f'"fetch":{round(fetchTime)}, "merge":{round(mergeTime)}, "late":{str(self._ready).lower()}}}')
+
+        self._init["pending"].discard(edge)
+        if not self._init["pending"] and not self._ready:
+            self._initTimer.cancel()
+            self._initDone(timedOut=False)
+
+    def _initTimeout(self):
+        """
+        Called from the main loop.
+        """
+        if not self._ready:
+            for edge in self._init["pending"]:
+                self.log.error(f"Edge {edge.ip} did not report its services within {self._cfg.initTimeout}s")
+            self._initDone(timedOut=True)
+
+    def _initDone(self, timedOut: bool):
+
+        self._ready = True
+        connectTime, totalTime = self._init["connect"], self._initPerf.ms()
+
+        self.log.info("")
+        self.log.info("")
+        self.log.warn("**** Fully connected. ****")
+        self.log.info("")
+        self.log.info("")
+
+        self.log.warn(f'#perfInit: {{"connect":{round(connectTime)}, "services":{round(totalTime - connectTime)}, ' +
+                      f'"fetch":{round(self._init["fetch"])}, "merge":{round(self._init["merge"])}, ' +
+                      f'"total":{round(totalTime)}, "pending":{len(self._init["pending"])}, ' +
+                      f'"failed":{self._init["failed"]}, "timedOut":{str(timedOut).lower()}, ' +
+                      f'"ts":{datetime.now().timestamp()}}}')
+
+        # signal being ready by creating a file
+        #
+        if self._cfg.readyFile:
+            fp = open(self._cfg.readyFile, 'x')  # 'x': fail if file already exists
+            fp.close()
 
     def packetIn(self, of: OpenFlow):
 
@@ -212,6 +411,9 @@ class EdgeController:
             return
 
         msg = of.msg
+        if Stats.category(msg.cookie) == Stats.REDIR_EDGE:
+            self.dispatcher.flowStats.flowRemoved(msg.cookie, msg.packet_count, msg.byte_count)
+
         if (msg.reason == of.proto.OFPRR_IDLE_TIMEOUT):
 
             self.log.info('-=FLOW tbl=%d src=%s:%s dst=%s:%s proto=%s cookie=%d %dsec packets=%d bytes=%d',
@@ -225,8 +427,72 @@ class EdgeController:
     def aggregateStats(self, of: OpenFlow):
 
         body = of.msg.body
-        self.log.info('AggregateStats: xid=%d packet_count=%d byte_count=%d '
-                      'flow_count=%d', of.msg.xid, body.packet_count, body.byte_count, body.flow_count)
+        self.log.debug('AggregateStats: xid=%d packet_count=%d byte_count=%d '
+                       'flow_count=%d', of.msg.xid, body.packet_count, body.byte_count, body.flow_count)
+
+    def flowStats(self, of: OpenFlow):
+        """
+        Sums up the flows per cookie of a FlowStatsReply (the reply may be split into several messages).
+        """
+        request = self._statsRequests.get(of.msg.xid)
+        if request is None:
+            return
+
+        dpid, counters = request
+        for flow in of.msg.body:
+            counter = counters.setdefault(flow.cookie, [0, 0])  # cookie -> [flowCount, byteCount]
+            counter[0] += 1
+            counter[1] += flow.byte_count
+
+        if not of.msg.flags & of.proto.OFPMPF_REPLY_MORE:
+            del self._statsRequests[of.msg.xid]
+            self.dispatcher.flowStats.update(dpid, counters)
+
+    @property
+    def statsInterval(self):
+        return self._cfg.statsInterval
+
+    def housekeeping(self):
+        """
+        Called periodically (every `statsInterval` seconds) from the main loop.
+        """
+        self.dispatcher.expire()
+        self.requestFlowStats()
+        self.log.info("#memStats: " + json_dumps(self.dispatcher.memStats()))
+        self.log.warn("#deployStats: " + json_dumps(self._serviceMngr.deployments.stats()))
+        self.log.warn("#deployQueueStats: " + json_dumps(self.dispatcher.queueStats()))
+        self.log.warn("#probeStats: " + json_dumps(self._serviceMngr.prober.stats()))
+        self._serviceMngr.history.save()
+
+        if self.autoscaler.enabled:
+            self.autoscaler.run()
+            self.log.warn("#scaleStats: " + json_dumps(self.autoscaler.stats()))
+
+        if self.reaper.enabled:
+            self.reaper.run()
+            self.log.warn("#reapStats: " + json_dumps(self.reaper.stats()))
+
+        if self.prewarmer.enabled:
+            self.prewarmer.run()
+            self.log.warn("#prewarmStats: " + json_dumps(self.prewarmer.stats()))
+
+        if self.capacity.numEvicted or self.capacity.numRejected:
+            self.log.warn("#capacityStats: " + json_dumps(self.capacity.stats()))
+
+    def requestFlowStats(self):
+        """
+        Requests the live flow statistics of all service instances from all switches: a single request per switch
+        for all flows with an instance cookie (the cookie mask matches the category only).
+        """
+        self._statsRequests = {}  # ignore any late replies to previous requests
+
+        flowStats = self.dispatcher.flowStats
+        flowStats.expire({(edge, svc.eAddr) for edge, svc in self._serviceMngr.instances()})
+
+        for dpid, of in self._datapaths.items():
+            request = of.FlowStatsRequest().table(self.EDGE_REDIR_TABLE)
+            xid = request.cookie(flowStats.category, Stats.CATEGORY_MASK).send()
+            self._statsRequests[xid] = (dpid, {})
 
     def logger(self, name, dpid=None):
         #
@@ -247,5 +513,5 @@ class EdgeController:
 
             for edgeCfg in switchCfg['edges']:
                 edge = Edge(edgeCfg['ip'], switch, edgeCfg.get('target'), edgeCfg['serviceCidr'],
-                            edgeCfg.get('scheduler'))
+                            edgeCfg.get('scheduler'), Resources.fromCfg(edgeCfg.get('capacity')))
                 switch.edges.append(edge)
@@ -3,6 +3,7 @@ from .Dispatcher import Dispatcher
 from util.SocketAddr import SocketAddr
 from util.RyuOpenFlow import OpenFlow, Packet
 from util.Stats import Stats
+from util.Topology import Topology
 from logging import DEBUG, INFO
 
 from functools import partial
@@ -11,15 +12,31 @@ from functools import partial
 class EdgeRedirector:
     """
     Redirects requests for registered services to edge nodes.
+
+    If the edge is attached to another switch, the flows along the path (see Topology) are installed as well:
+    the packets are rewritten at the first switch (forward) and at the edge's switch (return) only; all switches in
+    between forward them in the transit table.
+
+    With `selectGroups`, a service instance with several replicas at a local edge gets an OpenFlow SELECT group
+    (one bucket per replica). The forward flows point at the group: the switch hashes the connections across the
+    replicas (the first packet is sent through the group as well). The forward flows still match the client IP: each
+    new client is dispatched (and its flows counted) by the controller. The groups are updated whenever the replicas
+    change.
     """
 
+    TRANSIT_PRIORITY = 2  # higher than the preselect rules, lower than the ARP rule
+
     def __init__(self,
                  log,
                  serviceMngr: ServiceManager,
                  dispatcher: Dispatcher,
                  tableID,
                  defaultTableID,
-                 flowIdleTimeout=10):
+                 flowIdleTimeout=10,
+                 transitTableID=None,
+                 topology: Topology = None,
+                 datapaths: dict = None,
+                 selectGroups=False):
 
         self.log = log
         self._serviceMngr: ServiceManager = serviceMngr
@@ -27,6 +44,13 @@ class EdgeRedirector:
         self.table = tableID
         self.defaultTable = defaultTableID
         self.idleTimeout = flowIdleTimeout
+        self.transitTable = transitTableID
+        self.topology = topology
+        self._datapaths = datapaths  # dpid -> OpenFlow (of all connected switches)
+
+        self.selectGroups = selectGroups
+        self._groups = {}  # (dpid, vAddr, edgeIP) -> [groupID, replicas, isUDP, edgeMac]
+        self._nextGroupID = {}  # dpid -> groupID
 
         self.isDebugLogLevel = log.isEnabledFor(DEBUG)
         self.isInfoLogLevel = log.isEnabledFor(INFO)
@@ -37,6 +61,9 @@ class EdgeRedirector:
         log.info("Connected.")
 
         of.FlowMod().table(self.table).clearTable()
+        if self.selectGroups:
+            of.GroupMod().delete()  # all groups
+            self._groups = {key: group for key, group in self._groups.items() if key[0] != of.dpid}
 
         # Fallthrough rule for user table: send to controller
         #
@@ -74,37 +101,200 @@ class EdgeRedirector:
         #
         #  It's for our service IP
         #
-        fnFlowSetup = partial(self._fwdToEdge, log, of, packet, src, dst)  # fn(edge)
+        fnFlowSetup = partial(self._fwdToEdge, log, of, packet, src, dst)  # fn(edge, cookie, dpid)
+        fnPacketOut = partial(self._packetOutToEdge, of, packet, dst)  # fn(edge, dpid)
 
-        if not self.dispatcher.dispatch(of.switch, src, dst, fnFlowSetup):
+        if not self.dispatcher.dispatch(of.switch, src, dst, fnFlowSetup, fnPacketOut):
             log.warn("No servers available for %s --> regular forwarding.", dst)
             return False
         return True
 
-    def _fwdToEdge(self, log, of, packet, src, dst, edge):
+    def _fwdToEdge(self, log, of, packet, src, dst, edge, cookie=Stats.REDIR_EDGE, dpid=None, packetOut=True):
         """
         Set up table entry towards selected server.
+
+        The cookie identifies the service instance in the flow statistics. `dpid`: The switch the edge is attached to.
+        `packetOut`: False if the packet is too old to be sent (the flow is set up nevertheless).
         """
         match = of.Match().srcIP(src.ip).dstIP(dst.ip).dstPort(dst.port)  # no srcPort
+        if not packetOut:
+            of.discardPacket()
+
+        svc = self._serviceMngr.instanceFor(edge) if self.selectGroups and not self._isRemote(of, dpid) else None
+        if svc is not None and len(svc.replicas) > 1:
+            self._fwdToGroup(log, of, packet, src, dst, edge, svc, match, cookie, packetOut)
+            return
+
+        actions = self._toEdgeActions(of, packet, dst, edge, dpid)
+        self.redirect(of, match, actions, packetOut=packetOut, cookie=cookie)
+
+        if self._isRemote(of, dpid):
+            self._setUpPath(log, of, src, dst, edge, dpid)
+        else:
+            # Install return flow proactively (instead of waiting for the packet-in) to speed things up.
+            # Nevertheless, we still need to monitor the return path:
+            #    * the response might come earlier than the FlowMod
+            #
+            self.fwdFromEdge(log, of, packet, edge, src, proactive=True)  # ignore result since this is optional
+
+        if self.isDebugLogLevel:
+            of.debug(log)  # takes a few milliseconds
+        if self.isInfoLogLevel:
+            log.info("==> {} -> {} ({}) => {} ({}) |t{}|l={}".format(src, dst, dst.mac, edge, edge.mac, of.msg.table_id,
+                                                                     of.msg.total_len))
+
+    def _fwdToGroup(self, log, of, packet, src, dst, edge, svc, match, cookie, packetOut=True):
+        """
+        Set up table entry towards the SELECT group of the service instance (and the return flows of all replicas).
+        """
+        groupID = self._group(of, svc, edge.mac, packet.isUDP())
+
+        # the packet itself is sent through the group as well: the switch hashes it to the same replica as the rest of
+        # the connection (not necessarily the one chosen by the Dispatcher)
+        actions = of.Action().group(groupID)
+        self.redirect(of, match, actions, packetOut=actions if packetOut else False, cookie=cookie)
+
+        outport = of.switch.portFor(of.src.mac)
+        for replica in svc.replicas:
+            self._fromEdge(of, packet, SocketAddr(replica.ip, replica.port, edge.mac), src, dst, outport)
+
+        if self.isInfoLogLevel:
+            log.info("==> {} -> {} ({}) => group {} {}".format(src, dst, dst.mac, groupID, svc.replicas))
+
+    def _group(self, of, svc, edgeMac, isUDP: bool):
+        """
+        Returns the ID of the SELECT group for this service instance at the switch (installs it if necessary).
+        """
+        key = (of.dpid, svc.service.vAddr, svc.edgeIP)
+        group = self._groups.get(key)
+
+        if group is None:
+            groupID = self._nextGroupID.get(of.dpid, 1)
+            self._nextGroupID[of.dpid] = groupID + 1
+
+            group = self._groups[key] = [groupID, list(svc.replicas), isUDP, edgeMac]
+            of.GroupMod().group(groupID).buckets(self._buckets(of, svc.service.vAddr, group)).add()
+            of.BarrierRequest().send()  # the group must exist before the FlowMod/PacketOut using it
+            self.log.info("Group {} @ {}: {} {}".format(groupID, of.dpid, svc.service, svc.replicas))
+
+        return group[0]
+
+    def _buckets(self, of, vAddr, group):
+
+        _, replicas, isUDP, edgeMac = group
+        outport = of.switch.portFor(edgeMac)
+
+        buckets = []
+        for replica in replicas:
+            port = replica.port if replica.port != vAddr.port else None
+            buckets.append(of.Action().setUDP(isUDP).setDestination(edgeMac, replica.ip.ip, port).outport(outport))
+        return buckets
+
+    def replicasChanged(self, svc, edge):
+        """
+        Updates the SELECT group of the service instance (if any) to the current replicas (in the main loop).
+
+        Without replicas, the group is deleted (incl. all flows pointing at it).
+        """
+        key = (edge.dpid, svc.service.vAddr, svc.edgeIP)
+        group = self._groups.get(key)
+        of = self._datapaths.get(edge.dpid)
+
+        if group is None or of is None or group[1] == svc.replicas:
+            return
+
+        group[1] = list(svc.replicas)
+        if group[1]:
+            of.GroupMod().group(group[0]).buckets(self._buckets(of, svc.service.vAddr, group)).modify()
+        else:
+            of.GroupMod().group(group[0]).delete()
+            del self._groups[key]
+        self.log.info("Group {} @ {}: {} {}".format(group[0], edge.dpid, svc.service, svc.replicas))
+
+    def deleteFlows(self, of, entries, replicas):
+        """
+        Deletes the forward flows of the clients (FlowMemoryEntries) and all flows from/to the replicas at the switch
+        (e.g., before the replicas are stopped). The next packets are sent to the controller again.
+        """
+        for proto in (of.IPPROTO_TCP, of.IPPROTO_UDP):  # the flows were set up for the protocol of the first packet
+            for entry in entries:
+                match = of.Match().srcIP(entry.src.ip).dstIP(entry.dst.ip).dstPort(entry.dst.port, proto)
+                of.FlowMod().table(self.table).match(match).delete()
+
+            for replica in replicas:
+                of.FlowMod().table(self.table).match(of.Match().srcIP(replica.ip).srcPort(replica.port, proto)).delete()
+                if self.transitTable is not None:  # see _setUpPath()
+                    for match in (of.Match().dstIP(replica.ip).dstPort(replica.port, proto),
+                                  of.Match().srcIP(replica.ip).srcPort(replica.port, proto)):
+                        of.FlowMod().table(self.transitTable).match(match).delete()
+
+    def _packetOutToEdge(self, of, packet, dst, edge, dpid=None):
+        """
+        Sends the packet towards the selected server (the flow has been set up already).
+        """
+        of.PacketOut().actions(self._toEdgeActions(of, packet, dst, edge, dpid)).send()
 
-        outport = of.switch.portFor(edge.mac)
+    def _toEdgeActions(self, of, packet, dst, edge, dpid=None):
 
-        actions = of.Action().setUDP(packet.isUDP()).setDestination(
+        if self._isRemote(of, dpid):
+            outport = self.topology.nextPort(of.dpid, dpid)
+        else:
+            outport = of.switch.portFor(edge.mac)
+
+        return of.Action().setUDP(packet.isUDP()).setDestination(
             edge.mac, edge.ip.ip, edge.port if edge.port != dst.port else None).outport(outport)
-        self.redirect(of, match, actions, packetOut=True)
 
-        # Install return flow proactively (instead of waiting for the packet-in) to speed things up.
-        # Nevertheless, we still need to monitor the return path:
-        #    * the response might come earlier than the FlowMod
-        #    * the FlowMod towards the edge server might be in a different switch!
+    def _isRemote(self, of, dpid):
+
+        return dpid is not None and dpid != of.dpid and self.topology is not None
+
+    def _setUpPath(self, log, of, src, dst, edge, dpid):
+        """
+        Installs the forward and return flows on all switches along the path to the edge in one step.
+
+        NOTE: Matches and actions are built with the OpenFlow object of the first switch (same protocol version).
+        """
+        path = self.topology.path(of.dpid, dpid)  # [(dpid, outport)]: from the first switch up to the edge's switch
+        if not path:
+            log.warn("No path from {} to {}.".format(of.dpid, dpid))
+            return
+
+        fwdMatch = of.Match().srcIP(src.ip).dstIP(edge.ip).dstPort(edge.port)  # rewritten at the first switch
+        retMatch = of.Match().srcIP(dst.ip).srcPort(dst.port).dstIP(src.ip)  # rewritten at the edge's switch
+
+        # first switch: return flow to the client
         #
-        self.fwdFromEdge(log, of, packet, edge, src, proactive=True)  # ignore result since this is optional
+        self._transit(of, retMatch, of.Action().outport(of.switch.portFor(of.src.mac)))
+
+        switches = [hopDpid for hopDpid, _ in path[1:]] + [dpid]
+        for i, hopDpid in enumerate(switches):
+
+            hopOf = self._datapaths.get(hopDpid)
+            if hopOf is None:
+                log.warn("Switch {} on path to {} not connected.".format(hopDpid, edge))
+                return
+
+            isLast = (hopDpid == dpid)
+            fwdPort = hopOf.switch.portFor(edge.mac) if isLast else path[i + 1][1]
+            retPort = self.topology.nextPort(hopDpid, path[i][0])  # towards the previous switch
+
+            self._transit(hopOf, fwdMatch, of.Action().outport(fwdPort))
+
+            if isLast:  # edge's switch: rewrite the response BACK to the client
+                match = of.Match().srcIP(edge.ip).srcPort(edge.port).dstIP(src.ip)
+                actions = of.Action().setUDP(of.packet().isUDP()).setSource(
+                    dst.mac, dst.ip.ip, dst.port if dst.port != edge.port else None).outport(retPort)
+                self._transit(hopOf, match, actions)
+            else:
+                self._transit(hopOf, retMatch, of.Action().outport(retPort))
 
-        if self.isDebugLogLevel:
-            of.debug(log)  # takes a few milliseconds
         if self.isInfoLogLevel:
-            log.info("==> {} -> {} ({}) => {} ({}) |t{}|l={}".format(src, dst, dst.mac, edge, edge.mac, of.msg.table_id,
-                                                                     of.msg.total_len))
+            log.info("==> {} -> {} => {} via {}".format(src, dst, edge, [str(hop) for hop, _ in path] + [str(dpid)]))
+
+    def _transit(self, of, match, actions):
+
+        of.FlowMod().table(self.transitTable).priority(self.TRANSIT_PRIORITY).cookie(Stats.REDIR_EDGE).idleTimeout(
+            self.idleTimeout).match(match).actions(actions).send()
 
     def fwdFromEdge(self, log, of: OpenFlow, packet: Packet, src: SocketAddr, dst: SocketAddr, proactive=False):
         #
@@ -116,21 +306,24 @@ class EdgeRedirector:
             log.warn("No memory for %s/%s --> regular forwarding.", src, dst)
             return False
 
-        match = of.Match().srcIP(src.ip).srcPort(src.port).dstIP(dst.ip)  # no dstPort
-
         outport = of.switch.portFor(of.src.mac if proactive else of.dst.mac)
+        self._fromEdge(of, packet, src, dst, serviceID, outport, packetOut=not proactive)
+
+        if (not proactive) and self.isInfoLogLevel:
+            log.info("<== {} <= {} ({}) @@ {} ({}) |t{}|l={}".format(dst, serviceID, serviceID.mac, src, src.mac,
+                                                                     of.msg.table_id, of.msg.total_len))
+        return True
+
+    def _fromEdge(self, of, packet, src, dst, serviceID, outport, packetOut=False):
+
+        match = of.Match().srcIP(src.ip).srcPort(src.port).dstIP(dst.ip)  # no dstPort
 
         # ATTENTION: We must NOT go through a default forwarder afterwards (without faking the inport), since we would
         # confuse it with a fake combination of inport + vMac!! An L2 forwarder might learn the wrong out_port for vMac.
         #
         actions = of.Action().setUDP(packet.isUDP()).setSource(
             serviceID.mac, serviceID.ip.ip, serviceID.port if serviceID.port != src.port else None).outport(outport)
-        self.redirect(of, match, actions, packetOut=not proactive)
-
-        if (not proactive) and self.isInfoLogLevel:
-            log.info("<== {} <= {} ({}) @@ {} ({}) |t{}|l={}".format(dst, serviceID, serviceID.mac, src, src.mac,
-                                                                     of.msg.table_id, of.msg.total_len))
-        return True
+        self.redirect(of, match, actions, packetOut=packetOut)
 
     def redirectDefault(self, of: OpenFlow, src: SocketAddr, dst: SocketAddr, outport):
 
@@ -142,9 +335,10 @@ class EdgeRedirector:
 
         self.redirect(of, match, actions, packetOut=outport)
 
-    def redirect(self, of, match, actions, packetOut=False):
+    def redirect(self, of, match, actions, packetOut=False, cookie=None):
 
-        cookie = Stats.REDIR_EDGE if isinstance(packetOut, bool) else Stats.REDIR_DEFAULT
+        if cookie is None:
+            cookie = Stats.REDIR_EDGE if isinstance(packetOut, bool) else Stats.REDIR_DEFAULT
 
         of.FlowMod().table(self.table).cookie(cookie).idleTimeout(self.idleTimeout,
                                                                   notify=True).match(match).actions(actions,
@@ -0,0 +1,141 @@
+from __future__ import annotations
+
+from util.DeployExecutor import DeployExecutor
+from util.EdgeTools import Edge
+from util.Service import ServiceInstance
+from util.Stats import FlowStatsRegistry
+from util.MainLoopQueue import MainLoopQueue
+from util.Performance import PerfCounter
+from .ServiceManager import ServiceManager
+
+from functools import partial
+from time import time
+
+
+class IdleReaper:
+    """
+    Scales idle service instances down to zero (the deployment is kept for a fast scale-up).
+
+    An instance is idle if it has no active flows and neither a flow was set up nor removed within its grace period
+    (see FlowStats.lastActive). Instances that have never been used count from the time they were first seen.
+
+    No race with new requests: The reaper books the instance in the DeploymentRegistry and marks it as not running
+    before it scales it down. A request arriving meanwhile waits for the reaper and then scales the instance up again
+    (see ServiceManager.deploy()).
+
+    The scale-downs run in the DeployExecutor (shared with the Dispatcher) as background tasks.
+
+    Config (all optional):
+        "enabled": false
+        "idleTimeout": Default grace period in seconds (default: 300).
+        "services": {"<label or ip:port>": seconds}: Grace period per service (0: never scale down).
+    """
+
+    def __init__(self,
+                 log,
+                 cfg: dict,
+                 serviceMngr: ServiceManager,
+                 flowStats: FlowStatsRegistry,
+                 minIdle=0,
+                 mainLoop: MainLoopQueue = None,
+                 isBusy=None,
+                 executor: DeployExecutor = None):
+
+        self.log = log
+        self._serviceMngr = serviceMngr
+        self._flowStats = flowStats
+        self._mainLoop = mainLoop
+        self._isBusy = isBusy  # fn(svc, edge) -> True if the instance must not be touched (e.g., rescaling)
+        self._executor = executor or DeployExecutor(log, {"maxWorkers": 2})
+
+        self.enabled = cfg.get("enabled", False)
+        self.idleTimeout = cfg.get("idleTimeout", 300)
+        self.graceByService = cfg.get("services", {})
+        self.minIdle = minIdle  # e.g., the timeout of the FlowMemory: no client must remember the instance
+
+        self._firstSeen = {}  # (vAddr, edge) -> timestamp
+        self._reaping = set()  # (vAddr, edge)
+        self.numReaped = 0
+
+    def gracePeriod(self, svc: ServiceInstance):
+
+        service = svc.service
+        grace = self.graceByService.get(service.label, self.graceByService.get(str(service.vAddr), self.idleTimeout))
+        return max(grace, self.minIdle) if grace else 0
+
+    def run(self):
+        """
+        Starts scaling down all idle instances (in the main loop; called periodically).
+        """
+        if not self.enabled:
+            return
+
+        curTime = time()
+
+        for edge, svc in self._serviceMngr.instances():
+
+            key = (svc.service.vAddr, edge)
+            if key in self._reaping or not svc.deployment or not svc.deployment.ready_replicas:
+                self._firstSeen.pop(key, None)
+                continue
+
+            firstSeen = self._firstSeen.setdefault(key, curTime)
+            grace = self.gracePeriod(svc)
+            stats = self._flowStats.stats(edge, svc.eAddr)
+
+            if not grace or (stats and stats.activeFlows):
+                continue
+            if curTime - max(firstSeen, stats.lastActive if stats else 0) < grace:
+                continue
+            if self._isBusy and self._isBusy(svc, edge):
+                continue
+
+            self._reap(edge, svc)
+
+    def _reap(self, edge: Edge, svc: ServiceInstance):
+
+        if self._executor.full():
+            return  # try again in the next run
+
+        # not running anymore from now on: new requests will wait for us (and scale it up again)
+        #
+        if not self._serviceMngr.release(edge, svc):
+            return  # a deployment is running
+
+        key = (svc.service.vAddr, edge)
+        self._reaping.add(key)
+        self._firstSeen.pop(key, None)
+
+        future = self._executor.submit(edge, lambda: DeployExecutor.BACKGROUND, self._reapFunc, edge, svc)
+        future.add_done_callback(lambda ft: self._runInMainLoop(partial(self._reaped, key, ft)))
+
+    def _reapFunc(self, edge: Edge, svc: ServiceInstance):
+        #
+        # NOTE: Called in the executor thread.
+        #
+        startTime_s = time()
+        perf = PerfCounter()
+
+        self._serviceMngr.scaleDown(edge, svc)
+
+        self.log.warn(f'#perfReap: {{"svc":"{str(svc.service)}", "edge":"{str(edge.ip)}", ' +
+                      f'"total":{round(perf.ms())}, "ts":{startTime_s}}}')
+
+    def _reaped(self, key, future):
+
+        self._reaping.discard(key)
+        if future.exception():
+            self.log.error(f"Scale down failed for {key[0]} @ {key[1].ip}: {future.exception()}")
+        else:
+            self.numReaped += 1
+
+    def _runInMainLoop(self, fn):
+
+        if self._mainLoop is None:
+            fn()
+        else:
+            self._mainLoop.put(fn)
+
+    def stats(self) -> dict:
+
+        return {"reaping": len(self._reaping), "reaped": self.numReaped}
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+from util.EdgeTools import Edge
+from util.Service import Service
+from util.RyuDPID import DPID
+from util.Topology import Topology
+from util.DeployHistory import DeployHistory
+from .ProximityScheduler import ProximityScheduler
+from logging import DEBUG
+
+
+class LoadAwareScheduler(ProximityScheduler):
+    """
+    Selects the least loaded edge for a given request to an edge service.
+
+    The load of an edge is derived from the live flow statistics (`edge.stats`: active flows from FlowMod/FlowRemoved,
+    resynced by AggregateStats; byte rate from AggregateStats) and the number of service instances at the edge.
+    Edges without a running instance get a penalty for the cold start. Thus, a running instance is preferred as long as
+    it has capacity left; new clients are spread across the other edges otherwise.
+
+    The path cost to the edge is added as well (see ProximityScheduler.distance()); unreachable edges are ignored.
+
+    Config (all optional):
+        "flowsPerInstance": Flows that a single service instance can handle (default: 100).
+        "bytesPerInstance": Bytes/s that a single service instance can handle (default: 0 = ignore).
+        "instancesPerEdge": Service instances that a single edge can handle (default: 100).
+        "weights": {"flows": 1.0, "bytes": 1.0, "instances": 1.0}
+        "scaleUpPenalty": Cost of a scale-up from zero (default: 0.5).
+        "deployPenalty": Cost of a new deployment (default: 1.0).
+        "distanceWeight": Cost per unit of path cost (default: 0.01).
+        "coldStartAware": Use the predicted cold start instead of the fixed penalties (default: false).
+        "coldStartWeight": Cost per second of predicted cold start (default: 0.5).
+        "maxCost", "coldStart": see ProximityScheduler.
+    """
+
+    def __init__(self, log, cfg: dict, topology: Topology = None, history: DeployHistory = None):
+
+        super().__init__(log, cfg, topology, history)
+
+        self.flowsPerInstance = cfg.get("flowsPerInstance", 100)
+        self.bytesPerInstance = cfg.get("bytesPerInstance", 0)
+        self.instancesPerEdge = cfg.get("instancesPerEdge", 100)
+        self.scaleUpPenalty = cfg.get("scaleUpPenalty", 0.5)
+        self.deployPenalty = cfg.get("deployPenalty", 1.0)
+        self.distanceWeight = cfg.get("distanceWeight", 0.01)
+        self.coldStartWeight = cfg.get("coldStartWeight", 0.5)
+
+        weights = cfg.get("weights", {})
+        self.wFlows = weights.get("flows", 1.0)
+        self.wBytes = weights.get("bytes", 1.0)
+        self.wInstances = weights.get("instances", 1.0)
+
+    def schedule(self, dpid: DPID, service: Service, edges: list[Edge, int, int]) -> tuple[Edge, int, int]:
+        # input: list of [edge, numDeployedInstancesInEdge, numRunningInstancesInEdge]
+
+        costs = [(self.cost(dpid, *choice, service=service), choice) for choice in edges]
+        costs = [(cost, choice) for (cost, choice) in costs if cost is not None]  # reachable only
+        if not len(costs):
+            return (None, None, None)
+
+        if self.log.isEnabledFor(DEBUG):
+            self.log.debug("{}: {}".format(service, [(str(c[0].ip), round(cost, 3)) for cost, c in costs]))
+
+        return min(costs, key=lambda choice: choice[0])[1]
+
+    def cost(self, dpid: DPID, edge: Edge, numDeployed: int, numRunning: int, service: Service = None) -> float:
+        """
+        Returns the cost of choosing this edge; None if it is not reachable.
+        """
+        distance = self.distance(dpid, edge)
+        if distance is None:
+            return None
+
+        cost = self.load(edge) + self.distanceWeight * distance
+
+        if not numRunning:
+            if self.coldStartAware and service is not None:
+                cost += self.coldStartWeight * self.coldStart(service, edge, numDeployed, numRunning) / 1000
+            else:
+                cost += self.scaleUpPenalty if numDeployed else self.deployPenalty
+        return cost
+
+    def load(self, edge: Edge) -> float:
+        """
+        Returns the utilization of the edge (0 = idle, 1 = fully loaded; may be > 1 if overloaded).
+        """
+        stats = edge.stats
+        numInstances = max(1, len(edge.vServices))
+
+        load = self.wFlows * stats.activeFlows / (self.flowsPerInstance * numInstances)
+        if self.bytesPerInstance:
+            load += self.wBytes * stats.byteRate / (self.bytesPerInstance * numInstances)
+        load += self.wInstances * len(edge.vServices) / self.instancesPerEdge
+        return load
@@ -0,0 +1,265 @@
+from __future__ import annotations
+
+from util.EdgeTools import Edge
+from util.Service import Service
+from util.MainLoopQueue import MainLoopQueue
+from util.DeploymentRegistry import DeploymentState
+from util.Resources import Resources
+from util.Performance import PerfCounter
+from util.AgingDict import AgingDict
+from util.DeployExecutor import DeployExecutor
+from .ServiceManager import ServiceManager
+from .CapacityManager import CapacityManager
+
+from functools import partial
+from time import time
+
+
+class _Pattern:
+    """
+    Request pattern of a service at an edge.
+    """
+
+    def __init__(self, service: Service, numSlots: int):
+
+        self.service = service
+        self.count = 0  # requests since the last update
+        self.rate = 0.0  # requests/s (EWMA)
+        self.seasonal = [0.0] * numSlots  # requests per time-of-day slot (EWMA across days)
+        self.slot = None  # current slot
+        self.slotCount = 0  # requests within the current slot
+
+
+class Prewarmer:
+    """
+    Deploys (or scales up) services ahead of time at the edges where their requests arrive.
+
+    Learns from the new requests seen by the Dispatcher (Dispatcher.onRequest) per service and edge:
+    - recent rate: EWMA of the requests per second,
+    - seasonality: EWMA across days of the requests per time-of-day slot.
+
+    Expected requests within the next `horizon` seconds = max(rate, rate of the upcoming slot) * horizon. If that is at
+    least `minRequests` and the service is not running at the edge, it is deployed via ServiceManager.deploy() (i.e.
+    the usual Cluster.deploy/scale paths; requests arriving meanwhile wait for it). Pre-warmed instances that are not
+    used yet must fit into the `budget` and into the edge's free capacity (nothing is evicted for them). Unused
+    instances are left to the IdleReaper.
+
+    The deployments run in the DeployExecutor (shared with the Dispatcher) with the priority given by `priority`: in
+    the background until clients wait for them (see Dispatcher.deployPriority()).
+
+    Metrics (#prewarmStats):
+        precision: pre-warmed instances used within the horizon / all pre-warmed instances evaluated so far
+        recall: cold starts avoided / (cold starts avoided + cold starts still paid)
+
+    Config (all optional):
+        "enabled": false
+        "horizon": Look-ahead in seconds (default: 60).
+        "minRequests": Expected requests within the horizon required for pre-warming (default: 1.0).
+        "slotMinutes": Length of a time-of-day slot (default: 60).
+        "rateAlpha": Weight of the latest interval for the rate (default: 0.3).
+        "seasonalAlpha": Weight of the latest day for the slots (default: 0.5).
+        "maxPerRun": Pre-warming deployments started per run (default: 2).
+        "budget": {"containers": 4, "cpu": 0, "memory": 0}: Resources for unused pre-warmed instances (0 = no limit).
+        "patternTimeout": Seconds without requests until a pattern is dropped (default: 172800 = two seasonal cycles).
+        "maxPatterns": Least recently requested patterns are dropped beyond this limit (default: 10000; 0 = no limit).
+    """
+
+    def __init__(self,
+                 log,
+                 cfg: dict,
+                 serviceMngr: ServiceManager,
+                 capacity: CapacityManager,
+                 replicas=1,
+                 executor: DeployExecutor = None,
+                 priority=None,
+                 mainLoop: MainLoopQueue = None):
+
+        self.log = log
+        self._serviceMngr = serviceMngr
+        self._capacity = capacity
+        self._replicas = replicas
+        self._mainLoop = mainLoop
+        self._executor = executor or DeployExecutor(log, {"maxWorkers": 2})
+        self._priority = priority or (lambda service, edge: DeployExecutor.BACKGROUND)  # fn(service, edge)
+
+        self.enabled = cfg.get("enabled", False)
+        self.horizon = cfg.get("horizon", 60)
+        self.minRequests = cfg.get("minRequests", 1.0)
+        self.slotSeconds = cfg.get("slotMinutes", 60) * 60
+        self.rateAlpha = cfg.get("rateAlpha", 0.3)
+        self.seasonalAlpha = cfg.get("seasonalAlpha", 0.5)
+        self.maxPerRun = cfg.get("maxPerRun", 2)
+        self.budget = Resources.fromCfg(cfg.get("budget", {"containers": 4}))
+
+        self._numSlots = max(1, round(86400 / self.slotSeconds))
+        self._patterns = AgingDict(idleTimeout=cfg.get("patternTimeout", 2 * 86400),
+                                   maxEntries=cfg.get("maxPatterns", 10000))  # (vAddr, edge) -> _Pattern
+        self._lastRun = None
+        self._warming = set()  # (vAddr, edge): pre-warming in progress
+        self._warm = {}  # (vAddr, edge) -> (ready timestamp, Resources): pre-warmed, but not used yet
+
+        self.numPrewarmed = self.numHits = self.numMisses = self.numColdStarts = self.numFailed = 0
+
+    def onRequest(self, service: Service, edge: Edge, numRunning: int):
+        """
+        Called by the Dispatcher for each new request (in the main loop).
+        """
+        if not self.enabled:
+            return
+
+        key = (service.vAddr, edge)
+        pattern = self._patterns.get(key)  # keeps it alive
+        if pattern is None:
+            pattern = self._patterns[key] = _Pattern(service, self._numSlots)
+        pattern.count += 1
+        pattern.slotCount += 1
+
+        if key in self._warm:
+            self._warm.pop(key)
+            self.numHits += 1  # cold start avoided
+        elif not numRunning:
+            self.numColdStarts += 1
+
+    def run(self):
+        """
+        Updates the request patterns and starts pre-warming the likely needed services (in the main loop; called
+        periodically).
+        """
+        if not self.enabled:
+            return
+
+        curTime = time()
+        interval = curTime - self._lastRun if self._lastRun else None
+        self._lastRun = curTime
+
+        slot = self.slot(curTime)
+        candidates = []
+
+        self._patterns.expire()  # no requests within the timeout
+
+        for key, pattern in self._patterns.items():
+            self._update(pattern, slot, interval)
+            expected = self.expected(pattern, curTime)
+            if expected >= self.minRequests:
+                candidates.append((expected, key, pattern))
+
+        self._expire(curTime)
+
+        started = 0
+        for expected, (_, edge), pattern in sorted(candidates, key=lambda c: -c[0]):
+            if started >= self.maxPerRun:
+                break
+            if self._prewarm(edge, pattern.service, expected):
+                started += 1
+
+    def slot(self, timestamp: float) -> int:
+
+        return int(timestamp % 86400 // self.slotSeconds) % self._numSlots
+
+    def expected(self, pattern: _Pattern, curTime: float) -> float:
+        """
+        Returns the expected number of requests within the next `horizon` seconds.
+        """
+        seasonalRate = pattern.seasonal[self.slot(curTime + self.horizon)] / self.slotSeconds
+        return max(pattern.rate, seasonalRate) * self.horizon
+
+    def _update(self, pattern: _Pattern, slot: int, interval: float):
+
+        if interval:
+            pattern.rate = self.rateAlpha * pattern.count / interval + (1 - self.rateAlpha) * pattern.rate
+        pattern.count = 0
+
+        if pattern.slot is None:
+            pattern.slot = slot
+        elif pattern.slot != slot:  # slot completed
+            prev = pattern.seasonal[pattern.slot]
+            pattern.seasonal[pattern.slot] = self.seasonalAlpha * pattern.slotCount + (1 - self.seasonalAlpha) * prev
+            pattern.slot = slot
+            pattern.slotCount = 0
+
+    def _expire(self, curTime: float):
+        """
+        Pre-warmed instances not used within the horizon count as misses.
+        """
+        for key, (readyTime, _) in list(self._warm.items()):
+            if curTime - readyTime > self.horizon:
+                self._warm.pop(key)
+                self.numMisses += 1
+
+    def _running(self, service: Service, edge: Edge) -> bool:
+
+        svc = edge.vServices.get(service.vAddr)
+        return bool(svc and svc.deployment and svc.deployment.ready_replicas)
+
+    def _prewarm(self, edge: Edge, service: Service, expected: float) -> bool:
+
+        key = (service.vAddr, edge)
+        if key in self._warming or key in self._warm or self._running(service, edge):
+            return False
+        if self._serviceMngr.deployments.state(service, edge) == DeploymentState.DEPLOYING:
+            return False
+
+        demand = self._capacity.resources(edge, service) * self._replicas
+        warm = sum((resources for _, resources in self._warm.values()), Resources())
+        if not (warm + demand).fits(self.budget) or not self._capacity.fits(edge, service, demand):
+            return False
+        if self._executor.full():
+            return False  # clients first
+
+        if self._serviceMngr.bookDeployment(service, edge):
+            return False  # deploying already
+
+        self._warming.add(key)
+        numDeployed = int(service.vAddr in edge.vServices)
+
+        future = self._executor.submit(edge, partial(self._priority, service, edge), self._prewarmFunc, edge, service,
+                                       numDeployed, expected)
+        future.add_done_callback(lambda ft: self._runInMainLoop(partial(self._prewarmed, key, demand, ft)))
+        return True
+
+    def _prewarmFunc(self, edge: Edge, service: Service, numDeployed: int, expected: float):
+        #
+        # NOTE: Called in the executor thread.
+        #
+        startTime_s = time()
+        perf = PerfCounter()
+
+        svc = self._serviceMngr.deploy(service, edge, None, numDeployed, waitOnly=False)
+
+        self.log.warn(f'#perfPrewarm: {{"svc":"{str(service)}", "edge":"{str(edge.ip)}", ' +
+                      f'"expected":{round(expected, 2)}, "ok":{int(svc is not None)}, "total":{round(perf.ms())}, ' +
+                      f'"ts":{startTime_s}}}')
+        return svc
+
+    def _prewarmed(self, key, demand: Resources, future):
+
+        self._warming.discard(key)
+        if future.exception() or future.result() is None:
+            self.numFailed += 1
+            return
+
+        self.numPrewarmed += 1
+        self._warm[key] = (time(), demand)
+
+    def _runInMainLoop(self, fn):
+
+        if self._mainLoop is None:
+            fn()
+        else:
+            self._mainLoop.put(fn)
+
+    def stats(self) -> dict:
+
+        evaluated = self.numHits + self.numMisses
+        return {
+            "patterns": len(self._patterns),
+            "warming": len(self._warming),
+            "warm": len(self._warm),
+            "prewarmed": self.numPrewarmed,
+            "failed": self.numFailed,
+            "avoided": self.numHits,
+            "missed": self.numMisses,
+            "coldStarts": self.numColdStarts,
+            "precision": round(self.numHits / evaluated, 3) if evaluated else None,
+            "recall": round(self.numHits / (self.numHits + self.numColdStarts), 3) if self.numHits else 0
+        }
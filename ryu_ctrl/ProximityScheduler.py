@@ -3,6 +3,9 @@ from __future__ import annotations
 from util.EdgeTools import Edge
 from util.Service import Service
 from util.RyuDPID import DPID
+from util.Topology import Topology
+from util.DeployHistory import DeployHistory
+from .ServiceManager import ServiceManager
 
 
 class ProximityScheduler:
@@ -10,27 +13,72 @@ class ProximityScheduler:
     Selects the closest edge server that has the service running already for a given request to an edge service.
     If no service instance is running yet, then the closest edge cluster is chosen.
 
-    'Closest' here means 'the edge that is directly attached to the switch that got the request'.
+    'Closest' here means 'the edge with the lowest path cost from the switch that got the request' (see Topology).
+    Without a topology, only the edges directly attached to the switch that got the request are considered.
+
+    Cold-start aware (optional): Instead of always preferring a running instance, the edge with the lowest expected
+    delay is chosen: path cost * `msPerCost` + predicted cold start (see DeployHistory; 0 if running). Thus, a nearby
+    edge that must deploy first wins only if its cold start is faster than the detour to a running instance.
+
+    Config (all optional):
+        "maxCost": Edges with a higher path cost are not considered (default: no limit).
+        "coldStartAware": false
+        "msPerCost": Delay in ms per unit of path cost (default: 1.0).
+        "coldStart": {"scaleUp": 1000, "deploy": 5000}: Predicted cold start in ms if there is no history yet.
     """
 
-    def __init__(self, log, cfg: dict):
+    def __init__(self, log, cfg: dict, topology: Topology = None, history: DeployHistory = None):
 
         self.log = log
         self.cfg = cfg
+        self.topology = topology
+        self.history = history
+        self.maxCost = cfg.get("maxCost")
+        self.coldStartAware = cfg.get("coldStartAware", False) and history is not None
+        self.msPerCost = cfg.get("msPerCost", 1.0)
+        self.defaultColdStart = {"scaleUp": 1000, "deploy": 5000, **cfg.get("coldStart", {})}
 
     def schedule(self, dpid: DPID, service: Service, edges: list[Edge, int, int]) -> tuple[Edge, int, int]:
         # input: list of [edge, numDeployedInstancesInEdge, numRunningInstancesInEdge]
 
-        choices = [(edge, dep, avail) for (edge, dep, avail) in edges if avail]  # preference for running instance first
+        edges = [(self.distance(dpid, edge), (edge, dep, avail)) for (edge, dep, avail) in edges]
+        edges = [(cost, choice) for (cost, choice) in edges if cost is not None]  # reachable only
+
+        if self.coldStartAware:
+            delays = [(cost * self.msPerCost + self.coldStart(service, *c), c) for (cost, c) in edges]
+            return min(delays, key=lambda choice: choice[0])[1] if len(delays) else (None, None, None)
+
+        choices = [(cost, c) for (cost, c) in edges if c[2]]  # preference for running instance first
 
         if not len(choices):  # no instance running yet? -> choose from deployed
-            choices = [(edge, dep, avail) for (edge, dep, avail) in edges
-                       if dep]  # preference for deployed instance second
+            choices = [(cost, c) for (cost, c) in edges if c[1]]  # preference for deployed instance second
 
         if not len(choices):  # no instance running yet? -> choose from all
             choices = edges
 
-        closest = [(edge, dep, avail) for (edge, dep, avail) in choices
-                   if edge.dpid == dpid]  # preference for closest third
+        # preference for closest third (the first one if the costs are equal)
+        #
+        return min(choices, key=lambda choice: choice[0])[1] if len(choices) else (None, None, None)
+
+    def distance(self, dpid: DPID, edge: Edge):
+        """
+        Returns the path cost from the switch `dpid` to the edge; None if not reachable (or too far away).
+        """
+        if edge.dpid == dpid:
+            return 0
+        if self.topology is None:
+            return None
+
+        cost = self.topology.cost(dpid, edge.dpid)
+        return None if cost is None or (self.maxCost is not None and cost > self.maxCost) else cost
+
+    def coldStart(self, service: Service, edge: Edge, numDeployed: int, numRunning: int) -> float:
+        """
+        Returns the predicted time in ms until the service is available at the edge (0 if running already).
+        """
+        if numRunning:
+            return 0
 
-        return closest[0] if len(closest) else (None, None, None)  # return the first one
+        task = 'scaleUp' if numDeployed else 'deploy'
+        predicted = self.history.predict(ServiceManager.historyKey(service), edge.ip, task) if self.history else None
+        return self.defaultColdStart[task] if predicted is None else predicted
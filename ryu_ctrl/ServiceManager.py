@@ -3,14 +3,18 @@ from __future__ import annotations
 from cluster.Cluster import Cluster
 from util.EdgeTools import Edge, Switches
 from util.SocketAddr import SocketAddr
-from util.Service import ServiceInstance, Service
+from util.Service import Deployment, ServiceInstance, Service
 from util.IPAddr import IPAddr
 from util.TinyServiceTrie import TinyServiceTrie
+from util.DeploymentRegistry import DeploymentRegistry, DeploymentState
+from util.DeployHistory import DeployHistory
+from util.PortProber import PortProber
 from util.Performance import PerfCounter
 
-from time import sleep, time
+from json import dumps as json_dumps
+from threading import Thread
+from time import monotonic, sleep, time
 
-import socket
 import os
 import glob
 
@@ -20,19 +24,57 @@ class ServiceManager:
     Manages the available services.
     """
 
-    def __init__(self, log, switches: Switches, clusterGlob: str, servicesGlob: str, servicesDir: str):
+    def __init__(self,
+                 log,
+                 switches: Switches,
+                 clusterGlob: str,
+                 servicesGlob: str,
+                 servicesDir: str,
+                 replicas: int = 1,
+                 historyFile: str = None,
+                 clusterCfg: dict = None,
+                 provisionCfg: dict = None):
 
         self.log = log
         self._switches = switches
+        self._replicas = max(1, replicas)  # replicas per service instance (when scaling up from zero)
+        self._provisionCfg = provisionCfg or {}  # see provision()
         self._services: TinyServiceTrie = TinyServiceTrie(servicesDir)
 
-        # Remember currently running deployments
+        # Remember currently running deployments (and notify waiters when they are done)
         #
-        self._curDeployments = {}
+        self._deployments = DeploymentRegistry()
+        self._prober = PortProber(log)
+        self._history = DeployHistory(historyFile, log=log)  # timings of past deployments (see #perfDeploy)
 
-        self.loadClusters(clusterGlob)
+        # Index for the lookups per request (maintained incrementally)
+        #
+        self._instances = {}  # vAddr -> {Edge -> ServiceInstance}
+        self._servers = {}  # eAddr (of each replica) -> Edge
+        self._reachableEdges = {}  # Edge -> True: edges whose cluster is available at their switch
+        self._unreachableEdges = {}  # Edge -> True: edges whose cluster is not available (yet or anymore)
+        self._edgeOrder = {}  # Edge -> position in the config (the order of availServers())
+
+        # fn(svc, edge): called whenever the replicas of a service instance change (NOTE: in any thread)
+        self.replicaListeners = []
+
+        # fn(svc, edge, replicas): called by updateReplicas() for removed replicas (in the main loop; before they are
+        # stopped)
+        self.onReplicasRemoved = None
+
+        # fn(edge, service, replicas) -> bool: may the service be deployed/scaled up at the edge? (e.g., capacity)
+        # fn(edge, service): called when that deployment is done
+        self.admission = None
+        self.admissionDone = None
+
+        self.loadClusters(clusterGlob, clusterCfg)
         self.loadServices(servicesGlob)
 
+        for edge in (edge for sw in self._switches.values() for edge in sw.edges):
+            if edge.cluster and edge.cluster._ip:
+                self._edgeOrder[edge] = len(self._edgeOrder)
+                self._unreachableEdges[edge] = True  # until its host is known at the switch (see hostAdded())
+
         log.info(f"NumServices={len(self._services)}")
 
     def isService(self, addr: SocketAddr):
@@ -46,17 +88,20 @@ class ServiceManager:
 
     def isServer(self, dpid, addr: SocketAddr):
 
-        switch = self._switches.get(dpid)
-        if switch:
-            for edge in switch.edges:  # REVIEW Inefficient data structure for search (but method is rarely used)
-                if addr in edge.eServices:
-                    return True
-        return False
+        edge = self._servers.get(addr)
+        return edge is not None and edge.dpid == dpid
+
+    def instanceFor(self, addr: SocketAddr) -> ServiceInstance:
+        """
+        Returns the service instance that the replica with this edge address belongs to.
+        """
+        edge = self._servers.get(addr)
+        return edge.eServices.get(addr) if edge is not None else None
 
     def service(self, addr: SocketAddr):
         return self._services.get(addr)
 
-    def loadClusters(self, clusterGlob):
+    def loadClusters(self, clusterGlob, clusterCfg: dict = None):
 
         files = glob.glob(clusterGlob)
 
@@ -72,7 +117,7 @@ class ServiceManager:
                 for edge in sw.edges:
                     if edge.ip == IPAddr(edgeIP):
 
-                        edge.cluster = Cluster.init(clusterType, apiServer, filename)
+                        edge.cluster = Cluster.init(clusterType, apiServer, filename, clusterCfg)
                         break
 
     def loadServices(self, servicesGlob):
@@ -84,8 +129,16 @@ class ServiceManager:
         """
         Will be called after the switch connected. Before that, we may not be able to connect to the cluster.
         """
+        self.addServices(edge, self.fetchServices(edge))
+
+    def fetchServices(self, edge: Edge) -> list[tuple[ServiceInstance, list[SocketAddr]]]:
+        """
+        Connects to the cluster of the edge and returns the deployed instances of the services we know about, together
+        with the addresses of their replicas (blocking, may be called from any thread; see addServices()).
+        """
         edge.cluster.connect()
 
+        result = []
         svcInstances = edge.cluster.services(None)
 
         for svcList in svcInstances.values():
@@ -104,7 +157,80 @@ class ServiceManager:
                             svcInstance.deployment = next(iter(edge.cluster.deployments(svc.label)), None)
 
                         if svcInstance.deployment:
-                            self._addServiceInstance(svcInstance, edge)
+                            result.append((svcInstance, self.replicaAddrs(edge, svcInstance)))
+        return result
+
+    def addServices(self, edge: Edge, svcInstances: list[tuple[ServiceInstance, list[SocketAddr]]]):
+        """
+        Adds the instances returned by fetchServices() (to be called from the main loop; does not query the cluster).
+        """
+        for svcInstance, replicas in svcInstances:
+            self._addServiceInstance(svcInstance, edge, replicas)
+            if svcInstance.deployment.ready_replicas:
+                self._deployments.resolve(svcInstance.service, edge, svcInstance)
+
+        if self._provisionCfg.get("services"):
+            if self._provisionCfg.get("background", True):
+                Thread(target=self.provision, args=(edge, ), name=f"Provision-{edge.ip}", daemon=True).start()
+            else:
+                self.provision(edge)
+
+    def provision(self, edge: Edge):
+        """
+        Deploys the configured services with zero replicas (Deployment + Service objects only) if they are not
+        deployed at the edge yet. A first request then only needs to scale them up.
+
+        Config: {"services": [<glob of service files>], "prePull": false, "background": true}
+
+        NOTE: Blocking.
+        """
+        startTime_s = time()
+        perf = PerfCounter()
+        numProvisioned = 0
+        todo = []  # [(service, serviceDef)]
+        images = set()
+
+        files = sorted({filename for pattern in self._provisionCfg["services"] for filename in glob.glob(pattern)})
+        for filename in files:
+            try:
+                service = Service(vAddr=None,
+                                  label=Service.labelFromServiceFilename(filename),
+                                  port=Service.portFromServiceFilename(filename))
+                service = self.service(service.vAddr)  # the instance from the catalog
+                if service is None or service.vAddr in edge.vServices:
+                    continue  # not in the catalog or deployed already
+
+                serviceDef = self.serviceDef(service)
+                images.update(cont.image for cont in serviceDef.containers())
+                todo.append((service, serviceDef))
+            except Exception as e:
+                self.log.warn(f"Provisioning: skipping {filename}: {e}")
+
+        # pull first: creating the containers might need the images (e.g., Docker)
+        #
+        pullPerf = PerfCounter()
+        if self._provisionCfg.get("prePull") and images:
+            edge.cluster.prePull(sorted(images))
+        prePullTime = pullPerf.ms()
+
+        for service, serviceDef in todo:
+            if service.vAddr in edge.vServices or self._deployments.book(service, edge):
+                continue  # deployed by a request in the meantime (or right now)
+            try:
+                svc = edge.cluster.deploy(serviceDef.annotate(edge.schedulerName, replicas=0))
+                if svc:
+                    svc.resources = serviceDef.resources()
+                    svc.deployment = svc.deployment or Deployment(0, 0)
+                    self._addServiceInstance(svc, edge)
+                    numProvisioned += 1
+            except Exception as e:
+                self.log.error(f"Provisioning {service} at edge {edge.ip} failed: {e}")
+            finally:
+                self._deployments.scaledDown(service, edge)  # waiting requests scale it up
+
+        self.log.warn(f'#perfProvision: {{"edge":"{str(edge.ip)}", "services":{numProvisioned}, ' +
+                      f'"images":{len(images)}, "prePull":{round(prePullTime)}, "total":{round(perf.ms())}, ' +
+                      f'"ts":{startTime_s}}}')
 
     def _addService(self, filename: str = None):
 
@@ -124,17 +250,19 @@ class ServiceManager:
             elif numServices == 20:
                 self.log.info("[... more ServiceIDs ...]")
 
-    def _addServiceInstance(self, svcInstance: ServiceInstance, edge):
+    def _addServiceInstance(self, svcInstance: ServiceInstance, edge, replicas: list[SocketAddr] = None):
 
         # Set correct eAddr for service instance: Exposed / Cluster / Pod
         #
+        if replicas is None:
+            replicas = self.replicaAddrs(edge, svcInstance)
+
         if edge.target == "pod":
             #
             # If we route directly to the pod, we need to get the PodIP
             #
-            pods = edge.cluster.pods(svcInstance.service.label)
-            if len(pods) and pods[0].ip:
-                svcInstance.podAddr.ip = IPAddr(pods[0].ip)
+            if len(replicas):
+                svcInstance.podAddr.ip = replicas[0].ip
                 svcInstance.eAddr = svcInstance.podAddr
 
         elif edge.target == "cluster":
@@ -148,23 +276,228 @@ class ServiceManager:
 
         # Add ServiceInstance to edge
         #
-        edge.vServices[svcInstance.service.vAddr] = svcInstance  # REVIEW Requires to have a single instance only
-        if svcInstance.eAddr:
-            edge.eServices[svcInstance.eAddr] = svcInstance
-
+        edge.vServices[svcInstance.service.vAddr] = svcInstance  # a single instance (with n replicas) per edge
+        self._setReplicas(svcInstance, edge, replicas)
         self.log.info("ServiceInstance @ {}: {}".format(edge.dpid, svcInstance))
 
+    def replicaAddrs(self, edge, svcInstance: ServiceInstance) -> list[SocketAddr]:
+        """
+        Returns the edge addresses of all running replicas (queries the cluster).
+        """
+        if edge.target == "pod":
+            pods = edge.cluster.pods(svcInstance.service.label)
+            return [SocketAddr(pod.ip, svcInstance.podAddr.port) for pod in pods if pod.ip]
+
+        if edge.target == "cluster":
+            return edge.cluster.replicaAddrs(svcInstance)  # e.g., several Docker containers
+
+        return [svcInstance.publicAddr] if svcInstance.publicAddr else []
+
+    def rescale(self, edge, svcInstance: ServiceInstance, replicas: int) -> list[SocketAddr]:
+        """
+        Scales a running service instance to `replicas` and returns the addresses of the ready replicas (the ports are
+        open already). The caller has to register them with updateReplicas().
+
+        Additional replicas need admission (see deploy()): if not all of them fit into the edge, the target is capped
+        to as many as fit (none: the instance is left as it is).
+
+        NOTE: Blocking; to be called in a separate thread.
+        """
+        prev = set(svcInstance.replicas)
+        current = max(1, svcInstance.deployment.replicas if svcInstance.deployment else len(prev))
+
+        if replicas > current and self.admission:
+            try:
+                replicas = self._admitReplicas(edge, svcInstance.service, current, replicas)
+                if replicas > current:
+                    edge.cluster.rescale(svcInstance, replicas)
+            finally:
+                if self.admissionDone:
+                    self.admissionDone(edge, svcInstance.service)
+        else:
+            edge.cluster.rescale(svcInstance, replicas)
+        addrs = self.replicaAddrs(edge, svcInstance)
+
+        if edge.target == "pod":
+            # pod IPs might not be reachable from here (K8s checks the readiness anyway); but when scaling down,
+            # K8s chooses the pods to remove -> wait until they are terminating and return the survivors only
+            endTime = monotonic() + 30
+            while len(addrs) > replicas and monotonic() < endTime:
+                sleep(0.5)
+                addrs = self.replicaAddrs(edge, svcInstance)
+        else:
+            for addr in addrs:
+                if addr not in prev:
+                    self._prober.wait(addr)
+        return addrs
+
+    def _admitReplicas(self, edge, service: Service, current: int, replicas: int) -> int:
+        """
+        Returns the largest number of replicas (up to `replicas`) admitted for the edge; `current` if none fits.
+        """
+        for target in range(replicas, current, -1):
+            if self.admission(edge, service, target):
+                if target < replicas:
+                    self.log.warn(f"rescale: {service} at edge {edge.ip} capped to {target} of {replicas} replicas.")
+                return target
+        self.log.error(f"rescale: No capacity left for more replicas of {service} at edge {edge.ip}.")
+        return current
+
+    def instances(self):
+        """
+        Returns all service instances as [(edge, svc)].
+        """
+        return [(edge, svc) for instances in self._instances.values() for edge, svc in instances.items()]
+
+    def updateReplicas(self, svcInstance: ServiceInstance, edge, replicas: list[SocketAddr]):
+        """
+        Replaces the ready replicas of a service instance (e.g., after scaling). Known clients stay with their replica
+        (see FlowMemory); new clients are spread across the new replicas (consistent hashing).
+
+        The clients of removed replicas are forgotten and their flows deleted (see onReplicasRemoved): their next
+        request is dispatched to one of the remaining replicas.
+
+        NOTE: To be called in the main loop (before removed replicas are stopped).
+        """
+        prev = list(svcInstance.replicas)
+        self._setReplicas(svcInstance, edge, replicas)
+        self.log.info("Replicas @ {}: {} {}".format(edge.dpid, svcInstance, svcInstance.replicas))
+
+        removed = [addr for addr in prev if addr not in svcInstance.replicas]
+        if removed and self.onReplicasRemoved:
+            self.onReplicasRemoved(svcInstance, edge, removed)
+
+    def _setReplicas(self, svcInstance: ServiceInstance, edge, replicas: list[SocketAddr]):
+
+        self._unindexServiceInstance(svcInstance, edge)
+
+        if not replicas and svcInstance.eAddr:
+            replicas = [svcInstance.eAddr]
+        svcInstance.setReplicas(replicas)
+
+        self._indexServiceInstance(svcInstance, edge)
+        self._notifyReplicas(svcInstance, edge)
+
+    def _notifyReplicas(self, svcInstance: ServiceInstance, edge):
+
+        for listener in self.replicaListeners:
+            try:
+                listener(svcInstance, edge)
+            except Exception as e:
+                self.log.error(f"Replica listener failed for {svcInstance}: {e}")
+
+    def _removeServiceInstance(self, svcInstance: ServiceInstance, edge):
+
+        vAddr = svcInstance.service.vAddr
+        if edge.vServices.get(vAddr) is svcInstance:
+            del edge.vServices[vAddr]
+
+        self._unindexServiceInstance(svcInstance, edge)
+        svcInstance.setReplicas([])
+        self._notifyReplicas(svcInstance, edge)
+        self.log.info("Removed ServiceInstance @ {}: {}".format(edge.dpid, svcInstance))
+
+    def _indexServiceInstance(self, svcInstance: ServiceInstance, edge):
+
+        prev = self._instances.get(svcInstance.service.vAddr, {}).get(edge)
+        if prev is not None and prev is not svcInstance:
+            self._unindexServiceInstance(prev, edge)  # replaced (e.g., new pod address)
+
+        self._instances.setdefault(svcInstance.service.vAddr, {})[edge] = svcInstance
+        for addr in svcInstance.replicas:
+            self._servers[addr] = edge
+            edge.eServices[addr] = svcInstance
+
+    def _unindexServiceInstance(self, svcInstance: ServiceInstance, edge):
+
+        instances = self._instances.get(svcInstance.service.vAddr, {})
+        if instances.get(edge) is svcInstance:
+            del instances[edge]
+            if not instances:
+                del self._instances[svcInstance.service.vAddr]
+
+        for addr in svcInstance.replicas:
+            if self._servers.get(addr) is edge:
+                del self._servers[addr]
+            if edge.eServices.get(addr) is svcInstance:
+                del edge.eServices[addr]
+
+    def hostAdded(self, dpid, ip: IPAddr):
+        """
+        To be called when a host (ARP) was added or updated at a switch: edges become reachable.
+        """
+        switch = self._switches.get(dpid)
+        if switch:
+            for edge in switch.edges:
+                if edge.cluster and edge.cluster._ip == ip and self._unreachableEdges.pop(edge, None):
+                    self._reachableEdges[edge] = True
+                    self.log.info("Cluster {} available at switch {}".format(ip, dpid))
+
+    def hostRemoved(self, dpid, ip: IPAddr):
+        """
+        To be called when a host is not reachable anymore at a switch (e.g., the switch disconnected): its edges are
+        not offered anymore until the host is added again.
+        """
+        switch = self._switches.get(dpid)
+        if switch:
+            for edge in switch.edges:
+                if edge.cluster and edge.cluster._ip == ip:
+                    self.clusterLost(edge)
+
+    def clusterLost(self, edge: Edge):
+        """
+        To be called when the cluster of an edge is not available anymore (e.g., its API server cannot be reached):
+        the edge is not offered anymore until its host is added again (see hostAdded()).
+        """
+        if self._reachableEdges.pop(edge, None):
+            self._unreachableEdges[edge] = True
+            self.log.warn("Cluster {} not available anymore at switch {}".format(edge.cluster._ip, edge.dpid))
+
     def bookDeployment(self, service, edge):
         """
         Records that we are about to deploy this service. 
 
         Note: To be called in the main thread to avoid race conditions (while deploy() runs in a separate thread).
 
-        Returns 0 if no deployment is running already.
+        Returns True if the same deployment is running already.
         """
-        result = self._curDeployments.get((service, edge), 0)
-        self._curDeployments[(service, edge)] = 1  # REVIEW/TODO Clean up dict
-        return result
+        return self._deployments.book(service, edge)
+
+    def waitForDeployment(self, service: Service, edge: Edge, src: SocketAddr, fn) -> bool:
+        """
+        Calls fn(svc) once the running deployment is resolved, without occupying a thread (unlike deploy() with
+        waitOnly). svc is None if the deployment failed or if the instance was scaled down (see deploy()).
+
+        NOTE: fn is called in the thread that resolves the deployment (or right away if resolved already).
+
+        Returns False if there is no such deployment.
+        """
+        startTime_s = time()
+        perf = PerfCounter()
+
+        def resolved(svc: ServiceInstance):
+            if svc:
+                self.log.warn(f'#perfDeploy: {{"t":"wait", "total":{round(perf.ms())}, "wait":0, ' +
+                              f'"svc": "{str(svc)}", "src":"{str(src)}", "steps":{{}}, "ts":{startTime_s}}}')
+            fn(svc)
+
+        return self._deployments.addCallback(service, edge, resolved)
+
+    @property
+    def deployments(self) -> DeploymentRegistry:
+        return self._deployments
+
+    @property
+    def prober(self) -> PortProber:
+        return self._prober
+
+    @property
+    def history(self) -> DeployHistory:
+        return self._history
+
+    @staticmethod
+    def historyKey(service: Service) -> str:
+        return service.label or str(service.vAddr)
 
     def deploy(self, service: Service, edge: Edge, src: SocketAddr, numDeployed, waitOnly: bool):
 
@@ -172,56 +505,138 @@ class ServiceManager:
         startTime_s = time()
         perf = PerfCounter()
         portWaitTime = 0
+        steps = {}  # timings of the deployment steps (if available)
         svc = None
 
         # Is the same deployment currently running?
         #
         if waitOnly:
             task = 'wait'
-            svc = edge.vServices.get(service.vAddr)
-            while svc is None or svc.eAddr is None:
-                sleep(1 / 100)  # 10 ms
-                svc = edge.vServices.get(service.vAddr)
-            portWaitTime = self._waitForOpenPort(svc)
+            svc = self._deployments.wait(service, edge)  # resolved by the deploying task (after the port is open)
 
-        else:
-            for _ in range(3):  # try at most 3 times
-                try:
-                    if numDeployed:
-                        task = 'scaleUp'
-                        svc = edge.vServices.get(service.vAddr)
-                    else:
-                        task = 'deploy'
-                        svc = self._deployService(edge, service)  # try to deploy an instance
-                    portWaitTime = self._scaleService(edge, svc)  # (wait for) scaling up instance
-                    break
-                except Exception as e:
-                    self.log.error(f'{task}: Exception when instantiating service {service} at edge {edge.ip}: {e}')
+            state = self._deployments.state(service, edge)
+            if svc is None and state in (DeploymentState.SCALED_DOWN, DeploymentState.DEPLOYING):
+                # scaled down (idle) while the request arrived -> scale up again (or wait for whoever does so)
+                waitOnly = self._deployments.book(service, edge)
+                numDeployed = numDeployed or int(service.vAddr in edge.vServices)
+                if waitOnly:
+                    svc = self._deployments.wait(service, edge)
+
+            if waitOnly and svc is None:
+                self.log.error(f'{task}: Could not instantiate service {service} at edge {edge.ip}.')
+                return None
+
+        if not waitOnly:
+            task = 'scaleUp' if numDeployed else 'deploy'
+            try:
+                if self.admission and not self.admission(edge, service, self._replicas):
+                    self.log.error(f'{task}: No capacity left for service {service} at edge {edge.ip}.')
+                else:
+                    deployPerf = PerfCounter()  # cold start: without admission (e.g., evictions)
+                    for _ in range(3):  # try at most 3 times
+                        try:
+                            if numDeployed:
+                                svc = edge.vServices.get(service.vAddr)
+                            else:
+                                svc = self._deployService(edge, service, steps)  # try to deploy an instance
+                            portWaitTime = self._scaleService(edge, svc, steps)  # (wait for) scaling up instance
+                            if svc:
+                                svc.coldStart = deployPerf.ms()
+                            break
+                        except Exception as e:
+                            self.log.error(
+                                f'{task}: Exception when instantiating service {service} at edge {edge.ip}: {e}')
+            finally:
+                if self.admissionDone:
+                    self.admissionDone(edge, service)
+
+                # notify waiters exactly once (even in case of failure)
+                self._deployments.resolve(service, edge, svc if svc and svc.eAddr else None)
 
             if not svc:
                 self.log.error(f'{task}: Could not instantiate service {service} at edge {edge.ip}.')
                 return None
 
+        if task != 'wait':
+            self._history.add(self.historyKey(service), edge.ip, task, perf.ms(), portWaitTime)
+
         # use double curlies to escape curly braces in f-strings
         self.log.warn(f'#perfDeploy: {{"t":"{task}", "total":{round(perf.ms())}, "wait":{round(portWaitTime)}, ' +
-                      f'"svc": "{str(svc)}", "src":"{str(src)}", "ts":{startTime_s}}}')
+                      f'"svc": "{str(svc)}", "src":"{str(src)}", "steps":{json_dumps(steps)}, "ts":{startTime_s}}}')
         return svc
 
-    def _deployService(self, edge: Edge, service: Service) -> ServiceInstance:
+    def serviceDef(self, service: Service):
+        """
+        Returns the (parsed) service definition (K8sService).
+        """
+        return Cluster.initService(service=service, filename=self._services.serviceFilename(service.vAddr))
+
+    def _deployService(self, edge: Edge, service: Service, steps: dict = None) -> ServiceInstance:
 
-        serviceDef = Cluster.initService(service=service, filename=self._services.serviceFilename(service.vAddr))
+        serviceDef = self.serviceDef(service)
 
-        # REVIEW For a higher total speed, immediately scale to 1
+        # REVIEW For a higher total speed, immediately scale to the configured number of replicas
         #
-        return edge.cluster.deploy(serviceDef.annotate(edge.schedulerName, replicas=1))
+        try:
+            svc = edge.cluster.deploy(serviceDef.annotate(edge.schedulerName, replicas=self._replicas))
+        finally:
+            if steps is not None:
+                steps.update(serviceDef.perf)  # parsing (and deployment steps, if reported by the cluster)
+        if svc:
+            svc.resources = serviceDef.resources()
+        return svc
+
+    def release(self, edge: Edge, svc: ServiceInstance) -> bool:
+        """
+        Takes the service instance out of service before it is scaled down (see scaleDown()): it is booked in the
+        DeploymentRegistry (new requests wait for the scale-down and scale it up again afterwards) and marked as not
+        running.
+
+        Returns False if a deployment is running.
+        """
+        if self._deployments.book(svc.service, edge):
+            return False
+
+        svc.deployment = Deployment(svc.deployment.replicas if svc.deployment else 0, 0)
+        return True
 
-    def _scaleService(self, edge: Edge, svc: ServiceInstance):
+    def scaleDown(self, edge: Edge, svc: ServiceInstance, reclaim: bool = False):
+        """
+        Scales the released service instance down to zero (the deployment is kept for a fast scale-up).
 
-        edge.cluster.scale(svc, replicas=1)
+        reclaim: Free all of its resources (e.g., do not keep paused containers in memory; see Cluster.reclaim()).
+
+        NOTE: Blocking; to be called in a separate thread.
+        """
+        try:
+            edge.cluster.scale(svc, replicas=0)
+            if reclaim:
+                edge.cluster.reclaim(svc)
+        except Exception:
+            svc.deployment = None  # unknown state: the next request scales it up (again)
+            raise
+        finally:
+            self._deployments.scaledDown(svc.service, edge)  # release waiting requests
+
+    def _scaleService(self, edge: Edge, svc: ServiceInstance, steps: dict = None):
+
+        perf = PerfCounter()
+        edge.cluster.scale(svc, replicas=self._replicas)  # no-op if already deployed with replicas
+        if svc and svc.deployment and 0 < svc.deployment.ready_replicas < self._replicas:
+            edge.cluster.rescale(svc, self._replicas)  # e.g., a new Docker deployment starts a single replica
+        if steps is not None:
+            steps["scale"] = perf.ms()
 
         if svc and svc.deployment and svc.deployment.ready_replicas:
             portWaitTime = self._waitForOpenPort(svc)
-            self._addServiceInstance(svc, edge)  # add only after port is open!!
+            replicas = self.replicaAddrs(edge, svc)
+
+            if edge.target != "pod":  # pod IPs might not be reachable from here (see rescale())
+                for addr in replicas:
+                    if addr != svc.clusterAddr:  # probed already
+                        self._prober.wait(addr)
+
+            self._addServiceInstance(svc, edge, replicas)  # add only after the ports are open!!
             return portWaitTime
         return 0
 
@@ -234,21 +649,7 @@ class ServiceManager:
 
         Returns 0 if port was open on first attempt; waiting time in ms otherwise.
         """
-        perf = PerfCounter()
-
-        for i in range(0, 3000):
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.settimeout(0.2)
-            try:
-                s.connect((str(svc.clusterAddr.ip), svc.clusterAddr.port))
-                s.shutdown(socket.SHUT_RDWR)
-                break
-            except:
-                sleep(0.01)  # 10 ms
-            finally:
-                s.close()
-
-        return perf.ms() if i else 0  # returns > 0 only if port was still closed on first attempt
+        return self._prober.wait(svc.clusterAddr)  # shared probe for all waiters of the same instance
 
     def availServers(self, addr: SocketAddr) -> tuple[Service, list[Edge, int, int]]:
         """
@@ -258,27 +659,30 @@ class ServiceManager:
         result = []
         service = None
 
-        for _, switch in self._switches.items():
-            for edge in switch.edges:
+        # edges with a deployed instance
+        #
+        instances = self._instances.get(addr, {})
+        for edge, svc in instances.items():
 
-                # find a server that hosts (or may host) the required service
-                #
-                svc = edge.vServices.get(addr)
-                if svc is not None:  # we found a deployed instance
+            service = svc.service  # if we found an instance -> return it (performance)
 
-                    service = svc.service  # if we found an instance -> return it (performance)
+            if edge in self._unreachableEdges:
+                continue  # see below
+            if svc.edgeIP in edge.switch.hosts:
+                result.append((edge, 1, 1 if (svc.deployment and svc.deployment.ready_replicas) else 0))
+            else:
+                log.warn("Server {} not available at switch {}".format(svc.edgeIP, edge.dpid))
+                log.debug(edge.switch.hosts)
 
-                    if svc.edgeIP in switch.hosts:
-                        result.append((edge, 1, 1 if (svc.deployment and svc.deployment.ready_replicas) else 0))
-                    else:
-                        log.warn("Server {} not available at switch {}".format(svc.edgeIP, switch.dpid))
-                        log.debug(switch.hosts)
-                else:
-                    if edge.cluster and edge.cluster._ip and edge.cluster._ip in switch.hosts:
-                        result.append((edge, 0, 0))
+        # edges that may host the required service
+        #
+        for edge in self._reachableEdges:
+            if edge not in instances:
+                result.append((edge, 0, 0))
 
-                    elif edge.cluster and edge.cluster._ip:
-                        log.warn("Cluster {} not available at switch {}".format(edge.cluster._ip, switch.dpid))
-                        log.debug(switch.hosts)
+        for edge in self._unreachableEdges:
+            log.warn("Cluster {} not available at switch {}".format(edge.cluster._ip, edge.dpid))
+            log.debug(edge.switch.hosts)
 
+        result.sort(key=lambda r: self._edgeOrder.get(r[0], 0))  # in the order of the config (switches, edges)
         return service, result
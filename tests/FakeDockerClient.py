@@ -0,0 +1,175 @@
+# Josef Hammer (josef.hammer@aau.at)
+#
+"""
+In-memory stand-in for docker.DockerClient: `containers.list/get` and `events` (as used by DockerContainerCache).
+"""
+
+from itertools import count
+from queue import Queue
+from threading import Lock
+from time import time
+
+
+class NotFound(Exception):
+    pass
+
+
+class FakeContainer(object):
+
+    def __init__(self, id: str, name: str, labels: dict, status="created", ports=None):
+
+        self.id = id
+        self.name = name
+        self.labels = labels
+        self.status = status
+        self.ports = ports or {}
+
+    def copy(self):
+        return FakeContainer(self.id, self.name, dict(self.labels), self.status, dict(self.ports))
+
+
+class FakeContainers(object):
+
+    def __init__(self, client):
+        self._client = client
+
+    def list(self, all=False, filters=None):
+
+        label = (filters or {}).get('label')
+        with self._client._lock:
+            self._client.numLists += 1
+            return [
+                cont.copy() for cont in self._client._containers.values()
+                if (all or cont.status == "running") and (label is None or label in cont.labels)
+            ]
+
+    def get(self, id: str):
+
+        with self._client._lock:
+            cont = self._client._containers.get(id)
+            if cont is None:
+                raise NotFound(id)
+            return cont.copy()
+
+
+class FakeEventStream(object):
+    """
+    Blocking iterator over the events (as returned by `events(decode=True)`).
+    """
+
+    _END = object()
+
+    def __init__(self, label: str = None):
+
+        self.label = label
+        self._queue = Queue()
+
+    def put(self, event):
+
+        if self.label is None or self.label in event["Actor"]["Attributes"]:
+            self._queue.put(event)
+
+    def close(self):
+        self._queue.put(self._END)
+
+    def fail(self, error: Exception):
+        self._queue.put(error)
+
+    def __iter__(self):
+
+        while True:
+            event = self._queue.get()
+            if event is self._END:
+                return
+            if isinstance(event, Exception):
+                raise event
+            yield event
+
+
+class FakeDockerClient(object):
+    """
+    Containers are changed with create/start/die/rename/remove, which emit the same events as the Docker daemon. A new
+    event stream replays the events since its `since` timestamp (as Docker does).
+
+    Set `emit` to False to change containers without any event (e.g., while the stream is broken).
+    """
+
+    def __init__(self):
+
+        self.containers = FakeContainers(self)
+        self.emit = True
+        self.numLists = 0
+        self.streams = []
+
+        self._lock = Lock()
+        self._containers = {}  # id -> FakeContainer
+        self._events = []  # [(timestamp, event)]
+        self._ids = count(1)
+
+    def events(self, decode=False, since=None, filters=None):
+
+        with self._lock:
+            stream = FakeEventStream((filters or {}).get('label'))
+            for timestamp, event in self._events:
+                if since is None or timestamp >= since:
+                    stream.put(event)
+            self.streams.append(stream)
+            return stream
+
+    @property
+    def stream(self) -> FakeEventStream:
+        return self.streams[-1] if self.streams else None
+
+    def create(self, name: str, labels: dict, ports=None) -> str:
+
+        contID = f"c{next(self._ids)}"
+        with self._lock:
+            self._containers[contID] = FakeContainer(contID, name, dict(labels), "created", ports)
+        self._event(contID, "create")
+        return contID
+
+    def start(self, contID: str):
+        self._setStatus(contID, "running", "start")
+
+    def die(self, contID: str):
+        self._setStatus(contID, "exited", "die")
+
+    def rename(self, contID: str, name: str):
+
+        with self._lock:
+            self._containers[contID].name = name
+        self._event(contID, "rename")
+
+    def remove(self, contID: str):
+
+        with self._lock:
+            cont = self._containers.pop(contID)
+        self._event(contID, "destroy", cont.labels)
+
+    def _setStatus(self, contID: str, status: str, action: str):
+
+        with self._lock:
+            self._containers[contID].status = status
+        self._event(contID, action)
+
+    def _event(self, contID: str, action: str, labels: dict = None):
+
+        if not self.emit:
+            return
+
+        with self._lock:
+            if labels is None:
+                labels = self._containers[contID].labels
+            event = {
+                "Type": "container",
+                "Action": action,
+                "status": action,
+                "id": contID,
+                "Actor": {
+                    "ID": contID,
+                    "Attributes": dict(labels)
+                }
+            }
+            self._events.append((int(time()), event))
+            for stream in self.streams:
+                stream.put(event)
@@ -0,0 +1,110 @@
+import logging
+import unittest
+from time import monotonic, sleep
+from unittest import mock
+
+from cluster.DockerContainerCache import DockerContainerCache
+from FakeDockerClient import FakeDockerClient
+
+LABEL = "edge.service"
+
+
+def toServices(containers):
+    return sorted((cont.name, cont.status) for cont in containers)
+
+
+class DockerContainerCacheTest(unittest.TestCase):
+
+    def setUp(self):
+
+        self.client = FakeDockerClient()
+        self.client.start(self.client.create("hello-1", {LABEL: "hello"}))
+        self.client.create("other", {"unrelated": "x"})
+
+        self.cache = DockerContainerCache(logging.getLogger("test"), self.client, LABEL, toServices)
+        self.cache.start()
+        self.assertTrue(self.cache.waitSynced(timeout=2))
+        self.waitFor(lambda: self.client.stream is not None)
+
+    def tearDown(self):
+        self.cache.stop()
+
+    def waitFor(self, predicate, timeout=2):
+
+        endTime = monotonic() + timeout
+        while not predicate():
+            if monotonic() > endTime:
+                self.fail("timeout")
+            sleep(0.01)
+
+    def services(self, label="hello"):
+        return self.cache.services(label)
+
+    def testInitialList(self):
+
+        self.assertEqual(self.services(), [("hello-1", "running")])
+        self.assertEqual(len(self.cache.containers()), 1)  # labeled containers only
+        self.assertEqual(self.cache.services("unrelated"), [])
+
+    def testCreateAndStart(self):
+
+        contID = self.client.create("hello-2", {LABEL: "hello"})
+        self.waitFor(lambda: ("hello-2", "created") in self.services())
+
+        self.client.start(contID)
+        self.waitFor(lambda: self.services() == [("hello-1", "running"), ("hello-2", "running")])
+
+    def testOtherServiceUntouched(self):
+
+        self.client.start(self.client.create("world-1", {LABEL: "world"}))
+        self.waitFor(lambda: self.services("world") == [("world-1", "running")])
+        self.assertEqual(self.services(), [("hello-1", "running")])
+
+    def testDieAndDestroy(self):
+
+        contID = self.cache.containers("hello")[0].id
+
+        self.client.die(contID)
+        self.waitFor(lambda: self.services() == [("hello-1", "exited")])
+
+        self.client.remove(contID)
+        self.waitFor(lambda: not self.cache.containers("hello"))
+        self.assertEqual(self.services(), [])
+        self.assertNotIn("hello", self.cache.services())
+
+    def testRename(self):
+
+        contID = self.cache.containers("hello")[0].id
+        self.client.rename(contID, "hello-renamed")
+        self.waitFor(lambda: self.services() == [("hello-renamed", "running")])
+
+    def testStreamEndResync(self):
+
+        numLists = self.client.numLists
+        self.client.emit = False  # changes while disconnected: no events
+        self.client.start(self.client.create("hello-2", {LABEL: "hello"}))
+        self.client.stream.close()
+
+        self.waitFor(lambda: self.client.numLists > numLists)
+        self.waitFor(lambda: self.services() == [("hello-1", "running"), ("hello-2", "running")])
+        self.assertGreaterEqual(self.cache.stats()["resyncs"], 1)
+
+    def testStreamErrorResync(self):
+
+        stream = self.client.stream
+        with mock.patch("cluster.DockerContainerCache.sleep"):  # no backoff in tests
+            self.client.emit = False
+            self.client.create("hello-2", {LABEL: "hello"})
+            stream.fail(ConnectionError("connection reset"))
+
+            self.waitFor(lambda: self.client.stream is not stream)
+            self.waitFor(lambda: ("hello-2", "created") in self.services())
+
+        # the new stream delivers events again
+        self.client.emit = True
+        self.client.remove(self.cache.containers("hello")[0].id)
+        self.waitFor(lambda: len(self.services()) == 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
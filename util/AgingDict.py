@@ -0,0 +1,125 @@
+# Josef Hammer (josef.hammer@aau.at)
+#
+"""
+Dictionary with idle timeout and LRU eviction.
+"""
+
+from collections import OrderedDict
+from time import monotonic
+
+
+class AgingDict(object):
+    """
+    Dict: key -> value
+
+    Entries expire after `idleTimeout` seconds without access. If more than `maxEntries` entries are stored, the least
+    recently used entries are evicted. `onRemove(key, value)` is called for every expired or evicted entry (but not for
+    entries removed explicitly via pop()).
+
+    idleTimeout == None / maxEntries == 0: unlimited.
+    """
+
+    def __init__(self, idleTimeout=None, maxEntries=0, onRemove=None):
+
+        self.idleTimeout = idleTimeout
+        self.maxEntries = maxEntries
+        self._onRemove = onRemove
+        self._items = OrderedDict()  # key -> [value, expiry]; least recently used first
+
+        self.numExpired = 0
+        self.numEvicted = 0
+
+    def get(self, key, default=None):
+        """
+        Returns the value and marks it as recently used.
+        """
+        item = self._items.get(key)
+        if item is None:
+            return default
+
+        self._refresh(key, item)
+        return item[0]
+
+    def peek(self, key, default=None):
+        """
+        Returns the value _without_ marking it as recently used.
+        """
+        item = self._items.get(key)
+        return default if item is None else item[0]
+
+    def touch(self, key):
+
+        item = self._items.get(key)
+        if item is not None:
+            self._refresh(key, item)
+
+    def set(self, key, value):
+
+        item = self._items.get(key)
+        if item is None:
+            item = self._items[key] = [value, None]
+        else:
+            item[0] = value
+        self._refresh(key, item)
+
+        if self.maxEntries:
+            while len(self._items) > self.maxEntries:
+                self._remove(*self._items.popitem(last=False))  # least recently used
+                self.numEvicted += 1
+
+    def pop(self, key, default=None):
+
+        item = self._items.pop(key, None)
+        return default if item is None else item[0]
+
+    def expire(self, curTime=None):
+        """
+        Removes all entries that have not been used within `idleTimeout`.
+
+        Since the entries are ordered by last use, only the expired entries at the front have to be checked.
+        """
+        if self.idleTimeout is None:
+            return
+
+        curTime = monotonic() if curTime is None else curTime
+        items = self._items
+
+        while items:
+            key, item = next(iter(items.items()))
+            if curTime <= item[1]:
+                break
+            del items[key]
+            self._remove(key, item)
+            self.numExpired += 1
+
+    def items(self):
+        return ((key, item[0]) for key, item in self._items.items())
+
+    def values(self):
+        return (item[0] for item in self._items.values())
+
+    def _refresh(self, key, item):
+
+        if self.idleTimeout is not None:
+            item[1] = monotonic() + self.idleTimeout
+        self._items.move_to_end(key)
+
+    def _remove(self, key, item):
+
+        if self._onRemove:
+            self._onRemove(key, item[0])
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __getitem__(self, key):
+        return self._items[key][0]
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
@@ -0,0 +1,176 @@
+# Josef Hammer (josef.hammer@aau.at)
+#
+"""
+Bounded, prioritized execution of deployments.
+"""
+
+from collections import Counter, deque
+from concurrent.futures import Future
+from functools import partial
+from itertools import count
+from threading import Condition, Thread
+from time import monotonic
+
+
+class _Task(object):
+
+    def __init__(self, seq: int, edge, priority, future: Future, fn):
+
+        self.seq = seq
+        self.edge = edge
+        self.priority = priority  # fn() -> comparable (higher first)
+        self.future = future
+        self.fn = fn
+        self.queued = monotonic()
+
+
+class DeployExecutor(object):
+    """
+    Thread pool for deployments with a global limit (`maxWorkers`) and a limit per edge (`maxPerEdge`).
+
+    Pending tasks wait in a queue; a free worker picks the task with the highest priority among those whose edge is
+    below its limit (FIFO for equal priorities). The priority is evaluated when a worker becomes free, so it may grow
+    while the task waits (e.g., the number of waiting clients). Submissions beyond `maxQueue` pending tasks are
+    rejected right away.
+
+    Background tasks (e.g., pre-warming) use the priority BACKGROUND: they run only if no client task is runnable,
+    and never take the last `reserved` workers or slots of an edge (kept for clients arriving meanwhile).
+
+    Config (all optional):
+        "maxWorkers": 16
+        "maxPerEdge": 4 (0: unlimited)
+        "maxQueue": 256 (0: unlimited)
+        "reserved": 1 (workers and slots per edge that background tasks must leave free; at least one remains usable)
+    """
+
+    BACKGROUND = (-1, )  # lower than any client priority (see Dispatcher._priority())
+
+    def __init__(self, log, cfg: dict):
+
+        self.log = log
+        self.maxWorkers = max(1, cfg.get("maxWorkers", 16))
+        self.maxPerEdge = cfg.get("maxPerEdge", 4)
+        self.maxQueue = cfg.get("maxQueue", 256)
+        self.reserved = cfg.get("reserved", 1)
+
+        self._cond = Condition()
+        self._pending = []  # [_Task]
+        self._running = Counter()  # edge -> running tasks
+        self._seq = count()
+        self._workers = 0
+        self._idle = 0
+        self._waits = deque(maxlen=1000)  # queueing times (ms) since the last stats()
+
+        self.numSubmitted = self.numRejected = self.maxQueued = 0
+
+    def accepts(self) -> bool:
+        """
+        Returns False (and counts the rejection) if a submit would be rejected (queue full).
+        """
+        if self.full():
+            self.numRejected += 1
+            return False
+        return True
+
+    def full(self) -> bool:
+        return bool(self.maxQueue and len(self._pending) >= self.maxQueue)
+
+    def submit(self, edge, priority, fn, *args) -> Future:
+        """
+        priority: fn() -> comparable (e.g., a tuple; higher first)
+
+        Returns None if the task was rejected (queue full).
+        """
+        with self._cond:
+            if self.full():
+                self.numRejected += 1
+                return None
+
+            future = Future()
+            self._pending.append(_Task(next(self._seq), edge, priority, future, partial(fn, *args)))
+            self.numSubmitted += 1
+            self.maxQueued = max(self.maxQueued, len(self._pending))
+
+            if len(self._pending) > self._idle and self._workers < self.maxWorkers:
+                self._workers += 1
+                Thread(target=self._run, name=f"Deploy-{self._workers}", daemon=True).start()
+            self._cond.notify_all()
+            return future
+
+    def _next(self) -> _Task:
+        #
+        # NOTE: Called with the lock held.
+        #
+        best = bestPrio = None
+        running = sum(self._running.values())
+        for task in self._pending:
+            if self.maxPerEdge and self._running[task.edge] >= self.maxPerEdge:
+                continue
+            try:
+                prio = (task.priority(), -task.seq)
+            except Exception as e:
+                self.log.warn(f"DeployExecutor: priority failed: {e}")
+                prio = ((), -task.seq)
+            if prio[0] == self.BACKGROUND and not self._backgroundFits(task.edge, running):
+                continue
+            if best is None or prio > bestPrio:
+                best, bestPrio = task, prio
+        return best
+
+    def _backgroundFits(self, edge, running: int) -> bool:
+        #
+        # NOTE: Called with the lock held.
+        #
+        if running >= max(1, self.maxWorkers - self.reserved):
+            return False
+        return not self.maxPerEdge or self._running[edge] < max(1, self.maxPerEdge - self.reserved)
+
+    def _run(self):
+
+        while True:
+            with self._cond:
+                self._idle += 1
+                task = self._next()
+                while task is None:
+                    self._cond.wait()
+                    task = self._next()
+                self._idle -= 1
+
+                self._pending.remove(task)
+                self._running[task.edge] += 1
+                self._waits.append((monotonic() - task.queued) * 1000)
+
+            if task.future.set_running_or_notify_cancel():
+                try:
+                    task.future.set_result(task.fn())
+                except BaseException as e:
+                    task.future.set_exception(e)
+
+            with self._cond:
+                self._running[task.edge] -= 1
+                if not self._running[task.edge]:
+                    del self._running[task.edge]
+                self._cond.notify_all()  # the edge may be below its limit again
+
+    def stats(self) -> dict:
+        """
+        Queue depth and queueing times (ms) since the last call.
+        """
+        with self._cond:
+            waits = list(self._waits)
+            self._waits.clear()
+            stats = {
+                "queued": len(self._pending),
+                "maxQueued": self.maxQueued,
+                "running": sum(self._running.values()),
+                "workers": self._workers,
+                "submitted": self.numSubmitted,
+                "rejected": self.numRejected,
+                "wait": {
+                    "count": len(waits),
+                    "avg": round(sum(waits) / len(waits), 3) if waits else 0,
+                    "max": round(max(waits), 3) if waits else 0
+                }
+            }
+            self.maxQueued = len(self._pending)
+            return stats
@@ -0,0 +1,123 @@
+# Josef Hammer (josef.hammer@aau.at)
+#
+"""
+History of the deployment timings (see `#perfDeploy`).
+"""
+
+from __future__ import annotations
+
+from collections import deque
+from threading import Lock
+from statistics import median
+
+import json
+import os
+
+
+class DeployHistory(object):
+    """
+    Dict: (service, edge IP, task) -> [recent [total, port wait] times in ms]
+
+    Predicts the time of a deployment/scale-up (median of the recent samples). Falls back to the recent samples of the
+    same task of the service at any edge, then of any service at the edge, and finally of any service anywhere
+    (aggregates kept up to date by add(), i.e. a prediction never scans the history).
+
+    Persisted as JSON (if a filename is given): loaded on start, saved by save() if anything changed.
+
+    Thread-safe.
+    """
+
+    def __init__(self, filename: str = None, maxSamples=20, log=None):
+
+        self.filename = filename
+        self.maxSamples = maxSamples
+        self.log = log
+
+        self._lock = Lock()
+        self._samples = {}  # "service|edgeIP|task" -> [[total, wait]]
+        self._aggregates = {}  # (service, None, task) | (None, edgeIP, task) | (None, None, task) -> deque([total])
+        self._dirty = False
+
+        if filename and os.path.exists(filename):
+            self.load()
+
+    def add(self, service: str, edgeIP, task: str, total: float, wait: float = 0):
+
+        with self._lock:
+            samples = self._samples.setdefault(self._key(service, edgeIP, task), [])
+            samples.append([round(total), round(wait)])
+            del samples[:-self.maxSamples]
+            self._aggregate(service, str(edgeIP), task, round(total))
+            self._dirty = True
+
+    def _aggregate(self, service: str, edgeIP: str, task: str, total: float):
+        #
+        # NOTE: Called with the lock held.
+        #
+        for key in [(service, None, task), (None, edgeIP, task), (None, None, task)]:
+            samples = self._aggregates.get(key)
+            if samples is None:
+                samples = self._aggregates[key] = deque(maxlen=self.maxSamples * 5)
+            samples.append(total)
+
+    def predict(self, service: str, edgeIP, task: str) -> float:
+        """
+        Returns the predicted total time in ms; None if there is no history for this task at all.
+        """
+        with self._lock:
+            samples = self._samples.get(self._key(service, edgeIP, task))
+            if samples:
+                return median(s[0] for s in samples)
+
+            for key in [(service, None, task), (None, str(edgeIP), task), (None, None, task)]:
+                samples = self._aggregates.get(key)
+                if samples:
+                    return median(samples)
+        return None
+
+    def _key(self, service: str, edgeIP, task: str) -> str:
+        return f"{service}|{edgeIP}|{task}"
+
+    def load(self):
+
+        try:
+            with open(self.filename) as file:
+                samples = json.load(file)
+            with self._lock:
+                self._samples = {key: list(values)[-self.maxSamples:] for key, values in samples.items()}
+                self._aggregates = {}
+                for key, values in self._samples.items():
+                    service, edgeIP, task = key.rsplit('|', 2)
+                    for total, _ in values:
+                        self._aggregate(service, edgeIP, task, total)
+        except (OSError, ValueError) as e:
+            if self.log:
+                self.log.warn(f"Could not load deploy history {self.filename}: {e}")
+
+    def save(self):
+        """
+        Writes the history to the file (atomically) if it changed.
+        """
+        if not self.filename or not self._dirty:
+            return
+
+        with self._lock:
+            data = json.dumps(self._samples)
+            self._dirty = False
+
+        tmpName = self.filename + ".tmp"
+        try:
+            with open(tmpName, "w") as file:
+                file.write(data)
+            os.replace(tmpName, self.filename)
+        except OSError as e:
+            if self.log:
+                self.log.warn(f"Could not save deploy history {self.filename}: {e}")
+
+    def stats(self) -> dict:
+
+        with self._lock:
+            return {"entries": len(self._samples), "samples": sum(len(s) for s in self._samples.values())}
+
+    def __len__(self):
+        return len(self._samples)
@@ -0,0 +1,126 @@
+# Josef Hammer (josef.hammer@aau.at)
+#
+"""
+Keeps track of the deployments of services at edges.
+"""
+
+from __future__ import annotations
+
+from util.Service import Service, ServiceInstance
+
+from concurrent.futures import Future
+from threading import Lock
+
+
+class DeploymentState(object):
+    """
+    States of a deployment (per service and edge).
+    """
+    DEPLOYING = "deploying"
+    READY = "ready"
+    FAILED = "failed"
+    SCALED_DOWN = "scaledDown"
+
+
+class DeploymentRegistry(object):
+    """
+    Dict: (service, edge) -> (state, future)
+
+    The future is resolved exactly once by the deploying task (result: ServiceInstance; None if the deployment failed).
+    Waiters may block on it or attach a callback instead of polling.
+
+    Thread-safe.
+    """
+
+    def __init__(self):
+
+        self._lock = Lock()
+        self._entries = {}  # (service, edge) -> [state, future, resolved]
+
+    def book(self, service: Service, edge) -> bool:
+        """
+        Records that we are about to deploy this service.
+
+        Returns True if the same deployment is running already (i.e. the caller should only wait for it).
+        """
+        with self._lock:
+            entry = self._entries.get((service, edge))
+            if entry and entry[0] == DeploymentState.DEPLOYING:
+                return True
+
+            self._entries[(service, edge)] = [DeploymentState.DEPLOYING, Future(), False]
+            return False
+
+    def resolve(self, service: Service, edge, svc: ServiceInstance):
+        """
+        Marks the deployment as ready (or failed if `svc` is None) and notifies all waiters.
+        """
+        self._resolve(service, edge, DeploymentState.READY if svc else DeploymentState.FAILED, svc)
+
+    def scaledDown(self, service: Service, edge):
+        """
+        Marks the service instance as scaled down to zero and releases all waiters (result: None).
+
+        Waiters that find this state should book a new deployment (i.e. scale up again).
+        """
+        self._resolve(service, edge, DeploymentState.SCALED_DOWN, None)
+
+    def _resolve(self, service: Service, edge, state: str, svc: ServiceInstance):
+
+        # Claim the future within the lock (exactly one resolver gets it; a later one gets a new future), but run the
+        # callbacks outside of it (they may use the registry; see addCallback()).
+        #
+        with self._lock:
+            entry = self._entries.get((service, edge))
+            if entry is None or entry[2]:
+                entry = self._entries[(service, edge)] = [None, Future(), False]
+
+            entry[0] = state
+            entry[2] = True
+            future = entry[1]
+        future.set_result(svc)
+
+    def wait(self, service: Service, edge, timeout=None) -> ServiceInstance:
+        """
+        Blocks until the deployment is resolved. Returns None if there is no such deployment or if it failed.
+        """
+        future = self.future(service, edge)
+        return None if future is None else future.result(timeout)
+
+    def addCallback(self, service: Service, edge, fn) -> bool:
+        """
+        Calls fn(svc) once the deployment is resolved (immediately if it is resolved already).
+
+        Returns False if there is no such deployment.
+        """
+        future = self.future(service, edge)
+        if future is None:
+            return False
+
+        future.add_done_callback(lambda ft: fn(ft.result()))
+        return True
+
+    def future(self, service: Service, edge) -> Future:
+
+        with self._lock:
+            entry = self._entries.get((service, edge))
+            return None if entry is None else entry[1]
+
+    def state(self, service: Service, edge) -> str:
+
+        with self._lock:
+            entry = self._entries.get((service, edge))
+            return None if entry is None else entry[0]
+
+    def stats(self) -> dict:
+        """
+        Returns the number of deployments per state.
+        """
+        result = {}
+        with self._lock:
+            for state, _, _ in self._entries.values():
+                result[state] = result.get(state, 0) + 1
+        return result
+
+    def __len__(self):
+        return len(self._entries)
@@ -6,6 +6,8 @@ Provides containers for the other components.
 
 from util.RyuDPID import DPID
 from util.IPAddr import IPAddr
+from util.Stats import FlowStats
+from util.Resources import Resources
 
 
 class Host(object):
@@ -102,7 +104,7 @@ class Edge(object):
     Contains all the data for one edge location.
     """
 
-    def __init__(self, ip, switch, target: str, serviceCidr=[], schedulerName: str = None):
+    def __init__(self, ip, switch, target: str, serviceCidr=[], schedulerName: str = None, capacity: Resources = None):
 
         assert isinstance(serviceCidr, list)
 
@@ -116,6 +118,9 @@ class Edge(object):
         self.vServices = {}  # SocketAddr -> ServiceInstance
         self.eServices = {}  # SocketAddr -> ServiceInstance
 
+        self.stats = FlowStats()  # sum of all service instances
+        self.capacity = capacity  # None: unlimited
+
     @property
     def dpid(self):
         return self.switch.dpid
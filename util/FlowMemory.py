@@ -1,4 +1,8 @@
-import time
+from util.AgingDict import AgingDict
+from util.SocketAddr import SocketAddr
+from util.Stats import Stats
+
+import sys
 
 
 class FlowMemoryEntry(object):
@@ -9,19 +13,12 @@ class FlowMemoryEntry(object):
     flows, increasing switching speed.
     """
 
-    idleTimeout = 60  # seconds
-
-    def __init__(self, src, dst, edge):
+    def __init__(self, src, dst, edge, cookie=Stats.REDIR_EDGE, dpid=None):
         self.src = src
         self.dst = dst
         self.edge = edge
-
-        self.timeout = None
-        # we do not call refresh() here for performance reasons
-
-    def refresh(self):
-        self.timeout = time.time() + FlowMemoryEntry.idleTimeout
-        return self
+        self.cookie = cookie  # identifies the service instance in the flow statistics
+        self.dpid = dpid  # switch the edge is attached to
 
     @property
     def fwdkey(self):
@@ -36,39 +33,103 @@ class FlowMemoryEntry(object):
 
 
 class FlowMemory(object):
-    """ 
+    """
     Manages FlowMemoryEntries. Client port is _not_ used for search, only the IP.
+
+    The memory is bounded by `maxEntries` and/or `maxBytes` (0: unlimited). If full, the least recently used entry is
+    evicted. Forward and return lookup always refer to the same set of entries.
     """
 
-    def __init__(self, idleTimeout=60):  # seconds
+    def __init__(self, idleTimeout=60, maxEntries=0, maxBytes=0):  # seconds
+
+        self.entryBytes = FlowMemory.entrySize()
+        if maxBytes:
+            byteLimit = max(1, maxBytes // self.entryBytes)
+            maxEntries = min(maxEntries, byteLimit) if maxEntries else byteLimit
 
-        self._fwd = {}
-        self._ret = {}
-        FlowMemoryEntry.idleTimeout = idleTimeout
+        self._fwd = AgingDict(idleTimeout, maxEntries, onRemove=self._removeRet)  # fwdkey -> entry (in LRU order)
+        self._ret = {}  # retkey -> entry
 
     def getFwd(self, src, dst):  # client to serviceID
 
-        self._expireOldFlows()  # expire on fwd event only
-        entry = self._fwd.get(FlowMemoryEntry(src, dst, None).fwdkey)
-        return entry if entry is None else entry.refresh()
+        self._fwd.expire()  # expire on fwd event only
+        return self._fwd.get(FlowMemoryEntry(src, dst, None).fwdkey)
 
     def getRet(self, edge, src):  # edge to client
 
         entry = self._ret.get(FlowMemoryEntry(src, None, edge).retkey)
-        return None if entry is None else entry.refresh()
+        if entry is not None:
+            self._fwd.touch(entry.fwdkey)
+        return entry
 
     def add(self, entry: FlowMemoryEntry):
 
-        entry.refresh()
+        prev = self._fwd.pop(entry.fwdkey)  # e.g. client migrated to a different edge
+        if prev is not None:
+            self._removeRet(prev.fwdkey, prev)
+
         self._fwd[entry.fwdkey] = entry  # does not use client port
         self._ret[entry.retkey] = entry  # does not use client port
 
-    def _expireOldFlows(self):
-
-        curTime = time.time()  # performance: call only once for all flows
+    def expire(self):
+
+        self._fwd.expire()
+
+    def removeEdges(self, edges: list) -> list[FlowMemoryEntry]:
+        """
+        Removes all entries pointing at one of the edges (e.g., replicas to be stopped) and returns them.
+        """
+        entries = [entry for entry in self._fwd.values() if entry.edge in edges]
+        for entry in entries:
+            self._fwd.pop(entry.fwdkey)
+            self._removeRet(entry.fwdkey, entry)
+        return entries
+
+    @staticmethod
+    def entrySize() -> int:
+        """
+        Measures the memory used per entry (sys.getsizeof): the entry with its SocketAddrs and IPs, both keys, and the
+        slots in both dicts (incl. the LRU bookkeeping of the AgingDict). Strings and ints shared with other objects
+        (e.g., the MACs) are counted as well, so it is an upper bound.
+        """
+        src = SocketAddr("10.0.0.1", 54321, "02:00:00:00:00:01")
+        dst = SocketAddr("10.0.100.1", 80, "02:00:00:00:00:02")
+        edge = SocketAddr("10.0.200.1", 30080, "02:00:00:00:00:03")
+        entry = FlowMemoryEntry(src, dst, edge, Stats.cookie(Stats.REDIR_EDGE, 1), 1)
+
+        seen = set()
+
+        def sizeOf(obj) -> int:
+            if id(obj) in seen:
+                return 0
+            seen.add(id(obj))
+            size = sys.getsizeof(obj)
+            if isinstance(obj, (tuple, list)):
+                size += sum(sizeOf(item) for item in obj)
+            if hasattr(obj, "__dict__"):
+                size += sizeOf(obj.__dict__) + sum(sizeOf(value) for value in vars(obj).values())
+            for slot in getattr(type(obj), "__slots__", ()):
+                size += sizeOf(getattr(obj, slot, None))
+            return size
+
+        fwdItem = [entry, 0.0]  # AgingDict: [value, expiry]
+        dictSlots = 2 * 3 * 8 * 2  # hash, key, value (8 bytes each) per slot in both dicts; <= 2/3 used
+        return sizeOf(entry) + sizeOf(entry.fwdkey) + sizeOf(entry.retkey) + sizeOf(fwdItem) + dictSlots
+
+    def stats(self) -> dict:
+
+        return {
+            "entries": len(self._fwd),
+            "bytes": len(self._fwd) * self.entryBytes,
+            "expired": self._fwd.numExpired,
+            "evicted": self._fwd.numEvicted
+        }
+
+    def _removeRet(self, fwdkey, entry: FlowMemoryEntry):
 
         # REVIEW Forward to other components?
-        expired = [v for v in self._fwd.values() if curTime > v.timeout]
+        if self._ret.get(entry.retkey) is entry:
+            del self._ret[entry.retkey]
 
-        self._fwd = {k: v for k, v in self._fwd.items() if curTime <= v.timeout}
-        self._ret = {k: v for k, v in self._ret.items() if curTime <= v.timeout}
+    def __len__(self):
+        return len(self._fwd)
@@ -0,0 +1,60 @@
+# Josef Hammer (josef.hammer@aau.at)
+#
+"""
+Consistent hashing.
+"""
+
+from bisect import bisect
+from hashlib import md5
+
+
+class HashRing(object):
+    """
+    Maps keys (e.g., client IPs) to nodes (e.g., service replicas) by consistent hashing.
+
+    Each node is placed `vnodes` times on the ring for an even distribution. If a node is added or removed, only the
+    keys of that node move (~1/n of all keys); all other keys keep their node.
+    """
+
+    def __init__(self, nodes: list = None, vnodes=64):
+
+        self._vnodes = vnodes
+        self._ring = []  # sorted hashes
+        self._nodes = {}  # hash -> node
+
+        for node in nodes or []:
+            self.add(node)
+
+    def add(self, node):
+
+        for i in range(self._vnodes):
+            h = self._hash(f"{node}#{i}")
+            if h not in self._nodes:
+                self._ring.insert(bisect(self._ring, h), h)
+            self._nodes[h] = node
+
+    def remove(self, node):
+
+        for i in range(self._vnodes):
+            h = self._hash(f"{node}#{i}")
+            if self._nodes.get(h) == node:
+                del self._nodes[h]
+                self._ring.remove(h)
+
+    def get(self, key):
+        """
+        Returns the node for this key; None if the ring is empty.
+        """
+        if not self._ring:
+            return None
+
+        idx = bisect(self._ring, self._hash(str(key))) % len(self._ring)
+        return self._nodes[self._ring[idx]]
+
+    @staticmethod
+    def _hash(value: str) -> int:
+        # stable across processes (unlike hash())
+        return int.from_bytes(md5(value.encode()).digest()[:8], 'big')
+
+    def __len__(self):
+        return len(self._ring) // self._vnodes
@@ -6,6 +6,13 @@ import yaml
 from util.Service import Service, ServiceInstance, Container
 from util.IPAddr import IPAddr
 from util.SocketAddr import SocketAddr
+from util.Resources import Resources
+from util.Performance import PerfCounter
+
+from copy import deepcopy
+from threading import Lock
+
+import os
 
 
 class K8sService(object):
@@ -14,6 +21,12 @@ class K8sService(object):
     """
     LABEL_NAME = "edge.service"
 
+    # Parsed service files: many services may share the same template (e.g., symlinked service files), so each file is
+    # parsed only once (per resolved path and mtime) and every instance gets its own copy to annotate.
+    #
+    _templates = {}  # resolved path -> {"mtime", "yaml", "containers", "volumes", "parseTime"}
+    _templatesLock = Lock()
+
     def __init__(self, service=None, label=None, port=None, filename=None, yml: dict = None):
 
         self.service = service
@@ -33,7 +46,8 @@ class K8sService(object):
         self._serviceDef = None  # pointer to the yaml item (if avail)
         self._deploymentDef = None  # pointer to the yaml item (if avail)
         self._containers = None
-
+        self._volumes = None
+        self.perf = {}  # timings (ms) of parsing (and deploying, see K8sCluster) this service
         # NOTE: info from filename has precedence over yaml
         #
         if not filename is None:
@@ -44,10 +58,45 @@ class K8sService(object):
 
         assert (filename is not None or yml is not None)  # only one of both allowed
         if filename is not None:
-            self.yaml = self._loadYaml(filename)
+            self._loadTemplate(filename)
         elif yml is not None:
             self.yaml = yml
+            self._parseYaml(self.yaml)
+
+    def _loadTemplate(self, filename):
+        """
+        Loads and parses the service file, or copies the cached result if the file has been parsed already.
+        """
+        perf = PerfCounter()
+        path = os.path.realpath(filename)
+        mtime = os.stat(path).st_mtime_ns
+
+        with K8sService._templatesLock:
+            template = K8sService._templates.get(path)
+
+        if template and template["mtime"] == mtime:
+            self.yaml = deepcopy(template["yaml"])
+            self._containers = deepcopy(template["containers"])
+            self._volumes = template["volumes"]
+            self._parseYaml(self.yaml)  # label, ports, etc. may differ per service
+            self.perf["parse"] = perf.ms()
+            self.perf["parseSaved"] = round(max(0, template["parseTime"] - self.perf["parse"]), 3)
+            return
+
+        self.yaml = self._loadYaml(filename)
         self._parseYaml(self.yaml)
+        volumes = self.volumes() if self._deploymentDef else None
+        self.perf["parse"] = perf.ms()
+        self.perf["parseSaved"] = 0
+
+        with K8sService._templatesLock:
+            K8sService._templates[path] = {
+                "mtime": mtime,
+                "yaml": deepcopy(self.yaml),  # annotate() modifies our copy
+                "containers": deepcopy(self._containers),
+                "volumes": volumes,
+                "parseTime": self.perf["parse"]
+            }
 
     def annotate(self, schedulerName: str = None, replicas: int = 0) -> K8sService:
 
@@ -197,10 +246,26 @@ class K8sService(object):
                 if path and name:
                     cont.volumes[name] = path
 
+            resources = container.get('resources') or {}
+            for kind in ['limits', 'requests']:  # requests have precedence
+                values = resources.get(kind) or {}
+                cont.cpu = Resources.parseCpu(values.get('cpu', cont.cpu))
+                cont.memory = Resources.parseMemory(values.get('memory', cont.memory))
+
         return result
 
+    def resources(self) -> Resources:
+        """
+        Returns the resources required per replica.
+        """
+        containers = self.containers()
+        return Resources(len(containers), sum(cont.cpu for cont in containers), sum(cont.memory for cont in containers))
+
     def volumes(self) -> dict[str]:  # name -> hostPath
 
+        if self._volumes is not None:
+            return dict(self._volumes)
+
         assert (self._deploymentDef)
         result = {}
 
@@ -224,7 +289,8 @@ class K8sService(object):
             if path is not None:
                 result[name] = path
 
-        return result
+        self._volumes = result
+        return dict(result)
 
     def _parseServiceDef(self, yml: dict):
         """
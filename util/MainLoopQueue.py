@@ -0,0 +1,72 @@
+# Josef Hammer (josef.hammer@aau.at)
+#
+"""
+Hands over work from worker threads to the controller's main loop.
+"""
+
+from queue import SimpleQueue, Empty
+
+import os
+
+
+class MainLoopQueue(object):
+    """
+    Queue of callables to be executed in the main loop.
+
+    Worker threads call put(). The main loop waits until fileno() is readable (e.g., with a green-thread-aware
+    trampoline) and then calls drain() to execute all queued callables. Thus, all switch I/O stays in a single thread.
+    """
+
+    def __init__(self, log):
+
+        self.log = log
+        self._queue = SimpleQueue()
+
+        # self-pipe: wakes up the main loop (without polling)
+        #
+        self._rfd, self._wfd = os.pipe()
+        os.set_blocking(self._rfd, False)
+        os.set_blocking(self._wfd, False)
+
+    def put(self, fn):
+        """
+        Thread-safe.
+        """
+        self._queue.put(fn)
+        try:
+            os.write(self._wfd, b'.')
+        except BlockingIOError:
+            pass  # pipe is full -> the main loop will wake up anyway
+
+    def fileno(self):
+        return self._rfd
+
+    def drain(self):
+        """
+        Executes all queued callables. To be called in the main loop only.
+
+        Returns the number of executed callables.
+        """
+        # clear the pipe _before_ reading the queue: items added later trigger another wakeup
+        #
+        try:
+            while os.read(self._rfd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        count = 0
+        while True:
+            try:
+                fn = self._queue.get_nowait()
+            except Empty:
+                return count
+
+            count += 1
+            try:
+                fn()
+            except Exception as e:
+                self.log.exception(f"MainLoopQueue: {e}")
+
+    def __len__(self):
+        return self._queue.qsize()
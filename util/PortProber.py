@@ -0,0 +1,118 @@
+# Josef Hammer (josef.hammer@aau.at)
+#
+"""
+Shared, asynchronous prober for open TCP ports.
+"""
+
+from util.SocketAddr import SocketAddr
+from util.Performance import PerfCounter
+
+from concurrent.futures import Future
+from threading import Lock, Thread
+
+import asyncio
+
+
+class PortProber(object):
+    """
+    Waits until TCP ports are open for connections (e.g., a service instance is ready).
+
+    All probes run as non-blocking connects in a single asyncio loop (in a background thread), with exponential backoff
+    between the attempts and a deadline. Concurrent requests for the same address share a single probe.
+
+    Thread-safe.
+    """
+
+    def __init__(self, log, timeout=30, connectTimeout=0.2, minBackoff=0.005, maxBackoff=0.2):  # seconds
+
+        self.log = log
+        self.timeout = timeout
+        self.connectTimeout = connectTimeout
+        self.minBackoff = minBackoff
+        self.maxBackoff = maxBackoff
+
+        self._lock = Lock()
+        self._probes = {}  # SocketAddr -> [Future, numWaiters]
+
+        self.numRequests = 0
+        self.numProbes = 0
+        self.numAttempts = 0
+        self.numTimeouts = 0
+
+        self._loop = asyncio.new_event_loop()
+        Thread(target=self._loop.run_forever, name="PortProber", daemon=True).start()
+
+    def probe(self, addr: SocketAddr) -> Future:
+        """
+        Returns a future that is resolved once the port is open (or the deadline has passed).
+
+        Result: 0 if the port was open on the first attempt; the waiting time in ms otherwise.
+        """
+        with self._lock:
+            self.numRequests += 1
+
+            probe = self._probes.get(addr)
+            if probe is not None:
+                probe[1] += 1
+                return probe[0]
+
+            self.numProbes += 1
+            probe = self._probes[addr] = [None, 1]
+            probe[0] = asyncio.run_coroutine_threadsafe(self._probe(addr), self._loop)
+            return probe[0]
+
+    def wait(self, addr: SocketAddr):
+        """
+        Blocks until the port is open (or the deadline has passed). Returns the waiting time in ms (0 if open at once).
+        """
+        return self.probe(addr).result()
+
+    async def _probe(self, addr: SocketAddr):
+
+        perf = PerfCounter()
+        deadline = self._loop.time() + self.timeout
+        backoff = self.minBackoff
+        attempts = 0
+        isOpen = False
+
+        while True:
+            attempts += 1
+            try:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(str(addr.ip), addr.port),
+                                                   self.connectTimeout)
+                writer.close()
+                isOpen = True
+                break
+            except (OSError, asyncio.TimeoutError):
+                pass
+
+            if self._loop.time() + backoff > deadline:
+                break
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.maxBackoff)
+
+        waitTime = perf.ms() if attempts > 1 else 0  # > 0 only if port was still closed on first attempt
+
+        with self._lock:
+            self.numAttempts += attempts
+            if not isOpen:
+                self.numTimeouts += 1
+            waiters = self._probes.pop(addr)[1]
+
+        if not isOpen:
+            self.log.error(f"Port {addr} still closed after {round(waitTime)} ms.")
+
+        self.log.info(f'#perfProbe: {{"addr":"{str(addr)}", "open":{str(isOpen).lower()}, "attempts":{attempts}, ' +
+                      f'"waiters":{waiters}, "wait":{round(waitTime)}}}')
+        return waitTime
+
+    def stats(self) -> dict:
+
+        with self._lock:
+            return {
+                "requests": self.numRequests,
+                "probes": self.numProbes,
+                "attempts": self.numAttempts,
+                "timeouts": self.numTimeouts,
+                "running": len(self._probes)
+            }
@@ -0,0 +1,94 @@
+# Josef Hammer (josef.hammer@aau.at)
+#
+"""
+Compute resources (of an edge or required by a service).
+"""
+
+from __future__ import annotations
+
+import re
+
+
+class Resources(object):
+    """
+    Tuple: containers, cpu (cores), memory (bytes)
+
+    As a capacity, 0 means 'no limit'.
+    """
+
+    _memUnits = {
+        '': 1,
+        'k': 1000,
+        'M': 1000**2,
+        'G': 1000**3,
+        'T': 1000**4,
+        'Ki': 1024,
+        'Mi': 1024**2,
+        'Gi': 1024**3,
+        'Ti': 1024**4
+    }
+    _memPattern = re.compile(r'^([0-9.]+)([a-zA-Z]*)$')
+
+    def __init__(self, containers=0, cpu=0, memory=0):
+
+        self.containers = containers
+        self.cpu = Resources.parseCpu(cpu)
+        self.memory = Resources.parseMemory(memory)
+
+    @staticmethod
+    def fromCfg(cfg: dict) -> Resources:
+        """
+        E.g. {"containers": 20, "cpu": 4, "memory": "8Gi"}; None if no config.
+        """
+        if not cfg:
+            return None
+        return Resources(cfg.get("containers", 0), cfg.get("cpu", 0), cfg.get("memory", 0))
+
+    @staticmethod
+    def parseCpu(value) -> float:
+        """
+        K8s notation: 0.5 | "500m" | "2"
+        """
+        if isinstance(value, str):
+            return int(value[:-1]) / 1000 if value.endswith('m') else float(value)
+        return value or 0
+
+    @staticmethod
+    def parseMemory(value) -> int:
+        """
+        K8s notation: 134217728 | "128Mi" | "1G"
+        """
+        if isinstance(value, str):
+            match = Resources._memPattern.match(value.strip())
+            if not match or match.group(2) not in Resources._memUnits:
+                raise ValueError(f"Invalid memory value: {value}")
+            return int(float(match.group(1)) * Resources._memUnits[match.group(2)])
+        return int(value or 0)
+
+    def fits(self, capacity: Resources) -> bool:
+        """
+        True if these resources do not exceed the capacity (limits of 0 are ignored).
+        """
+        return ((not capacity.containers or self.containers <= capacity.containers)
+                and (not capacity.cpu or self.cpu <= capacity.cpu + 1e-9)
+                and (not capacity.memory or self.memory <= capacity.memory))
+
+    def __add__(self, other: Resources) -> Resources:
+        return Resources(self.containers + other.containers, self.cpu + other.cpu, self.memory + other.memory)
+
+    def __sub__(self, other: Resources) -> Resources:
+        return Resources(self.containers - other.containers, self.cpu - other.cpu, self.memory - other.memory)
+
+    def __mul__(self, factor: int) -> Resources:
+        return Resources(self.containers * factor, self.cpu * factor, self.memory * factor)
+
+    def __eq__(self, other):
+        if (isinstance(other, Resources)):
+            return (self.containers, self.cpu, self.memory) == (other.containers, other.cpu, other.memory)
+        return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "containers={} cpu={} mem={}Mi".format(self.containers, round(self.cpu, 3), round(self.memory / 1024**2))
@@ -75,12 +75,18 @@ class OpenFlow(object):
     def PacketOut(self):
         return PacketOut(self)
 
+    def GroupMod(self):
+        return GroupMod(self)
+
     def BarrierRequest(self):
         return BarrierRequest(self)
 
     def AggregateStatsRequest(self):
         return AggregateStatsRequest(self)
 
+    def FlowStatsRequest(self):
+        return FlowStatsRequest(self)
+
     def ArpRequest(self, dstIP):
         return ArpRequest(self, dstIP)
 
@@ -90,6 +96,13 @@ class OpenFlow(object):
     def hasBufferID(self):
         return self.msg.buffer_id != self.proto.OFP_NO_BUFFER
 
+    def discardPacket(self):
+        """
+        Messages created from now on neither reference the switch's buffer (it may have been released already) nor
+        forward the packet.
+        """
+        self.msg.buffer_id = self.proto.OFP_NO_BUFFER
+
     def isValidPort(self, port):
         return port <= self.proto.OFPP_MAX
 
@@ -161,6 +174,7 @@ class Action(object):
         self._srcPort = None
         self._dstPort = None
         self._outport = None
+        self._group = None
         self._toTable = None
         self._isTCP = True
 
@@ -187,6 +201,8 @@ class Action(object):
                 actions.append(self.of.parser.OFPActionSetField(udp_dst=self._dstPort))
         if self._outport != None:
             actions.append(self.of.parser.OFPActionOutput(self._outport, 0))  # REVIEW: Is max_len = 0 correct?
+        if self._group != None:
+            actions.append(self.of.parser.OFPActionGroup(self._group))
 
         return actions
 
@@ -214,6 +230,12 @@ class Action(object):
         self._outport = self.of.proto.OFPP_FLOOD if outport is None else outport
         return self
 
+    def group(self, groupID):
+
+        assert self._outport is None  # either outport or group
+        self._group = groupID
+        return self
+
     def sendToController(self):
 
         return self.outport(self.of.proto.OFPP_CONTROLLER)
@@ -273,8 +295,8 @@ class Match(object):
         self.kwargs["ipv4_dst"] = (ip.ip, mask) if isinstance(ip, IPAddr) else (ip, mask)
         return self
 
-    def srcPort(self, port):
-        self.kwargs["ip_proto"] = self.of.packet().ipv4().proto
+    def srcPort(self, port, proto=None):  # proto: of the packet by default
+        self.kwargs["ip_proto"] = proto or self.of.packet().ipv4().proto
 
         if self.kwargs["ip_proto"] == OpenFlow.IPPROTO_TCP:
             self.kwargs["tcp_src"] = port
@@ -282,8 +304,8 @@ class Match(object):
             self.kwargs["udp_src"] = port
         return self
 
-    def dstPort(self, port):
-        self.kwargs["ip_proto"] = self.of.packet().ipv4().proto
+    def dstPort(self, port, proto=None):  # proto: of the packet by default
+        self.kwargs["ip_proto"] = proto or self.of.packet().ipv4().proto
 
         if self.kwargs["ip_proto"] == OpenFlow.IPPROTO_TCP:
             self.kwargs["tcp_dst"] = port
@@ -368,7 +390,8 @@ class FlowMod(Message):
         self.msg.match = match
         return self
 
-    # If packetOut == 'True' then the output action is already included in the action. Otherwise, it's the output port.
+    # If packetOut == 'True' then the output action is already included in the action. If it's an Action, then that
+    # one is used for the PacketOut (e.g., if the FlowMod forwards to a group). Otherwise, it's the output port.
     #
     # NOTE: Any gotoTable actions will be ignored (for the PacketOut only!) since these are not possible for PacketOut.
     #
@@ -380,6 +403,8 @@ class FlowMod(Message):
             if packetOut:  # output action is already included
                 assert actions._outport != None and actions._outport != self.of.proto.OFPP_CONTROLLER
                 self._packetOutAction = actions.build()
+        elif isinstance(packetOut, Action):
+            self._packetOutAction = packetOut.build()
         else:  # outport or None
             self._packetOutAction = self.of.Action().outport(packetOut).build()
         return self
@@ -401,16 +426,22 @@ class FlowMod(Message):
         Clear table number `tableID` (0..n).
         """
 
+        self.delete()
+
+        # Set barrier (otherwise flows added later might be deleted)
+        #
+        self.of.BarrierRequest().send()
+
+    def delete(self):
+        """
+        Deletes all flows of the table that match (non-strict, i.e. incl. all more specific flows; default: all).
+        """
         self.msg.command = self._dp.ofproto.OFPFC_DELETE
 
         self.msg.out_port = self._dp.ofproto.OFPP_ANY  # required for DELETE to work !!!
         self.msg.out_group = self._dp.ofproto.OFPG_ANY  # required for DELETE to work !!!
         self.send()
 
-        # Set barrier (otherwise flows added later might be deleted)
-        #
-        self.of.BarrierRequest().send()
-
 
 class PacketOut(Message):
     """
@@ -434,6 +465,54 @@ class PacketOut(Message):
         return self
 
 
+class GroupMod(Message):
+    """
+    Sends out OpenFlow GroupMod messages (ofp_parser.OFPGroupMod) for SELECT groups.
+    """
+
+    def __init__(self, of: OpenFlow):
+        super().__init__(of)
+
+        self.msg = self._dp.ofproto_parser.OFPGroupMod(self._dp, type_=self._dp.ofproto.OFPGT_SELECT)
+
+    def group(self, groupID):
+
+        self.msg.group_id = groupID
+        return self
+
+    def buckets(self, actions: list[Action]):
+        """
+        One bucket per Action (equal weights: the switch hashes the flows across the buckets).
+        """
+        self.msg.buckets = [
+            self.of.parser.OFPBucket(weight=1,
+                                     watch_port=self.of.proto.OFPP_ANY,
+                                     watch_group=self.of.proto.OFPG_ANY,
+                                     actions=action.build()) for action in actions
+        ]
+        return self
+
+    def add(self):
+
+        self.msg.command = self.of.proto.OFPGC_ADD
+        self.send()
+
+    def modify(self):
+
+        self.msg.command = self.of.proto.OFPGC_MODIFY
+        self.send()
+
+    def delete(self):
+        """
+        Deletes the group (and all flows forwarding to it); all groups if no group ID was set.
+        """
+        self.msg.command = self.of.proto.OFPGC_DELETE
+        if not self.msg.group_id:
+            self.msg.group_id = self.of.proto.OFPG_ALL
+        self.msg.buckets = []
+        self.send()
+
+
 class BarrierRequest(Message):
     def __init__(self, of: OpenFlow):
         super().__init__(of)
@@ -460,7 +539,7 @@ class AggregateStatsRequest(Message):
     def cookie(self, cookie, mask):
 
         self.msg.cookie = cookie
-        self.msg.cookieMask = mask
+        self.msg.cookie_mask = mask
         return self
 
     def table(self, tableID):
@@ -480,6 +559,24 @@ class AggregateStatsRequest(Message):
         return self.msg.xid  # required to track the correct response
 
 
+class FlowStatsRequest(AggregateStatsRequest):
+    """
+    Requests the statistics of the individual flows (one reply per flow; possibly split into several messages).
+    """
+
+    def __init__(self, of: OpenFlow):
+        Message.__init__(self, of)
+
+        self.msg = self.of.parser.OFPFlowStatsRequest(self._dp,
+                                                      0,
+                                                      of.proto.OFPTT_ALL,
+                                                      of.proto.OFPP_ANY,
+                                                      of.proto.OFPG_ANY,
+                                                      0,
+                                                      0,
+                                                      match=of.parser.OFPMatch())
+
+
 class ArpRequest(Message):
     def __init__(self, of: OpenFlow, dstIP: IPAddr):
         super().__init__(of)
@@ -9,8 +9,11 @@ NOTE: The variable names usually used are:
 - serviceDef: K8sService
 """
 
+from __future__ import annotations
+
 from util.IPAddr import IPAddr
 from util.SocketAddr import SocketAddr
+from util.HashRing import HashRing
 
 import re
 import os
@@ -95,6 +98,25 @@ class ServiceInstance(object):
         self.deployment: Deployment = None
         self.containers = []  # REVIEW
 
+        self.replicas = []  # edge addresses of all ready replicas (eAddr is used if empty)
+        self._ring = None  # HashRing over the replicas
+
+        self.resources = None  # required per replica (Resources)
+        self.coldStart = 0  # ms of the last deployment/scale-up (0: unknown)
+
+    def setReplicas(self, addrs: list[SocketAddr]):
+
+        self.replicas = list(addrs)
+        self._ring = HashRing(self.replicas) if len(self.replicas) > 1 else None
+
+    def replicaFor(self, ip: IPAddr) -> SocketAddr:
+        """
+        Returns the replica for this client (consistent hashing: a client stays with its replica).
+        """
+        if self._ring is not None:
+            return self._ring.get(ip)
+        return self.replicas[0] if self.replicas else self.eAddr
+
     def __eq__(self, other):
         if (isinstance(other, ServiceInstance)):
             return self.service == other.service and self.edgeIP == other.edgeIP and self.eAddr == other.eAddr
@@ -104,7 +126,8 @@ class ServiceInstance(object):
         return not self == other
 
     def __repr__(self):
-        return "{} @ {} ({}) [{}]".format(self.service, self.edgeIP, self.eAddr or '-', self.deployment)
+        replicas = f" +{len(self.replicas) - 1}" if len(self.replicas) > 1 else ""
+        return "{} @ {} ({}{}) [{}]".format(self.service, self.edgeIP, self.eAddr or '-', replicas, self.deployment)
 
 
 class Deployment(object):
@@ -157,6 +180,8 @@ class Container(object):
         self.ports = []
         self.volumes = {}  # name -> mountPath
         self.imagePullPolicy = "IfNotPresent"  # IfNotPresent | Always | Never
+        self.cpu = 0  # requested cores (resources.requests; limits otherwise)
+        self.memory = 0  # requested bytes (resources.requests; limits otherwise)
 
     def __repr__(self):
         return f"{self.name}: {self.image} {self.ports}"
@@ -4,6 +4,8 @@
 Flow statistics.
 """
 
+from time import time
+
 
 class Stats(object):
     """
@@ -15,6 +17,7 @@ class Stats(object):
     # uint64_t cookie
     #
     CATEGORY_MASK = 0xff
+    ALL_MASK = 0xffffffffffffffff
     CATEGORY_SHIFT = 8
     DETAIL_SHIFT = 4
 
@@ -32,3 +35,140 @@ class Stats(object):
         :returns: The cookie value combining both category and value.
         """
         return (value << Stats.CATEGORY_SHIFT) + category
+
+    @staticmethod
+    def category(cookie: int) -> int:
+        return cookie & Stats.CATEGORY_MASK
+
+    @staticmethod
+    def value(cookie: int) -> int:
+        return cookie >> Stats.CATEGORY_SHIFT
+
+
+class FlowStats(object):
+    """
+    Flow counters of a service instance (or an entire edge).
+    """
+
+    def __init__(self):
+
+        self.activeFlows = 0  # flows currently installed on the switches
+        self.totalFlows = 0
+        self.packets = 0  # packets/bytes of removed flows (from FlowRemoved)
+        self.bytes = 0
+        self.byteRate = 0  # bytes/s of the installed flows (from AggregateStats)
+        self.lastActive = 0  # timestamp (seconds) of the last flow setup/removal
+        self.created = time()
+
+    def flowAdded(self):
+
+        self.activeFlows += 1
+        self.totalFlows += 1
+        self.lastActive = time()
+
+    def flowRemoved(self, packets: int, bytes: int):
+
+        self.activeFlows = max(0, self.activeFlows - 1)
+        self.packets += packets
+        self.bytes += bytes
+        self.lastActive = time()  # the flow was in use until its idle timeout
+
+    def __repr__(self):
+        return "flows={}/{} bytes={} rate={}".format(self.activeFlows, self.totalFlows, self.bytes,
+                                                     round(self.byteRate))
+
+
+class FlowStatsRegistry(object):
+    """
+    Assigns a cookie to each service instance (edge, eAddr) and keeps the FlowStats per cookie.
+
+    The counters of each instance are added to the FlowStats of its edge (`edge.stats`), too.
+    """
+
+    def __init__(self, category=Stats.REDIR_EDGE):
+
+        self.category = category
+        self._cookies = {}  # (edge, eAddr) -> cookie
+        self._stats = {}  # cookie -> (FlowStats, edge)
+        self._aggregates = {}  # cookie -> {dpid -> (flowCount, byteCount, byteRate, timestamp)}
+        self._lastID = 0
+
+    def cookie(self, edge, eAddr) -> int:
+
+        cookie = self._cookies.get((edge, eAddr))
+        if cookie is None:
+            self._lastID += 1
+            cookie = self._cookies[(edge, eAddr)] = Stats.cookie(self.category, self._lastID)
+            self._stats[cookie] = (FlowStats(), edge)
+        return cookie
+
+    def expire(self, alive: set):
+        """
+        Removes the cookies of service instances that do not exist anymore (`alive`: {(edge, eAddr)}) once they have
+        no active flows left.
+        """
+        for key, cookie in list(self._cookies.items()):
+            stats, edge = self._stats[cookie]
+            if key not in alive and not stats.activeFlows:
+                del self._cookies[key]
+                del self._stats[cookie]
+                self._aggregates.pop(cookie, None)
+                edge.stats.byteRate -= stats.byteRate
+
+    def cookies(self):
+        return self._stats.keys()
+
+    def stats(self, edge, eAddr) -> FlowStats:
+
+        cookie = self._cookies.get((edge, eAddr))
+        return None if cookie is None else self._stats[cookie][0]
+
+    def flowAdded(self, cookie: int):
+
+        stats, edge = self._stats.get(cookie, (None, None))
+        if stats:
+            stats.flowAdded()
+            edge.stats.flowAdded()
+
+    def flowRemoved(self, cookie: int, packets: int, bytes: int):
+
+        stats, edge = self._stats.get(cookie, (None, None))
+        if stats:
+            stats.flowRemoved(packets, bytes)
+            edge.stats.flowRemoved(packets, bytes)
+
+    def update(self, dpid, counters: dict):
+        """
+        Updates all cookies with the live values from the switch `dpid` (cookie -> [flowCount, byteCount]; cookies
+        without flows are missing).
+        """
+        for cookie in self._stats:
+            flowCount, byteCount = counters.get(cookie, (0, 0))
+            self.aggregate(cookie, dpid, flowCount, byteCount)
+
+    def aggregate(self, cookie: int, dpid, flowCount: int, byteCount: int):
+        """
+        Updates the counters with the live values from the switch `dpid` (sum of the flows of this cookie).
+        """
+        stats, edge = self._stats.get(cookie, (None, None))
+        if not stats:
+            return
+
+        curTime = time()
+        aggregates = self._aggregates.setdefault(cookie, {})
+        prev = aggregates.get(dpid)
+
+        rate = 0
+        if prev and curTime > prev[3]:
+            rate = max(0, byteCount - prev[1]) / (curTime - prev[3])  # removed flows may reduce the byteCount
+        aggregates[dpid] = (flowCount, byteCount, rate, curTime)
+
+        # the switches know best: resync the number of active flows (FlowRemoved messages might be missing)
+        #
+        flows = sum(v[0] for v in aggregates.values())
+        edge.stats.activeFlows += flows - stats.activeFlows
+        stats.activeFlows = flows
+
+        rate = sum(v[2] for v in aggregates.values())
+        edge.stats.byteRate += rate - stats.byteRate
+        stats.byteRate = rate
@@ -0,0 +1,102 @@
+# Josef Hammer (josef.hammer@aau.at)
+#
+"""
+Network topology between the switches.
+"""
+
+from __future__ import annotations
+
+from util.RyuDPID import DPID
+
+from collections import defaultdict
+import heapq
+
+
+class Topology(object):
+    """
+    Links between switches with a cost each (e.g., the latency in ms). Provides the lowest-cost paths between switches.
+
+    Config: [{"switches": ["1", "2"], "ports": [3, 4], "cost": 5}, ...]
+    (`ports`: the port of each switch that the link is attached to; `cost` defaults to 1)
+    """
+
+    def __init__(self, links: list = None):
+
+        self._links = defaultdict(dict)  # dpid -> {neighborDpid -> (outport, cost)}
+        self._paths = {}  # srcDpid -> {dstDpid -> (cost, prevDpid)} (cache)
+
+        for link in links or []:
+            (dpid1, dpid2), (port1, port2) = link["switches"], link["ports"]
+            self.addLink(DPID(dpid1), port1, DPID(dpid2), port2, link.get("cost", 1))
+
+    def addLink(self, dpid1: DPID, port1: int, dpid2: DPID, port2: int, cost=1):
+
+        self._links[dpid1][dpid2] = (port1, cost)
+        self._links[dpid2][dpid1] = (port2, cost)
+        self._paths = {}  # invalidate cache
+
+    def cost(self, src: DPID, dst: DPID):
+        """
+        Returns the cost of the lowest-cost path (0 for src == dst); None if dst is not reachable.
+        """
+        if src == dst:
+            return 0
+
+        path = self._shortestPaths(src).get(dst)
+        return None if path is None else path[0]
+
+    def path(self, src: DPID, dst: DPID) -> list[tuple[DPID, int]]:
+        """
+        Returns the hops [(dpid, outport), ...] from src to dst (excluding dst itself); None if not reachable.
+        """
+        paths = self._shortestPaths(src)
+        if src != dst and dst not in paths:
+            return None
+
+        hops = []
+        cur = dst
+        while cur != src:
+            prev = paths[cur][1]
+            hops.append((prev, self._links[prev][cur][0]))
+            cur = prev
+        hops.reverse()
+        return hops
+
+    def nextPort(self, src: DPID, dst: DPID) -> int:
+        """
+        Returns the outport at src towards dst; None if src == dst or dst is not reachable.
+        """
+        hops = self.path(src, dst)
+        return hops[0][1] if hops else None
+
+    def _shortestPaths(self, src: DPID) -> dict:
+        #
+        # Dijkstra (the number of switches is small; results are cached until the topology changes)
+        #
+        paths = self._paths.get(src)
+        if paths is not None:
+            return paths
+
+        paths = {}
+        visited = set()
+        queue = [(0, 0, src, None)]  # (cost, counter, dpid, prev); counter: DPIDs are not comparable
+        counter = 1
+
+        while queue:
+            cost, _, dpid, prev = heapq.heappop(queue)
+            if dpid in visited:
+                continue
+            visited.add(dpid)
+            if prev is not None:
+                paths[dpid] = (cost, prev)
+
+            for neighbor, (_, linkCost) in self._links[dpid].items():
+                if neighbor not in visited:
+                    heapq.heappush(queue, (cost + linkCost, counter, neighbor, dpid))
+                    counter += 1
+
+        self._paths[src] = paths
+        return paths
+
+    def __len__(self):
+        return len(self._links)